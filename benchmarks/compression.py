@@ -0,0 +1,178 @@
+"""Benchmark the compression of closed audit log segments.
+
+Writes synthetic audit logs to uncompressed segments, then compresses copies
+of them with each available codec and reports the compression ratio, the
+compression and full-scan throughput and the latency of a request ID lookup.
+zstd is measured when the optional `zstandard` package is installed.
+
+Usage::
+
+    python benchmarks/compression.py
+    python benchmarks/compression.py --logs 200000 --level 9
+"""
+import argparse
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+from datetime import datetime
+from datetime import timedelta
+from typing import List
+from typing import Optional
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Run against the checkout when the package is not installed.
+sys.path.insert(0, os.path.join(ROOT, 'src'))
+
+from flask_auditor import attributes  # noqa: E402
+from flask_auditor.sinks import SegmentedLogReader  # noqa: E402
+from flask_auditor.sinks import SegmentedLogSink  # noqa: E402
+from flask_auditor.sinks.codecs import CODECS  # noqa: E402
+from flask_auditor.sinks.segment import SEGMENT_SUFFIX  # noqa: E402
+from flask_auditor.sinks.segment import compress_segment  # noqa: E402
+
+ACTIONS = ('GET_USER', 'LIST_USERS', 'CREATE_USER', 'UPDATE_USER', 'LOGIN')
+AGENTS = ('Mozilla/5.0 (X11; Linux x86_64) Firefox/126.0',
+          'Mozilla/5.0 (Macintosh; Intel Mac OS X 14_5) Safari/605.1.15',
+          'python-requests/2.32.3')
+
+
+def make_log(rnd: random.Random, i: int, started: datetime) -> dict:
+    """Return a synthetic audit log."""
+    action_id = rnd.choice(ACTIONS)
+    user_id = rnd.randint(1, 100000)
+    return {
+        attributes.SOURCE_NAME: 'benchmark',
+        attributes.START_TIME: (started + timedelta(milliseconds=i * 10)
+                                ).strftime('%Y-%m-%d %H:%M:%S'),
+        attributes.ACTION_ID: action_id,
+        attributes.ACTION_DESCRIPTION: action_id.replace('_', ' ').lower(),
+        attributes.REQUEST: {
+            attributes.SERVER_HOST: '10.0.0.12',
+            attributes.SERVER_PORT: '8080',
+            attributes.REQUEST_ID: f'{rnd.getrandbits(128):032x}',
+            attributes.REQUEST_REMOTE_IP: f'192.168.{rnd.randint(0, 255)}.'
+                                          f'{rnd.randint(1, 254)}',
+            attributes.REQUEST_REMOTE_PORT: rnd.randint(1024, 65535),
+            attributes.REQUEST_PROTOCOL: 'HTTP/1.1',
+            attributes.REQUEST_METHOD: 'POST' if 'USER' in action_id
+                                       and action_id != 'GET_USER' else 'GET',
+            attributes.REQUEST_URI_PATH: f'/api/v1/users/{user_id}',
+            attributes.REQUEST_USER_AGENT: rnd.choice(AGENTS),
+            attributes.REQUEST_HEADERS: {'Content-Type': 'application/json'},
+            attributes.REQUEST_BODY: {'name': f'user-{user_id}'},
+        },
+        attributes.RESPONSE: {
+            attributes.RESPONSE_STATUS_CODE: rnd.choice((200, 200, 201, 400)),
+            attributes.RESPONSE_SIZE: rnd.randint(40, 4000),
+        },
+        attributes.LATENCY: round(rnd.random() / 100, 5),
+    }
+
+
+def write_segments(directory: str, logs: int, segment_bytes: int,
+                   seed: int) -> List[str]:
+    """Write uncompressed segments and return their request IDs."""
+    rnd = random.Random(seed)
+    started = datetime(2024, 5, 22)
+    sink = SegmentedLogSink(directory, max_segment_bytes=segment_bytes,
+                            compression=None)
+    request_ids = []
+    batch = []
+    for i in range(logs):
+        audit_log = make_log(rnd, i, started)
+        req = audit_log[attributes.REQUEST]
+        request_ids.append(req[attributes.REQUEST_ID])
+        batch.append(audit_log)
+        if len(batch) == 1000 or i == logs - 1:
+            # Written directly, the queue of the sink would drop logs.
+            sink.write_batch(batch)
+            batch = []
+
+    sink.close()
+    return request_ids
+
+
+def measure(directory: str, codec_name: Optional[str],
+            level: Optional[int], request_ids: List[str],
+            lookups: int) -> dict:
+    """Compress a copy of the segments and measure reads."""
+    size_in = size_out = 0
+    compress_seconds = 0.0
+    if codec_name is not None:
+        codec = CODECS[codec_name]
+        for segment in SegmentedLogReader(directory).segments():
+            started = time.perf_counter()
+            sizes = compress_segment(segment.base, codec, level)
+            compress_seconds += time.perf_counter() - started
+            size_in += sizes[0]
+            size_out += sizes[1]
+    else:
+        for name in os.listdir(directory):
+            if name.endswith(SEGMENT_SUFFIX):
+                size_in += os.path.getsize(os.path.join(directory, name))
+        size_out = size_in
+
+    reader = SegmentedLogReader(directory)
+    started = time.perf_counter()
+    scanned = sum(1 for _ in reader.iter_logs())
+    scan_seconds = time.perf_counter() - started
+
+    rnd = random.Random(0)
+    started = time.perf_counter()
+    for _ in range(lookups):
+        assert reader.query(request_id=rnd.choice(request_ids))
+    lookup_seconds = time.perf_counter() - started
+
+    mb_in = size_in / 2 ** 20
+    return {
+        'codec': codec_name or 'none',
+        'logs': scanned,
+        'size_mb': size_out / 2 ** 20,
+        'ratio': size_in / size_out if size_out else 0.0,
+        'compress_mb_s': mb_in / compress_seconds if compress_seconds else 0,
+        'scan_mb_s': mb_in / scan_seconds,
+        'lookup_ms': lookup_seconds / lookups * 1000,
+    }
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--logs', type=int, default=50000)
+    parser.add_argument('--segment-bytes', type=int, default=8 * 2 ** 20)
+    parser.add_argument('--level', type=int,
+                        help='Compression level, the codec default if not '
+                             'set.')
+    parser.add_argument('--lookups', type=int, default=200)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+
+    tmpdir = tempfile.mkdtemp(prefix='flask-auditor-compression-')
+    try:
+        source = os.path.join(tmpdir, 'source')
+        request_ids = write_segments(source, args.logs, args.segment_bytes,
+                                     args.seed)
+        rows = []
+        for codec_name in [None] + sorted(CODECS):
+            directory = os.path.join(tmpdir, codec_name or 'none')
+            shutil.copytree(source, directory)
+            rows.append(measure(directory, codec_name, args.level,
+                                request_ids, args.lookups))
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+    header = (f'{"codec":<8}{"logs":>9}{"size MB":>10}{"ratio":>8}'
+              f'{"compress MB/s":>15}{"scan MB/s":>11}{"lookup ms":>11}')
+    print(header)
+    print('-' * len(header))
+    for r in rows:
+        print(f'{r["codec"]:<8}{r["logs"]:>9}{r["size_mb"]:>10.2f}'
+              f'{r["ratio"]:>8.2f}{r["compress_mb_s"]:>15.1f}'
+              f'{r["scan_mb_s"]:>11.1f}{r["lookup_ms"]:>11.3f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,440 @@
+"""End-to-end load harness measuring the overhead of the auditor.
+
+The harness serves one of the apps of `examples/` on the loopback interface,
+drives it with a mix of GET and JSON POST requests from local client
+processes and reports the throughput, the p50/p99/p999 latency and the peak
+RSS of the server processes. Each worker model is measured with auditing
+off, with the default log handler and with each built-in sink. Sinks
+delivering over the network write to local drain servers, so the harness
+runs offline on a single Linux box.
+
+Worker models:
+    threaded: A single process serving each request in a new thread.
+    prefork: The app is loaded once, then `--workers` single-threaded
+             processes are forked and accept on the same socket, as a
+             preloaded gunicorn app does.
+
+Usage::
+
+    python benchmarks/load_harness.py
+    python benchmarks/load_harness.py --models prefork --audit off sqlite \\
+        --duration 30 --clients 16 --body-sizes 256 16384
+"""
+import argparse
+import http.client
+import importlib.util
+import json
+import math
+import multiprocessing
+import os
+import random
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer
+from socketserver import StreamRequestHandler
+from socketserver import ThreadingTCPServer
+from typing import Dict
+from typing import List
+from typing import Optional
+from typing import Tuple
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+EXAMPLES_DIR = os.path.join(ROOT, 'examples')
+
+MODELS = ('threaded', 'prefork')
+AUDIT_MODES = ('off', 'default', 'socket', 'http', 'sqlite', 'segment')
+SINK_MODES = ('socket', 'http', 'sqlite', 'segment')
+
+# Run against the checkout when the package is not installed.
+sys.path.insert(0, os.path.join(ROOT, 'src'))
+
+
+def load_example(name: str):
+    """Import an example app by file name, i.e, `function_based_view`."""
+    path = os.path.join(EXAMPLES_DIR, f'{name}.py')
+    spec = importlib.util.spec_from_file_location(f'example_{name}', path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def make_sink(audit: str, target: str):
+    """Create the built-in sink measured by the given audit mode."""
+    from flask_auditor import sinks
+
+    if audit == 'socket':
+        host, port = target.rsplit(':', 1)
+        return sinks.SocketSink((host, int(port)))
+
+    if audit == 'http':
+        return sinks.HTTPSink(target)
+
+    if audit == 'sqlite':
+        return sinks.SQLiteSink(target)
+
+    if audit == 'segment':
+        return sinks.SegmentedLogSink(target)
+
+    raise ValueError(f'Unknown sink: {audit}.')
+
+
+def serve(args: argparse.Namespace) -> None:
+    """Serve an example app until the process group is terminated."""
+    from werkzeug.serving import WSGIRequestHandler
+    from werkzeug.serving import make_server
+
+    class QuietRequestHandler(WSGIRequestHandler):
+        def log_request(self, *args, **kwargs) -> None:
+            pass
+
+    if args.audit == 'off':
+        # Read by `app.config.from_prefixed_env()` in the examples.
+        os.environ['FLASK_AUDIT_LOGGER_SKIP'] = 'true'
+
+    module = load_example(args.example)
+    if args.audit in SINK_MODES:
+        module.auditor.register_log_handler(
+            make_sink(args.audit, args.target))
+
+    server = make_server('127.0.0.1', args.port, module.app,
+                         threaded=args.model == 'threaded',
+                         request_handler=QuietRequestHandler)
+    if args.model == 'threaded':
+        server.serve_forever()
+        return
+
+    for _ in range(args.workers):
+        if os.fork() == 0:
+            server.serve_forever()
+            os._exit(0)
+
+    while True:
+        signal.pause()
+
+
+class _DrainHandler(StreamRequestHandler):
+    """Read and discard a stream of audit logs."""
+
+    def handle(self) -> None:
+        while self.rfile.read1(65536):
+            pass
+
+
+class _CollectorHandler(BaseHTTPRequestHandler):
+    """Accept and discard batches posted by `HTTPSink`."""
+
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self) -> None:  # noqa
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        self.send_response(204)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, *args) -> None:
+        pass
+
+
+class Target:
+    """The drain server or the storage written by a sink."""
+
+    def __init__(self, audit: str) -> None:
+        self.address: Optional[str] = None
+        self._server = None
+        self._tmpdir = None
+        if audit == 'socket':
+            ThreadingTCPServer.daemon_threads = True
+            self._server = ThreadingTCPServer(('127.0.0.1', 0), _DrainHandler)
+            host, port = self._server.server_address
+            self.address = f'{host}:{port}'
+        elif audit == 'http':
+            self._server = ThreadingHTTPServer(('127.0.0.1', 0),
+                                               _CollectorHandler)
+            self._server.daemon_threads = True
+            host, port = self._server.server_address
+            self.address = f'http://{host}:{port}/logs'
+        elif audit in ('sqlite', 'segment'):
+            self._tmpdir = tempfile.mkdtemp(prefix='flask-auditor-load-')
+            self.address = os.path.join(
+                self._tmpdir, 'audit.db' if audit == 'sqlite' else 'segments')
+
+        if self._server is not None:
+            threading.Thread(target=self._server.serve_forever,
+                             daemon=True).start()
+
+    def close(self) -> None:
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+
+        if self._tmpdir is not None:
+            shutil.rmtree(self._tmpdir, ignore_errors=True)
+
+
+def free_port() -> int:
+    """Return a free TCP port of the loopback interface."""
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def wait_ready(proc: subprocess.Popen, port: int,
+               timeout: float = 15.0) -> None:
+    """Wait until the server accepts connections."""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f'Server exited with code {proc.returncode}.')
+
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=0.5):
+                return
+        except OSError:
+            time.sleep(0.05)
+
+    raise RuntimeError('Server did not start in time.')
+
+
+def process_tree_rss(pid: int) -> int:
+    """Return the RSS in bytes of a process and its descendants, read from
+    `/proc`."""
+    children: Dict[int, List[int]] = {}
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+
+        try:
+            with open(f'/proc/{entry}/stat') as f:
+                stat = f.read()
+        except OSError:
+            continue
+
+        # The command name may contain spaces, fields follow its last ')'.
+        ppid = int(stat.rpartition(')')[2].split()[1])
+        children.setdefault(ppid, []).append(int(entry))
+
+    total = 0
+    stack = [pid]
+    while stack:
+        current = stack.pop()
+        stack.extend(children.get(current, ()))
+        try:
+            with open(f'/proc/{current}/status') as f:
+                for line in f:
+                    if line.startswith('VmRSS:'):
+                        total += int(line.split()[1]) * 1024
+                        break
+        except OSError:
+            continue
+
+    return total
+
+
+class RSSSampler(threading.Thread):
+    """Sample the peak RSS of the server processes in background."""
+
+    def __init__(self, pid: int, interval: float = 0.1) -> None:
+        super().__init__(daemon=True)
+        self.pid = pid
+        self.interval = interval
+        self.peak = 0
+        self._stop_event = threading.Event()
+
+    def run(self) -> None:
+        while not self._stop_event.is_set():
+            self.peak = max(self.peak, process_tree_rss(self.pid))
+            self._stop_event.wait(self.interval)
+
+    def stop(self) -> int:
+        self._stop_event.set()
+        self.join()
+        return self.peak
+
+
+def run_client(port: int, seed: int, warmup: float, duration: float,
+               post_ratio: float, body_sizes: List[int]
+               ) -> Tuple[List[float], int]:
+    """Send requests in a closed loop, one connection per request.
+
+    Return:
+        A tuple of the latencies in seconds of the requests sent after the
+        warmup and the number of failed requests.
+    """
+    rnd = random.Random(seed)
+    bodies = [json.dumps({'name': 'Makai', 'bio': 'x' * size}).encode()
+              for size in body_sizes]
+    latencies = []
+    errors = 0
+    measure_from = time.perf_counter() + warmup
+    end = measure_from + duration
+    while True:
+        started = time.perf_counter()
+        if started >= end:
+            break
+
+        if rnd.random() < post_ratio:
+            method, path = 'POST', '/api/v1/users'
+            body = rnd.choice(bodies)
+            headers = {'Content-Type': 'application/json'}
+        else:
+            method, path = 'GET', rnd.choice(
+                ('/api/v1/users', f'/api/v1/users/{rnd.randint(1, 1000)}'))
+            body, headers = None, {}
+
+        try:
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+            conn.request(method, path, body, headers)
+            resp = conn.getresponse()
+            resp.read()
+            conn.close()
+            failed = resp.status >= 500
+        except OSError:
+            failed = True
+
+        if started < measure_from:
+            continue
+
+        if failed:
+            errors += 1
+        else:
+            latencies.append(time.perf_counter() - started)
+
+    return latencies, errors
+
+
+def percentile(values: List[float], q: float) -> float:
+    """Return the nearest-rank percentile of sorted values."""
+    if not values:
+        return math.nan
+
+    return values[max(0, math.ceil(q * len(values)) - 1)]
+
+
+def measure(args: argparse.Namespace, model: str, audit: str) -> dict:
+    """Serve an example app with the given settings and load it."""
+    target = Target(audit)
+    port = free_port()
+    cmd = [sys.executable, os.path.abspath(__file__), 'serve',
+           '--example', args.example, '--model', model,
+           '--workers', str(args.workers), '--audit', audit,
+           '--port', str(port)]
+    if target.address:
+        cmd += ['--target', target.address]
+
+    # The default handler logs to stderr, the cost of formatting is kept.
+    proc = subprocess.Popen(cmd, stdout=subprocess.DEVNULL,
+                            stderr=subprocess.DEVNULL,
+                            start_new_session=True)
+    try:
+        wait_ready(proc, port)
+        sampler = RSSSampler(proc.pid)
+        sampler.start()
+        ctx = multiprocessing.get_context('spawn')
+        with ctx.Pool(args.clients) as pool:
+            results = pool.starmap(run_client, [
+                (port, args.seed + i, args.warmup, args.duration,
+                 args.post_ratio, args.body_sizes)
+                for i in range(args.clients)])
+        peak_rss = sampler.stop()
+    finally:
+        os.killpg(proc.pid, signal.SIGTERM)
+        proc.wait()
+        target.close()
+
+    latencies = sorted(x for lat, _ in results for x in lat)
+    return {
+        'model': model,
+        'audit': audit,
+        'requests': len(latencies),
+        'errors': sum(errors for _, errors in results),
+        'throughput': len(latencies) / args.duration,
+        'p50_ms': percentile(latencies, 0.50) * 1000,
+        'p99_ms': percentile(latencies, 0.99) * 1000,
+        'p999_ms': percentile(latencies, 0.999) * 1000,
+        'peak_rss_mb': peak_rss / 2 ** 20,
+    }
+
+
+def print_table(rows: List[dict]) -> None:
+    """Print results with the overhead relative to auditing off."""
+    header = (f'{"model":<10}{"audit":<10}{"req/s":>10}{"vs off":>9}'
+              f'{"p50 ms":>9}{"p99 ms":>9}{"p999 ms":>9}{"RSS MB":>9}'
+              f'{"errors":>8}')
+    print(header)
+    print('-' * len(header))
+    baseline = {r['model']: r['throughput'] for r in rows
+                if r['audit'] == 'off'}
+    for r in rows:
+        base = baseline.get(r['model'])
+        ratio = f'{r["throughput"] / base:8.0%}' if base else f'{"-":>8}'
+        print(f'{r["model"]:<10}{r["audit"]:<10}{r["throughput"]:>10.1f}'
+              f' {ratio}{r["p50_ms"]:>9.2f}{r["p99_ms"]:>9.2f}'
+              f'{r["p999_ms"]:>9.2f}{r["peak_rss_mb"]:>9.1f}'
+              f'{r["errors"]:>8}')
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    subparsers = parser.add_subparsers(dest='command')
+
+    srv = subparsers.add_parser('serve', help='Serve an example app.')
+    srv.add_argument('--example', default='function_based_view')
+    srv.add_argument('--model', choices=MODELS, default='threaded')
+    srv.add_argument('--workers', type=int, default=4)
+    srv.add_argument('--audit', choices=AUDIT_MODES, default='default')
+    srv.add_argument('--port', type=int, required=True)
+    srv.add_argument('--target')
+
+    parser.add_argument('--example', default='function_based_view',
+                        help='Example app, a file name of examples/.')
+    parser.add_argument('--models', nargs='+', choices=MODELS,
+                        default=list(MODELS))
+    parser.add_argument('--audit', nargs='+', choices=AUDIT_MODES,
+                        default=list(AUDIT_MODES))
+    parser.add_argument('--workers', type=int, default=4,
+                        help='Processes of the prefork model.')
+    parser.add_argument('--clients', type=int, default=8,
+                        help='Concurrent client processes.')
+    parser.add_argument('--duration', type=float, default=10.0,
+                        help='Measured seconds of each run.')
+    parser.add_argument('--warmup', type=float, default=2.0,
+                        help='Seconds before measuring.')
+    parser.add_argument('--post-ratio', type=float, default=0.3,
+                        help='Share of JSON POST requests.')
+    parser.add_argument('--body-sizes', type=int, nargs='+',
+                        default=[128, 4096, 65536],
+                        help='Padding in bytes of the POST bodies.')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', dest='json_path',
+                        help='Also write the results to a JSON file.')
+    return parser
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    args = build_parser().parse_args(argv)
+    if args.command == 'serve':
+        serve(args)
+        return
+
+    rows = []
+    for model in args.models:
+        for audit in args.audit:
+            rows.append(measure(args, model, audit))
+            print(f'{model}/{audit}: {rows[-1]["throughput"]:.1f} req/s',
+                  file=sys.stderr)
+
+    print_table(rows)
+    if args.json_path:
+        with open(args.json_path, 'w') as f:
+            json.dump(rows, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -7,6 +7,8 @@ from flask_auditor import FlaskAuditor
 
 app = Flask(__name__)
 app.config['AUDIT_LOGGER_SOURCE_NAME'] = 'classBasedViewExample'
+# i.e, FLASK_AUDIT_LOGGER_SKIP=true disables the auditor.
+app.config.from_prefixed_env()
 auditor = FlaskAuditor(app)
 
 
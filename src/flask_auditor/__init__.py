@@ -1,17 +1,44 @@
 """A Flask extension to extract audit logs."""
 import logging
+import random
+import time
 from datetime import datetime
-from threading import Thread
+from threading import Lock
 from typing import Callable
+from typing import Dict
+from typing import Iterable
+from typing import List
 from typing import Optional
+from typing import Tuple
 
 import flask
 
-from . import attributes
+from . import forksafe
+from .aio import EventLoopThread
+from .aio import is_async_callable
+from .action import PRIORITY_HIGH
+from .action import PRIORITY_LOW
+from .action import PRIORITY_NORMAL
+from .action import AuditAction
+from .action import AuditRule
+from .budget import MemoryBudget
+from .budget import estimate_request_size
+from .budget import estimate_response_size
 from .config import AuditLoggerConfig
+from .dispatcher import Dispatcher
+from .metrics import Metrics
+from .record import AuditRecord
+from .record import accepts_records
+from .record import handler_input
+from .request import BODY_DROPPED
 from .request import RequestLogger
 from .response import ResponseLogger
 
+logger = logging.getLogger('flask_auditor')
+
+# Cached properties of `flask.Request` holding parsed request data.
+_PARSED_REQUEST_ATTRIBUTES = ('args', 'form', 'files')
+
 
 class FlaskAuditor:
     """Flask extension to extract audit logs."""
@@ -23,12 +50,26 @@ class FlaskAuditor:
             app: Instance of the Flask application.
         """
         self._views = {}
+        self._rules: List[AuditRule] = []
+        # Lookup table of `endpoint -> method -> action`, compiled from the
+        # decorated views and the rules when the first request is audited.
+        self._endpoints: Optional[Dict[str, Dict[str, AuditAction]]] = None
+        self._endpoints_lock = Lock()
         self._hook: Optional[Callable] = None
+        self._deferred_hook: Optional[Callable] = None
+        self._captures: Dict[str, Callable] = {}
         self._log_handlers = set()
+        self._async_log_handlers = set()
         self._cfg: Optional[AuditLoggerConfig] = None
         self.app: Optional[flask.Flask] = None
         self.request_logger: Optional[RequestLogger] = None
         self.response_logger: Optional[ResponseLogger] = None
+        self.metrics = Metrics()
+        self._budget = MemoryBudget()
+        self._event_loop = EventLoopThread()
+        # Queues and workers of the audit events by priority.
+        self._lanes = self._create_lanes(AuditLoggerConfig())
+        forksafe.register(self)
         if app:
             self.init_app(app)
 
@@ -54,97 +95,367 @@ class FlaskAuditor:
         self.request_logger = RequestLogger(self._cfg)
         self.response_logger = ResponseLogger(self._cfg)
         self.app = app
+        self._budget.limit = self._cfg.memory_budget or None
+        self._event_loop.concurrency = self._cfg.async_concurrency
+        self._lanes = self._create_lanes(self._cfg)
+        self.metrics.gauge('async_pending', lambda: self._event_loop.pending)
+        self.metrics.gauge('workers', lambda: sum(
+            lane.workers for lane in self._lanes.values()))
+        self.metrics.gauge('queue_depth', lambda: sum(
+            lane.depth for lane in self._lanes.values()))
+        self.metrics.gauge('handler_latency_ms', lambda: max(
+            lane.latency for lane in self._lanes.values()) * 1000)
+        for name, lane in self._lanes.items():
+            self.metrics.gauge(f'workers.{name}', lambda x=lane: x.workers)
+            self.metrics.gauge(f'queue_depth.{name}', lambda x=lane: x.depth)
+        self.metrics.gauge('memory_in_flight_bytes', lambda: self._budget.used)
+        self.metrics.gauge('memory_budget_bytes',
+                           lambda: self._budget.limit or 0)
+        for action in self._views.values():
+            self._compile_action(action)
+
+        for rule in self._rules:
+            self._compile_action(rule.action)
 
         @app.after_request
         def after_request(resp: flask.Response) -> flask.Response:
-            endpoint = flask.request.endpoint
-            if not endpoint or endpoint not in app.view_functions:
+            # Servers forking without the at-fork hooks are detected by pid.
+            forksafe.check()
+            endpoints = self._endpoints
+            if endpoints is None:
+                endpoints = self._compile_endpoints()
+
+            actions = endpoints.get(flask.request.endpoint)
+            if not actions:
                 return resp
 
-            view = app.view_functions[endpoint]
-            if hasattr(view, 'view_class'):
-                view = view.view_class
-
-            view_location = '.'.join((view.__module__, view.__qualname__))
-            method = flask.request.method.lower()
-            if f'{view_location}.{method}' in self._views:
-                kwargs = self._views.get(f'{view_location}.{method}')
-            elif view_location in self._views:
-                kwargs = self._views.get(view_location)
-            else:
+            action = actions.get(flask.request.method)
+            if action is None:
                 return resp
 
+            extra = None
             if self._hook:
                 extra = self._hook(flask.request, resp)
-                if extra and isinstance(extra, dict):
-                    kwargs['extra'] = extra
-
-            thr = Thread(
-                target=self._extract,
-                args=(self._clone_current_request(), resp),
-                kwargs=kwargs)
-            thr.start()
+
+            captured = {
+                name: getter() for name, getter in self._captures.items()}
+            if action.sync:
+                try:
+                    self._extract(flask.request._get_current_object(), resp,
+                                  action, extra, captured)
+                except Exception:  # noqa
+                    # The view succeeded, its response is returned anyway.
+                    self.metrics.incr('events_sync_failed')
+                    logger.exception('Failed to extract the audit log of %s.',
+                                     action.action_id)
+                return resp
+
+            with_body, size = self._reserve_memory(resp, action.priority)
+            if size is None:
+                return resp
+
+            args = (size, self._clone_current_request(with_body), resp,
+                    action, extra, captured)
+            if self._lanes[action.priority].submit(self._process, *args):
+                if not with_body:
+                    self.metrics.incr('events_body_dropped')
+                return resp
+
+            if action.priority == PRIORITY_HIGH:
+                # High priority events are never dropped.
+                self._process(*args)
+            else:
+                self.metrics.incr('events_dropped')
+                self._budget.release(size)
             return resp
 
-    def log(self, action_id, description: Optional[str] = None):
+    def log(self, action_id, description: Optional[str] = None,
+            include: Optional[Iterable[str]] = None,
+            exclude: Optional[Iterable[str]] = None,
+            headers: Optional[tuple] = None,
+            sensitive_parameters: Optional[tuple] = None,
+            priority: str = PRIORITY_NORMAL,
+            sync: bool = False):
         """A decorator to extract audit logs.
 
+        The fields extracted for the action default to the global config, the
+        other arguments override them for this action only. The extraction
+        plan is compiled once, when the action is registered.
+
+        Events of each priority are served by their own queue and workers.
+        High priority events are exempt from the memory budget and never
+        dropped; low priority events are dropped first under overload.
+
         Args:
             action_id: Unique identifier for the action.
             description: A description of the action.
+            include: Fields to extract, see `AuditLoggerConfig.fields`.
+            exclude: Fields not to extract.
+            headers: Request headers to extract.
+            sensitive_parameters: Parameters removed from the request body.
+            priority: `high`, `normal` or `low`.
+            sync: Set to true to extract and write audit logs before the
+                  response is returned. Sinks write them directly instead of
+                  queuing them.
         """
+        action = AuditAction(action_id, description, include=include,
+                             exclude=exclude, headers=headers,
+                             sensitive_parameters=sensitive_parameters,
+                             priority=priority, sync=sync)
+        if self._cfg is not None:
+            # Raise on invalid fields when the view is decorated.
+            self._compile_action(action)
 
         def wrapper(view):
             view_location = '.'.join((view.__module__, view.__qualname__))
-            self._views[view_location] = {
-                'action_id': action_id,
-                'description': description
-            }
+            self._views[view_location] = action
+            self._endpoints = None
             return view
 
         return wrapper
 
+    def register_rule(self, action_id: str,
+                      description: Optional[str] = None,
+                      blueprint: Optional[str] = None,
+                      endpoint: Optional[str] = None,
+                      rule: Optional[str] = None,
+                      methods: Optional[Iterable[str]] = None,
+                      **kwargs) -> None:
+        """Audit all views matching a blueprint, an endpoint or a URL rule.
+
+        Rules are compiled into a per-endpoint lookup table when the first
+        request is audited, so matching a request does not depend on the
+        number of rules. Views decorated with `log` take precedence, then the
+        first registered matching rule applies.
+
+        Args:
+            action_id: Unique identifier for the action.
+            description: A description of the action.
+            blueprint: Name of the blueprint, nested blueprints match too.
+            endpoint: Glob pattern of the endpoint, i.e, `admin.*`.
+            rule: Glob pattern of the URL rule, i.e, `/api/v1/admin/*`.
+            methods: HTTP methods, all methods of the URL rule by default.
+            kwargs: Field options of the action, see `log`.
+        """
+        action = AuditAction(action_id, description, **kwargs)
+        if self._cfg is not None:
+            self._compile_action(action)
+
+        self._rules.append(AuditRule(action, blueprint=blueprint,
+                                     endpoint=endpoint, rule=rule,
+                                     methods=methods))
+        self._endpoints = None
+
+    def _after_fork(self) -> None:
+        """Reset locks inherited from the parent process."""
+        self._endpoints_lock = Lock()
+
+    def _compile_endpoints(self) -> Dict[str, Dict[str, AuditAction]]:
+        """Compile decorated views and rules into the lookup table of
+        audited actions by endpoint and method."""
+        with self._endpoints_lock:
+            if self._endpoints is not None:
+                return self._endpoints
+
+            endpoints = {}
+            for url_rule in self.app.url_map.iter_rules():
+                view = self.app.view_functions.get(url_rule.endpoint)
+                if view is None:
+                    continue
+
+                actions = endpoints.setdefault(url_rule.endpoint, {})
+                for rule in self._rules:
+                    if rule.matches(url_rule):
+                        for method in rule.match_methods(url_rule):
+                            actions.setdefault(method, rule.action)
+
+                view = getattr(view, 'view_class', view)
+                view_location = '.'.join((view.__module__, view.__qualname__))
+                for method in url_rule.methods or ():
+                    action = self._views.get(
+                        f'{view_location}.{method.lower()}',
+                        self._views.get(view_location))
+                    if action is not None:
+                        actions[method] = action
+
+            self._endpoints = {k: v for k, v in endpoints.items() if v}
+            return self._endpoints
+
+    def _create_lanes(self, cfg: AuditLoggerConfig) -> Dict[str, Dispatcher]:
+        """Create the queue and the workers of each priority."""
+        options = dict(scale_up_wait=cfg.scale_up_wait,
+                       idle_timeout=cfg.worker_idle_timeout,
+                       metrics=self.metrics)
+        return {
+            PRIORITY_HIGH: Dispatcher(
+                min_workers=1, max_workers=cfg.high_priority_workers,
+                max_queue_size=cfg.queue_size, name=PRIORITY_HIGH,
+                **options),
+            PRIORITY_NORMAL: Dispatcher(
+                min_workers=cfg.min_workers, max_workers=cfg.max_workers,
+                max_queue_size=cfg.queue_size, **options),
+            PRIORITY_LOW: Dispatcher(
+                min_workers=1, max_workers=cfg.low_priority_workers,
+                max_queue_size=cfg.low_priority_queue_size,
+                name=PRIORITY_LOW, **options),
+        }
+
+    def _compile_action(self, action: AuditAction) -> None:
+        """Compile the extraction plan of an action."""
+        action.compile(self._cfg, self.request_logger, self.response_logger)
+
+    def _reserve_memory(self, resp: flask.Response,
+                        priority: str = PRIORITY_NORMAL
+                        ) -> Tuple[bool, Optional[int]]:
+        """Reserve the memory budget for the current audit event.
+
+        Over budget, the request body is dropped first, then only a sample
+        of the events is kept. High priority events are always kept whole,
+        low priority events are not sampled.
+
+        Args:
+            resp: Flask response object.
+            priority: Priority of the audited action.
+
+        Return:
+            A tuple of `(with_body, size)`, the size is `None` when the event
+            must be dropped.
+        """
+        resp_size = estimate_response_size(resp)
+        size = estimate_request_size(flask.request) + resp_size
+        if priority == PRIORITY_HIGH:
+            self._budget.acquire(size)
+            return True, size
+
+        if self._budget.try_acquire(size):
+            return True, size
+
+        size = estimate_request_size(flask.request, with_body=False)
+        size += resp_size
+        if self._budget.try_acquire(size):
+            return False, size
+
+        if (priority == PRIORITY_LOW
+                or random.random() >= self._cfg.memory_sample_rate):
+            self.metrics.incr('events_dropped')
+            return False, None
+
+        self.metrics.incr('events_sampled')
+        self._budget.acquire(size)
+        return False, size
+
+    def _process(self, size: int, *args) -> None:
+        """Extract an audit event in background and release its memory
+        budget."""
+        try:
+            self._extract(*args)
+        finally:
+            self._budget.release(size)
+
     def _extract(self, flask_req: flask.Request,
-                 flask_resp: flask.Response, action_id: str,
-                 description: str, extra: Optional[dict] = None) -> dict:
+                 flask_resp: flask.Response, action: AuditAction,
+                 extra: Optional[dict] = None,
+                 captured: Optional[dict] = None) -> AuditRecord:
         """Extract Flask request and response to audit log.
 
         Args:
             flask_req: Flask request object.
             flask_resp: Flask response object.
-            action_id: Unique identifier of the action.
-            description: A description of the action.
+            action: The audited action.
             extra: Extra information to include in audit log.
+            captured: Request-local values captured for the deferred hook.
         """
+        cfg = action.cfg
         now = datetime.now()
-        audit_log = {
-            attributes.SOURCE_NAME: self._cfg.source_name,
-            attributes.START_TIME: now.strftime(self._cfg.datetime_format),
-            attributes.ACTION_ID: action_id,
-            attributes.ACTION_DESCRIPTION: description,
-            attributes.REQUEST: self.request_logger.extract(flask_req),
-            attributes.RESPONSE: self.response_logger.extract(flask_resp)
-        }
-        if self._cfg.log_latency:
+        audit_log = AuditRecord(
+            source=cfg.source_name,
+            start_time=now.strftime(cfg.datetime_format),
+            action_id=action.action_id,
+            description=action.description,
+            request=action.request_logger.extract_record(flask_req),
+            response=action.response_logger.extract_record(flask_resp))
+        if self._deferred_hook:
+            deferred = self._deferred_hook(flask_req, flask_resp,
+                                           captured or {})
+            if isinstance(deferred, dict):
+                audit_log.update_extra(deferred)
+
+        if cfg.log_latency:
             latency = datetime.now().timestamp() - now.timestamp()
-            audit_log[attributes.LATENCY] = round(latency, 5)
+            audit_log.latency = round(latency, 5)
 
-        if isinstance(extra, dict):
-            audit_log.update(extra)
+        if extra and isinstance(extra, dict):
+            audit_log.update_extra(extra)
 
-        if not self._log_handlers:
+        if not self._log_handlers and not self._async_log_handlers:
             self.default_log_handler(audit_log)
+        elif action.sync:
+            self._deliver_sync(audit_log)
         else:
-            for handler in self._log_handlers:
-                handler(audit_log)
+            # Plain handlers run first, sinks serialize what they changed.
+            for handler in sorted(self._log_handlers, key=accepts_records):
+                handler(handler_input(handler, audit_log))
+            for handler in self._async_log_handlers:
+                self._event_loop.submit(handler,
+                                        handler_input(handler, audit_log))
         return audit_log
 
+    def _deliver_sync(self, audit_log: AuditRecord) -> None:
+        """Pass an audit log to the handlers and wait until it is written.
+
+        Sinks write it directly, async handlers are awaited. Failures are
+        logged and counted, the response is returned anyway.
+        """
+        futures = []
+        for handler in self._async_log_handlers:
+            futures.append((handler, self._event_loop.submit(
+                handler, handler_input(handler, audit_log),
+                raise_errors=True)))
+        for handler in sorted(self._log_handlers, key=accepts_records):
+            try:
+                getattr(handler, 'write', handler)(
+                    handler_input(handler, audit_log))
+            except Exception:  # noqa
+                self.metrics.incr('events_sync_failed')
+                logger.exception('Audit log handler %r failed.', handler)
+
+        for handler, future in futures:
+            try:
+                future.result()
+            except Exception:  # noqa
+                self.metrics.incr('events_sync_failed')
+                logger.exception('Audit log handler %r failed.', handler)
+
     @staticmethod
-    def _clone_current_request() -> flask.Request:
-        """Copy current request to Flask request object."""
-        flask_req = flask.Request(environ=flask.request.environ.copy())
-        flask_req._cached_data = flask.request.get_data()
-        flask_req.url_rule = flask.request.url_rule
+    def _clone_current_request(with_body: bool = True) -> flask.Request:
+        """Copy current request to Flask request object.
+
+        Data the view has already parsed, the JSON body, the form and the
+        query arguments, is shared with the copy so the background thread
+        does not parse it a second time. Anything else is parsed lazily from
+        the copied body, only when an enabled field needs it.
+
+        Args:
+            with_body: Set to false to leave the request body out of the copy.
+        """
+        current = flask.request._get_current_object()
+        flask_req = flask.Request(environ=current.environ.copy())
+        flask_req.url_rule = current.url_rule
+        if not with_body:
+            flask_req.environ[BODY_DROPPED] = True
+            flask_req._cached_data = b''
+            if 'args' in current.__dict__:
+                flask_req.__dict__['args'] = current.__dict__['args']
+            return flask_req
+
+        flask_req._cached_data = current.get_data()
+        if '_cached_json' in current.__dict__:
+            flask_req._cached_json = current._cached_json
+
+        for name in _PARSED_REQUEST_ATTRIBUTES:
+            if name in current.__dict__:
+                flask_req.__dict__[name] = current.__dict__[name]
+
         return flask_req
 
     @property
@@ -160,11 +471,114 @@ class FlaskAuditor:
         return handler
 
     def register_log_handler(self, handler: Callable) -> None:
-        """Register an audit log handler."""
+        """Register an audit log handler.
+
+        Handlers are called with the audit log as a dict. Sinks, and handlers
+        having a true `accepts_records` attribute, receive the `AuditRecord`
+        instead, which serializes the audit log once for all of them.
+
+        Handlers defined with `async def` run on a background event loop
+        owned by the auditor, at most `AUDIT_LOGGER_ASYNC_CONCURRENCY` calls
+        at once, instead of in the thread extracting the audit log.
+        """
         if not isinstance(handler, Callable):
             raise TypeError("Handler must be callable.")
 
-        self._log_handlers.add(handler)
+        if is_async_callable(handler):
+            self._async_log_handlers.add(handler)
+        else:
+            self._log_handlers.add(handler)
+
+    def deliver(self, batch: List[dict]) -> None:
+        """Pass stored audit logs to the registered handlers and wait until
+        they are written, i.e, to replay them after a sink outage.
+
+        Sinks write the batch directly in the calling thread, other handlers
+        are called with each audit log and async handlers are awaited. All
+        handlers are called, then the first error is raised.
+
+        Args:
+            batch: Audit logs to deliver.
+        """
+        if not self._log_handlers and not self._async_log_handlers:
+            raise RuntimeError("No audit log handler registered.")
+
+        futures = [self._event_loop.submit(handler, audit_log,
+                                           raise_errors=True)
+                   for handler in self._async_log_handlers
+                   for audit_log in batch]
+        error = None
+        for handler in self._log_handlers:
+            try:
+                write_many = getattr(handler, 'write_many', None)
+                if write_many is not None:
+                    write_many(batch)
+                else:
+                    for audit_log in batch:
+                        handler(audit_log)
+            except Exception as exc:  # noqa
+                error = error or exc
+
+        for future in futures:
+            try:
+                future.result()
+            except Exception as exc:  # noqa
+                error = error or exc
+
+        if error is not None:
+            raise error
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """Block until the audit events queued so far have been passed to
+        the handlers.
+
+        Args:
+            timeout: Maximum time in seconds to wait.
+
+        Return:
+            False when the timeout expired first.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        for lane in self._lanes.values():
+            remaining = (None if deadline is None
+                         else max(0.0, deadline - time.monotonic()))
+            if not lane.flush(remaining):
+                return False
+
+        return True
+
+    def shutdown(self, timeout: Optional[float] = None) -> None:
+        """Stop background resources of the auditor.
+
+        Waits for queued audit events and pending async handler calls, stops
+        the workers and the event loop and closes the handlers having a
+        `close` method, i.e, sinks, which writes their buffered audit logs.
+
+        Args:
+            timeout: Maximum time in seconds to wait for each stage.
+        """
+        for lane in self._lanes.values():
+            lane.shutdown(timeout)
+        self._event_loop.shutdown(timeout)
+        for handler in self._log_handlers | self._async_log_handlers:
+            close = getattr(handler, 'close', None)
+            if callable(close):
+                close()
+
+    def query_logs(self, **filters) -> List[dict]:
+        """Query audit logs stored by a registered queryable handler, i.e,
+        `flask_auditor.sinks.SQLiteSink`.
+
+        Args:
+            filters: Filters passed to the `query` method of the handler, i.e,
+                     `action_id`, `start`, `end`, `request_id`, `status_code`,
+                     `limit` and `offset`.
+        """
+        for handler in self._log_handlers:
+            if callable(getattr(handler, 'query', None)):
+                return handler.query(**filters)
+
+        raise RuntimeError("No queryable audit log handler registered.")
 
     def register_hook(self, hook: Callable) -> None:
         """Register a hook to extract more information from request and
@@ -173,3 +587,35 @@ class FlaskAuditor:
             raise TypeError("Hook must be callable.")
 
         self._hook = hook
+
+    def register_deferred_hook(self, hook: Callable) -> None:
+        """Register a hook to extract more information for audit log off the
+        request thread.
+
+        Unlike the hook set by `register_hook`, it runs in the background
+        thread extracting the audit log, so its cost is not added to the
+        response latency. It is called with the copied request, the response
+        and the values captured by `register_capture`, and returns a dict
+        merged into the audit log.
+        """
+        if not isinstance(hook, Callable):
+            raise TypeError("Hook must be callable.")
+
+        self._deferred_hook = hook
+
+    def register_capture(self, name: str, getter: Callable) -> None:
+        """Register a getter of a request-local value, i.e, `flask.g.user`,
+        for the deferred hook.
+
+        Getters run on the request thread when the response is returned, they
+        must only read values which are not available from the copied request
+        and leave any expensive work to the deferred hook.
+
+        Args:
+            name: Key of the value in the captured dict.
+            getter: A callable without arguments returning the value.
+        """
+        if not isinstance(getter, Callable):
+            raise TypeError("Getter must be callable.")
+
+        self._captures[name] = getter
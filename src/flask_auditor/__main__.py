@@ -0,0 +1,6 @@
+"""Allow to run the command line tools with `python -m flask_auditor`."""
+import sys
+
+from .cli import main
+
+sys.exit(main())
@@ -0,0 +1,148 @@
+"""Implements the audited actions registered with `FlaskAuditor`."""
+import fnmatch
+from typing import FrozenSet
+from typing import Iterable
+from typing import Optional
+
+from werkzeug.routing import Rule
+
+from .config import AuditLoggerConfig
+from .request import RequestLogger
+from .response import ResponseLogger
+
+# Priorities of audited actions, each one is served by its own queue and
+# workers. High priority events are never dropped, low priority events are
+# dropped first under overload.
+PRIORITY_HIGH = 'high'
+PRIORITY_NORMAL = 'normal'
+PRIORITY_LOW = 'low'
+PRIORITIES = (PRIORITY_HIGH, PRIORITY_NORMAL, PRIORITY_LOW)
+
+
+class AuditAction:
+    """An audited action and its compiled extraction plan."""
+
+    def __init__(self, action_id: str,
+                 description: Optional[str] = None,
+                 include: Optional[Iterable[str]] = None,
+                 exclude: Optional[Iterable[str]] = None,
+                 headers: Optional[tuple] = None,
+                 sensitive_parameters: Optional[tuple] = None,
+                 priority: str = PRIORITY_NORMAL,
+                 sync: bool = False) -> None:
+        """Initialize an object of the class.
+
+        Args:
+            action_id: Unique identifier for the action.
+            description: A description of the action.
+            include: Fields to extract, see `AuditLoggerConfig.fields`.
+            exclude: Fields not to extract.
+            headers: Request headers to extract.
+            sensitive_parameters: Parameters removed from the request body.
+            priority: One of `PRIORITIES`.
+            sync: Set to true to write audit logs before the response is
+                  returned, bypassing the queues of the sinks.
+        """
+        if priority not in PRIORITIES:
+            raise ValueError(f'Unknown priority: {priority}.')
+
+        self.action_id = action_id
+        self.description = description
+        self.include = tuple(include) if include is not None else None
+        self.exclude = tuple(exclude) if exclude is not None else None
+        self.headers = headers
+        self.sensitive_parameters = sensitive_parameters
+        self.priority = priority
+        self.sync = sync
+        self.cfg: Optional[AuditLoggerConfig] = None
+        self.request_logger: Optional[RequestLogger] = None
+        self.response_logger: Optional[ResponseLogger] = None
+
+    @property
+    def overrides_config(self) -> bool:
+        """Return true when the action overrides the global config."""
+        return any(x is not None for x in (
+            self.include, self.exclude, self.headers,
+            self.sensitive_parameters))
+
+    def compile(self, cfg: AuditLoggerConfig,
+                request_logger: RequestLogger,
+                response_logger: ResponseLogger) -> None:
+        """Compile the extraction plan of the action once.
+
+        Actions without overrides share the loggers of the global config.
+
+        Args:
+            cfg: Global configuration object.
+            request_logger: Request logger of the global config.
+            response_logger: Response logger of the global config.
+        """
+        if not self.overrides_config:
+            self.cfg = cfg
+            self.request_logger = request_logger
+            self.response_logger = response_logger
+            return
+
+        self.cfg = cfg.derive(
+            include=self.include,
+            exclude=self.exclude,
+            default_request_headers=self.headers,
+            default_sensitive_parameters=self.sensitive_parameters)
+        self.request_logger = RequestLogger(self.cfg)
+        self.response_logger = ResponseLogger(self.cfg)
+
+
+class AuditRule:
+    """Declarative registration of an action for matching URL rules."""
+
+    def __init__(self, action: AuditAction,
+                 blueprint: Optional[str] = None,
+                 endpoint: Optional[str] = None,
+                 rule: Optional[str] = None,
+                 methods: Optional[Iterable[str]] = None) -> None:
+        """Initialize an object of the class.
+
+        Args:
+            action: The audited action.
+            blueprint: Name of the blueprint, nested blueprints match too.
+            endpoint: Glob pattern of the endpoint, i.e, `admin.*`.
+            rule: Glob pattern of the URL rule, i.e, `/api/v1/admin/*`.
+            methods: HTTP methods, all methods of the URL rule by default.
+        """
+        if blueprint is None and endpoint is None and rule is None:
+            raise ValueError(
+                "One of blueprint, endpoint or rule must be given.")
+
+        self.action = action
+        self.blueprint = blueprint
+        self.endpoint = endpoint
+        self.rule = rule
+        self.methods = (frozenset(m.upper() for m in methods)
+                        if methods is not None else None)
+
+    def matches(self, url_rule: Rule) -> bool:
+        """Return true when the rule applies to the given URL rule."""
+        endpoint = url_rule.endpoint
+        if self.blueprint is not None:
+            bp_name = endpoint.rpartition('.')[0]
+            if (bp_name != self.blueprint
+                    and not bp_name.startswith(self.blueprint + '.')):
+                return False
+
+        if (self.endpoint is not None
+                and not fnmatch.fnmatchcase(endpoint, self.endpoint)):
+            return False
+
+        if (self.rule is not None
+                and not fnmatch.fnmatchcase(url_rule.rule, self.rule)):
+            return False
+
+        return True
+
+    def match_methods(self, url_rule: Rule) -> FrozenSet[str]:
+        """Return the methods of the given URL rule the action applies to."""
+        methods = frozenset(url_rule.methods or ())
+        if self.methods is None:
+            return methods
+
+        return methods & self.methods
@@ -0,0 +1,147 @@
+"""Implements the event loop running asynchronous audit log handlers."""
+import asyncio
+import inspect
+import logging
+import threading
+from concurrent.futures import Future
+from typing import Any
+from typing import Callable
+from typing import Optional
+
+from . import forksafe
+
+logger = logging.getLogger('flask_auditor')
+
+
+def is_async_callable(func: Any) -> bool:
+    """Return true when calling the given object returns a coroutine."""
+    return (inspect.iscoroutinefunction(func)
+            or inspect.iscoroutinefunction(getattr(func, '__call__', None)))
+
+
+class EventLoopThread:
+    """A background thread running an asyncio event loop.
+
+    The loop is started on first use. At most `concurrency` handler calls
+    run at once, the others wait on the loop without holding a thread.
+    """
+
+    def __init__(self, concurrency: int = 100) -> None:
+        """Initialize an object of the class.
+
+        Args:
+            concurrency: Maximum number of coroutines running at once.
+        """
+        self.concurrency = concurrency
+        self.pending = 0
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._lock = threading.Lock()
+        forksafe.register(self)
+
+    @property
+    def running(self) -> bool:
+        """Return true when the loop thread is running."""
+        return self._thread is not None and self._thread.is_alive()
+
+    def submit(self, func: Callable, *args,
+               raise_errors: bool = False) -> Future:
+        """Schedule `func(*args)` on the loop from any thread.
+
+        Args:
+            func: An async callable.
+            args: Arguments passed to the callable.
+            raise_errors: Set to true to raise errors of the call from the
+                          `result` of the returned future, instead of only
+                          logging them.
+        """
+        loop = self._ensure_started()
+        with self._lock:
+            self.pending += 1
+
+        return asyncio.run_coroutine_threadsafe(
+            self._run(func, *args, raise_errors=raise_errors), loop)
+
+    def shutdown(self, timeout: Optional[float] = None) -> None:
+        """Wait for scheduled coroutines, then stop and close the loop.
+
+        Args:
+            timeout: Maximum time in seconds to wait for pending coroutines.
+        """
+        with self._lock:
+            loop, thread = self._loop, self._thread
+            self._loop = self._thread = None
+
+        if loop is None:
+            return
+
+        try:
+            asyncio.run_coroutine_threadsafe(
+                self._drain(), loop).result(timeout)
+        except Exception:  # noqa
+            logger.warning('Audit log event loop stopped with %d pending '
+                           'handler calls.', self.pending)
+
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join()
+        loop.close()
+
+    def _after_fork(self) -> None:
+        """Drop the loop inherited from the parent process, its thread does
+        not exist in the child."""
+        self.pending = 0
+        self._loop = self._thread = self._semaphore = None
+        self._lock = threading.Lock()
+
+    def _ensure_started(self) -> asyncio.AbstractEventLoop:
+        """Start the loop thread on first use."""
+        loop = self._loop
+        if loop is not None:
+            return loop
+
+        with self._lock:
+            if self._loop is not None:
+                return self._loop
+
+            loop = asyncio.new_event_loop()
+            ready = threading.Event()
+            thread = threading.Thread(target=self._run_loop,
+                                      args=(loop, ready),
+                                      name='FlaskAuditorEventLoop',
+                                      daemon=True)
+            thread.start()
+            ready.wait()
+            self._loop, self._thread = loop, thread
+            return loop
+
+    def _run_loop(self, loop: asyncio.AbstractEventLoop,
+                  ready: threading.Event) -> None:
+        """Target of the loop thread."""
+        asyncio.set_event_loop(loop)
+        # The semaphore must be created within its loop on Python < 3.10.
+        self._semaphore = asyncio.Semaphore(self.concurrency)
+        loop.call_soon(ready.set)
+        loop.run_forever()
+
+    async def _run(self, func: Callable, *args,
+                   raise_errors: bool = False) -> Any:
+        """Run a coroutine within the concurrency limit."""
+        try:
+            async with self._semaphore:
+                return await func(*args)
+        except Exception:  # noqa
+            if raise_errors:
+                raise
+            logger.exception('Async audit log handler %r failed.', func)
+        finally:
+            with self._lock:
+                self.pending -= 1
+
+    @staticmethod
+    async def _drain() -> None:
+        """Wait for all other tasks of the loop."""
+        current = asyncio.current_task()
+        tasks = [t for t in asyncio.all_tasks() if t is not current]
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
@@ -28,3 +28,4 @@ RESPONSE_STATUS_CODE = 'statusCode'
 RESPONSE_STATUS = 'status'
 RESPONSE_ERROR = 'error'
 RESPONSE_SIZE = 'responseSize'
+INTEGRITY = 'integrity'
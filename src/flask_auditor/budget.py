@@ -0,0 +1,86 @@
+"""Implements the memory budget of in-flight audit events."""
+import threading
+from typing import Optional
+
+from flask import Request
+from flask import Response
+
+from . import forksafe
+
+# Rough overhead in bytes of a Python object referenced by an event, i.e, an
+# environ key and its value.
+OBJECT_OVERHEAD = 64
+
+
+def estimate_request_size(flask_req: Request,
+                          with_body: bool = True) -> int:
+    """Return the approximate number of bytes held by a copied request.
+
+    Args:
+        flask_req: Flask request object.
+        with_body: Set to false to leave the request body out.
+    """
+    size = 0
+    for key, value in flask_req.environ.items():
+        size += len(key) + 2 * OBJECT_OVERHEAD
+        if isinstance(value, str):
+            size += len(value)
+
+    if with_body:
+        size += flask_req.content_length or 0
+
+    return size
+
+
+def estimate_response_size(flask_resp: Response) -> int:
+    """Return the approximate number of bytes held by a response."""
+    size = OBJECT_OVERHEAD * len(flask_resp.headers)
+    if not flask_resp.is_streamed:
+        size += flask_resp.content_length or 0
+
+    return size
+
+
+class MemoryBudget:
+    """Approximate memory budget shared by the in-flight audit events of the
+    process."""
+
+    def __init__(self, limit: Optional[int] = None) -> None:
+        """Initialize an object of the class.
+
+        Args:
+            limit: Budget in bytes, unlimited when it is not set or zero.
+        """
+        self.limit = limit or None
+        self.used = 0
+        self._lock = threading.Lock()
+        forksafe.register(self)
+
+    def try_acquire(self, size: int) -> bool:
+        """Reserve bytes when they fit in the budget.
+
+        Return:
+            True when the bytes were reserved.
+        """
+        with self._lock:
+            if self.limit is not None and self.used + size > self.limit:
+                return False
+
+            self.used += size
+            return True
+
+    def acquire(self, size: int) -> None:
+        """Reserve bytes even when they exceed the budget."""
+        with self._lock:
+            self.used += size
+
+    def release(self, size: int) -> None:
+        """Release bytes reserved for a finished event."""
+        with self._lock:
+            self.used = max(0, self.used - size)
+
+    def _after_fork(self) -> None:
+        """Reset the budget, events in flight belong to the parent
+        process."""
+        self.used = 0
+        self._lock = threading.Lock()
@@ -0,0 +1,265 @@
+"""Command line tools to work with stored audit logs."""
+import argparse
+import gzip
+import importlib
+import itertools
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from typing import Any
+from typing import Iterator
+from typing import List
+from typing import Optional
+from typing import Tuple
+
+from .columnar import ColumnarExporter
+from .config import AuditLoggerConfig
+from .integrity import ChainVerifier
+from .replay import Replayer
+from .replay import ReplayStats
+from .sinks.segment import Segment
+from .sinks.segment import SegmentedLogReader
+
+# Environment variable read when no integrity key is given.
+INTEGRITY_KEY_ENV = 'FLASK_AUDITOR_INTEGRITY_KEY'
+
+
+def _parse_time(value: str) -> float:
+    """Parse an ISO 8601 datetime or a POSIX timestamp argument."""
+    try:
+        return float(value)
+    except ValueError:
+        return datetime.fromisoformat(value).timestamp()
+
+
+def query(args: argparse.Namespace) -> int:
+    """Print audit logs of a segmented log matching the given filters."""
+    reader = SegmentedLogReader(args.directory, args.datetime_format)
+    logs = reader.iter_logs(action_id=args.action_id,
+                            start=args.start,
+                            end=args.end,
+                            request_id=args.request_id,
+                            status_code=args.status_code)
+    for i, audit_log in enumerate(logs):
+        if args.limit is not None and i == args.limit:
+            break
+
+        sys.stdout.write(json.dumps(audit_log) + '\n')
+
+    return 0
+
+
+def _read_file(path: str) -> Iterator[Tuple[bytes, str]]:
+    """Yield the lines of a JSON lines file, gzipped or not, with their
+    location."""
+    opener = gzip.open if path.endswith('.gz') else open
+    with opener(path, 'rb') as f:
+        for i, line in enumerate(f, 1):
+            if line.strip():
+                yield line, f'{path}:{i}'
+
+
+def _verify_segment(path: str, key: bytes) -> ChainVerifier:
+    """Verify the lines of a segment file.
+
+    A batch is never split across segments, so segments are verified
+    independently and merged.
+    """
+    verifier = ChainVerifier(key)
+    for i, line in enumerate(Segment(path).lines(), 1):
+        verifier.feed(line, f'{path}:{i}')
+
+    return verifier
+
+
+def verify(args: argparse.Namespace) -> int:
+    """Verify the hash chains of sealed audit logs."""
+    key = args.key or os.environ.get(INTEGRITY_KEY_ENV)
+    if args.key_file:
+        with open(args.key_file, 'rb') as f:
+            key = f.read().strip()
+
+    if not key:
+        sys.stderr.write(f'An integrity key is required, set --key, '
+                         f'--key-file or {INTEGRITY_KEY_ENV}.\n')
+        return 2
+
+    verifier = ChainVerifier(key)
+    segments = []
+    for path in args.paths:
+        if os.path.isdir(path):
+            reader = SegmentedLogReader(path)
+            segments.extend(x.path for x in reader.segments())
+        else:
+            for line, location in _read_file(path):
+                verifier.feed(line, location)
+
+    if args.jobs > 1 and len(segments) > 1:
+        with ProcessPoolExecutor(args.jobs) as executor:
+            results = executor.map(_verify_segment, segments,
+                                   itertools.repeat(verifier.key))
+            for result in results:
+                verifier.merge(result)
+    else:
+        for path in segments:
+            verifier.merge(_verify_segment(path, verifier.key))
+
+    ok = verifier.finish()
+    for error in verifier.errors:
+        sys.stderr.write(error + '\n')
+
+    sys.stdout.write(f'{verifier.records} audit logs, {verifier.batches} '
+                     f'batches, {verifier.chains} chains: '
+                     f'{"OK" if ok else f"{len(verifier.errors)} errors"}\n')
+    return 0 if ok else 1
+
+
+def export(args: argparse.Namespace) -> int:
+    """Export stored audit logs to columnar chunk files."""
+    with ColumnarExporter(args.output, args.chunk_rows,
+                          args.datetime_format) as exporter:
+        for path in args.paths:
+            if os.path.isdir(path):
+                reader = SegmentedLogReader(path, args.datetime_format)
+                exporter.write(reader.iter_logs())
+            else:
+                exporter.write(json.loads(line)
+                               for line, _ in _read_file(path))
+
+    sys.stdout.write(f'{exporter.rows} audit logs, {exporter.chunks} '
+                     f'chunks\n')
+    return 0
+
+
+def _load_auditor(name: str) -> Any:
+    """Import a `FlaskAuditor` given as `module:attribute`, from the current
+    directory like `flask --app`."""
+    if os.getcwd() not in sys.path:
+        sys.path.insert(0, os.getcwd())
+
+    module, _, attribute = name.partition(':')
+    obj = importlib.import_module(module)
+    for part in (attribute or 'auditor').split('.'):
+        obj = getattr(obj, part)
+
+    return obj
+
+
+def replay(args: argparse.Namespace) -> int:
+    """Re-deliver stored audit logs through the handlers of an auditor."""
+    auditor = _load_auditor(args.auditor)
+    replayer = Replayer(auditor.deliver,
+                        workers=args.workers,
+                        batch_size=args.batch_size,
+                        rate=args.rate,
+                        checkpoint=args.checkpoint,
+                        dedupe=args.dedupe,
+                        start=args.start,
+                        end=args.end,
+                        table=args.table,
+                        datetime_format=args.datetime_format)
+
+    def progress(stats: ReplayStats) -> None:
+        sys.stderr.write(f'{stats}\n')
+
+    try:
+        stats = replayer.run(args.paths, progress, args.report_interval)
+    finally:
+        # Sinks write the audit logs they have buffered.
+        auditor.shutdown()
+
+    sys.stdout.write(f'{stats}\n')
+    return 1 if stats.failed else 0
+
+
+def build_parser() -> argparse.ArgumentParser:
+    """Return the parser of the command line arguments."""
+    parser = argparse.ArgumentParser(
+        prog='flask-auditor', description=__doc__)
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    cmd = commands.add_parser(
+        'query', help='Query audit logs of a segmented log directory.')
+    cmd.add_argument('directory', help='Directory of the segment files.')
+    cmd.add_argument('--action-id', help='Unique identifier of the action.')
+    cmd.add_argument('--request-id', help='Request ID of the audit logs.')
+    cmd.add_argument('--status-code', type=int,
+                     help='Response status code of the audit logs.')
+    cmd.add_argument('--start', type=_parse_time,
+                     help='Include audit logs started at or after this time.')
+    cmd.add_argument('--end', type=_parse_time,
+                     help='Include audit logs started before this time.')
+    cmd.add_argument('--limit', type=int,
+                     help='Maximum number of audit logs to print.')
+    cmd.add_argument('--datetime-format',
+                     default=AuditLoggerConfig.datetime_format,
+                     help='Format of the `startTime` attribute.')
+    cmd.set_defaults(func=query)
+
+    cmd = commands.add_parser(
+        'verify', help='Verify the hash chains of sealed audit logs.')
+    cmd.add_argument('paths', nargs='+',
+                     help='Segmented log directories or JSON lines files.')
+    cmd.add_argument('--key', help=f'Integrity key, {INTEGRITY_KEY_ENV} is '
+                                   f'read if not set.')
+    cmd.add_argument('--key-file', help='File containing the integrity key.')
+    cmd.add_argument('--jobs', type=int, default=os.cpu_count() or 1,
+                     help='Number of processes verifying segments.')
+    cmd.set_defaults(func=verify)
+
+    cmd = commands.add_parser(
+        'export', help='Export audit logs to columnar chunk files.')
+    cmd.add_argument('paths', nargs='+',
+                     help='Segmented log directories or JSON lines files.')
+    cmd.add_argument('--output', required=True,
+                     help='Directory of the chunk files.')
+    cmd.add_argument('--chunk-rows', type=int, default=1000000,
+                     help='Maximum number of audit logs per chunk.')
+    cmd.add_argument('--datetime-format',
+                     default=AuditLoggerConfig.datetime_format,
+                     help='Format of the `startTime` attribute.')
+    cmd.set_defaults(func=export)
+
+    cmd = commands.add_parser(
+        'replay', help='Re-deliver stored audit logs to the handlers of an '
+                       'auditor.')
+    cmd.add_argument('paths', nargs='+',
+                     help='JSON lines files, spool or segmented log '
+                          'directories or SQLite databases.')
+    cmd.add_argument('--auditor', required=True,
+                     help='The FlaskAuditor with the handlers, as '
+                          '`module:attribute`, `attribute` is `auditor` by '
+                          'default.')
+    cmd.add_argument('--workers', type=int, default=4,
+                     help='Number of threads delivering batches.')
+    cmd.add_argument('--batch-size', type=int, default=500,
+                     help='Maximum number of audit logs per batch.')
+    cmd.add_argument('--rate', type=float,
+                     help='Maximum number of audit logs per second.')
+    cmd.add_argument('--checkpoint',
+                     help='File saving the progress, an interrupted replay '
+                          'resumes from it.')
+    cmd.add_argument('--no-dedupe', dest='dedupe', action='store_false',
+                     help='Deliver audit logs with the same request ID and '
+                          'start time again.')
+    cmd.add_argument('--start', type=_parse_time,
+                     help='Replay audit logs started at or after this time.')
+    cmd.add_argument('--end', type=_parse_time,
+                     help='Replay audit logs started before this time.')
+    cmd.add_argument('--table', default='audit_logs',
+                     help='Table of the SQLite databases.')
+    cmd.add_argument('--report-interval', type=float, default=10.0,
+                     help='Time in seconds between two progress reports.')
+    cmd.add_argument('--datetime-format',
+                     default=AuditLoggerConfig.datetime_format,
+                     help='Format of the `startTime` attribute.')
+    cmd.set_defaults(func=replay)
+    return parser
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """Entry point of the `flask-auditor` command."""
+    args = build_parser().parse_args(argv)
+    return args.func(args)
@@ -0,0 +1,421 @@
+"""Implements a columnar export of stored audit logs for offline analytics.
+
+The exporter streams audit logs into chunk files of at most `chunk_rows`
+rows. Numeric fields are stored as little-endian typed arrays and strings as
+dictionary-encoded `int32` codes, so a chunk is loaded by memory-mapping it
+without parsing any row. A chunk file is laid out as::
+
+    magic | header length (uint32) | JSON header | padding | columns
+
+The header lists the rows of the chunk and the type, the offset and the
+length of each column, with the dictionaries of the encoded columns. Columns
+are aligned on 8 bytes. Missing values are `NaN` in float columns and `-1` in
+integer and encoded columns.
+"""
+import array
+import json
+import math
+import mmap
+import os
+import struct
+import sys
+from datetime import datetime
+from typing import Any
+from typing import Dict
+from typing import Iterable
+from typing import List
+from typing import Optional
+from typing import Tuple
+
+from . import attributes
+from .config import AuditLoggerConfig
+
+try:
+    import numpy
+except ImportError:  # pragma: no cover
+    numpy = None
+
+CHUNK_PREFIX = 'chunk-'
+CHUNK_SUFFIX = '.col'
+
+_MAGIC = b'FACOL\x00\x00\x01'
+_HEADER_LENGTH = struct.Struct('<I')
+_ALIGNMENT = 8
+
+# Value of missing fields in integer and encoded columns.
+NULL_INT = -1
+
+FLOAT64 = 'float64'
+INT32 = 'int32'
+INT64 = 'int64'
+# Dictionary-encoded strings, stored as int32 codes.
+DICT = 'dict'
+
+# Array typecodes and numpy dtypes of the column types.
+_TYPECODES = {FLOAT64: 'd', INT32: 'i', INT64: 'q', DICT: 'i'}
+_DTYPES = {FLOAT64: '<f8', INT32: '<i4', INT64: '<i8', DICT: '<i4'}
+
+# Name, type and path in the audit log of the exported columns. `startTime`
+# is converted to a POSIX timestamp.
+COLUMNS: Tuple[Tuple[str, str, Tuple[str, ...]], ...] = (
+    (attributes.START_TIME, FLOAT64, (attributes.START_TIME,)),
+    (attributes.LATENCY, FLOAT64, (attributes.LATENCY,)),
+    (attributes.RESPONSE_STATUS_CODE, INT32,
+     (attributes.RESPONSE, attributes.RESPONSE_STATUS_CODE)),
+    (attributes.RESPONSE_SIZE, INT64,
+     (attributes.RESPONSE, attributes.RESPONSE_SIZE)),
+    (attributes.SOURCE_NAME, DICT, (attributes.SOURCE_NAME,)),
+    (attributes.ACTION_ID, DICT, (attributes.ACTION_ID,)),
+    (attributes.REQUEST_METHOD, DICT,
+     (attributes.REQUEST, attributes.REQUEST_METHOD)),
+    (attributes.REQUEST_ROUTE_PATH, DICT,
+     (attributes.REQUEST, attributes.REQUEST_ROUTE_PATH)),
+    (attributes.REQUEST_HOST, DICT,
+     (attributes.REQUEST, attributes.REQUEST_HOST)),
+    (attributes.REQUEST_REMOTE_IP, DICT,
+     (attributes.REQUEST, attributes.REQUEST_REMOTE_IP)),
+    (attributes.REQUEST_USER_AGENT, DICT,
+     (attributes.REQUEST, attributes.REQUEST_USER_AGENT)),
+)
+
+
+def _get(audit_log: dict, path: Tuple[str, ...]) -> Any:
+    """Return a nested value of an audit log, `None` when it is missing."""
+    value = audit_log
+    for key in path:
+        if not isinstance(value, dict):
+            return None
+        value = value.get(key)
+
+    return value
+
+
+def _padding(size: int) -> int:
+    """Return the padding aligning a size on `_ALIGNMENT`."""
+    return -size % _ALIGNMENT
+
+
+class _ColumnBuilder:
+    """Values of a column of the chunk being exported."""
+
+    def __init__(self, name: str, kind: str,
+                 path: Tuple[str, ...]) -> None:
+        self.name = name
+        self.kind = kind
+        self.path = path
+        self.values = array.array(_TYPECODES[kind])
+        self.codes: Dict[str, int] = {}
+
+    def add(self, value: Any) -> None:
+        """Append the value of a row, converted to the column type."""
+        if self.kind == DICT:
+            if value is None:
+                self.values.append(NULL_INT)
+                return
+
+            if not isinstance(value, str):
+                value = str(value)
+            code = self.codes.get(value)
+            if code is None:
+                code = self.codes[value] = len(self.codes)
+            self.values.append(code)
+        elif self.kind == FLOAT64:
+            try:
+                self.values.append(float(value))
+            except (TypeError, ValueError):
+                self.values.append(math.nan)
+        else:
+            try:
+                self.values.append(int(value))
+            except (TypeError, ValueError, OverflowError):
+                self.values.append(NULL_INT)
+
+    def to_bytes(self) -> bytes:
+        """Return the little-endian values of the column."""
+        if sys.byteorder == 'little':
+            return self.values.tobytes()
+
+        values = array.array(self.values.typecode, self.values)
+        values.byteswap()
+        return values.tobytes()
+
+
+class ColumnarExporter:
+    """Streams audit logs into columnar chunk files."""
+
+    def __init__(self, directory: str, chunk_rows: int = 1000000,
+                 datetime_format: str = AuditLoggerConfig.datetime_format
+                 ) -> None:
+        """Initialize an object of the class.
+
+        Args:
+            directory: Directory of the chunk files. Chunks are numbered after
+                       the chunks it already contains.
+            chunk_rows: Maximum number of rows of a chunk.
+            datetime_format: Format of the `startTime` attribute.
+        """
+        if chunk_rows < 1:
+            raise ValueError('chunk_rows must be at least 1.')
+
+        self.directory = directory
+        self.chunk_rows = chunk_rows
+        self.datetime_format = datetime_format
+        self.rows = 0
+        self.chunks = 0
+        self._times: Dict[str, float] = {}
+        os.makedirs(directory, exist_ok=True)
+        self._next_chunk = self._last_chunk() + 1
+        self._reset()
+
+    def _last_chunk(self) -> int:
+        """Return the number of the last chunk of the directory, -1 when it
+        has none. Chunks deleted before it are not reused."""
+        last = -1
+        for path in ColumnarReader(self.directory).chunk_paths():
+            number = os.path.basename(path)[
+                len(CHUNK_PREFIX):-len(CHUNK_SUFFIX)]
+            if number.isdigit():
+                last = max(last, int(number))
+
+        return last
+
+    def write(self, audit_logs: Iterable[dict]) -> None:
+        """Append audit logs, full chunks are written."""
+        columns = self._columns
+        for audit_log in audit_logs:
+            columns[0].add(self._timestamp(audit_log.get(
+                attributes.START_TIME)))
+            for column in columns[1:]:
+                column.add(_get(audit_log, column.path))
+
+            self._rows += 1
+            if self._rows >= self.chunk_rows:
+                self.flush()
+                columns = self._columns
+
+    def flush(self) -> None:
+        """Write the pending rows to a chunk."""
+        if not self._rows:
+            return
+
+        header = {'rows': self._rows, 'columns': []}
+        blobs = []
+        offset = 0
+        for column in self._columns:
+            blob = column.to_bytes()
+            info = {'name': column.name, 'type': column.kind,
+                    'offset': offset, 'length': len(blob)}
+            if column.kind == DICT:
+                info['dictionary'] = list(column.codes)
+            header['columns'].append(info)
+            blobs.append(blob + bytes(_padding(len(blob))))
+            offset += len(blobs[-1])
+
+        data = json.dumps(header, separators=(',', ':')).encode('utf-8')
+        head = _MAGIC + _HEADER_LENGTH.pack(len(data)) + data
+        head += bytes(_padding(len(head)))
+
+        name = f'{CHUNK_PREFIX}{self._next_chunk:06d}{CHUNK_SUFFIX}'
+        path = os.path.join(self.directory, name)
+        with open(path + '.tmp', 'wb') as f:
+            f.write(head)
+            for blob in blobs:
+                f.write(blob)
+        os.replace(path + '.tmp', path)
+
+        self.rows += self._rows
+        self.chunks += 1
+        self._next_chunk += 1
+        self._reset()
+
+    def close(self) -> None:
+        """Write the last partial chunk."""
+        self.flush()
+
+    def __enter__(self) -> 'ColumnarExporter':
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def _reset(self) -> None:
+        """Start a new chunk."""
+        self._columns = [_ColumnBuilder(*x) for x in COLUMNS]
+        self._rows = 0
+        self._times.clear()
+
+    def _timestamp(self, value: Any) -> float:
+        """Convert a `startTime` to a POSIX timestamp, `NaN` when it cannot
+        be parsed. Audit logs of the same second share their value, so
+        parsed values are cached per chunk."""
+        if not isinstance(value, str):
+            return math.nan
+
+        ts = self._times.get(value)
+        if ts is None:
+            try:
+                ts = datetime.strptime(value, self.datetime_format).timestamp()
+            except ValueError:
+                ts = math.nan
+            self._times[value] = ts
+
+        return ts
+
+
+class ColumnarChunk:
+    """A memory-mapped chunk file.
+
+    Columns are zero-copy views of the file: numpy arrays when numpy is
+    installed, typed memoryviews otherwise.
+    """
+
+    def __init__(self, path: str) -> None:
+        """Initialize an object of the class.
+
+        Args:
+            path: Path of the chunk file.
+
+        Raises:
+            ValueError: When the file is not a chunk file.
+        """
+        self.path = path
+        with open(path, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        if self._mmap[:len(_MAGIC)] != _MAGIC:
+            self._mmap.close()
+            raise ValueError(f'{path} is not a columnar chunk.')
+
+        begin = len(_MAGIC) + _HEADER_LENGTH.size
+        length, = _HEADER_LENGTH.unpack_from(self._mmap, len(_MAGIC))
+        header = json.loads(self._mmap[begin:begin + length])
+        self.rows: int = header['rows']
+        self._data = begin + length + _padding(begin + length)
+        self._columns: Dict[str, dict] = {
+            x['name']: x for x in header['columns']}
+
+    @property
+    def names(self) -> List[str]:
+        """Return the names of the columns."""
+        return list(self._columns)
+
+    def column(self, name: str) -> Any:
+        """Return the values of a column, codes for encoded columns.
+
+        Raises:
+            KeyError: When the column does not exist.
+        """
+        info = self._columns[name]
+        begin = self._data + info['offset']
+        if numpy is not None:
+            return numpy.frombuffer(self._mmap, dtype=_DTYPES[info['type']],
+                                    count=self.rows, offset=begin)
+
+        view = memoryview(self._mmap)[begin:begin + info['length']]
+        if sys.byteorder != 'little':
+            # Typed memoryviews use the native byte order.
+            values = array.array(_TYPECODES[info['type']], view.tobytes())
+            values.byteswap()
+            return memoryview(values)
+
+        return view.cast(_TYPECODES[info['type']])
+
+    def dictionary(self, name: str) -> List[str]:
+        """Return the strings of an encoded column, indexed by code."""
+        return self._columns[name].get('dictionary', [])
+
+    def decode(self, name: str) -> List[Optional[str]]:
+        """Return the strings of an encoded column."""
+        dictionary = self.dictionary(name)
+        return [dictionary[x] if x >= 0 else None
+                for x in self.column(name).tolist()]
+
+    def close(self) -> None:
+        """Unmap the chunk file.
+
+        Views of the columns must be released first.
+        """
+        self._mmap.close()
+
+    def __enter__(self) -> 'ColumnarChunk':
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+
+class ColumnarReader:
+    """Loads the chunks written by `ColumnarExporter`."""
+
+    def __init__(self, directory: str) -> None:
+        """Initialize an object of the class.
+
+        Args:
+            directory: Directory of the chunk files.
+        """
+        self.directory = directory
+
+    def chunk_paths(self) -> List[str]:
+        """Return the paths of the chunks in the order they were written."""
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return []
+
+        return [os.path.join(self.directory, x) for x in sorted(names)
+                if x.startswith(CHUNK_PREFIX) and x.endswith(CHUNK_SUFFIX)]
+
+    def chunks(self) -> Iterable[ColumnarChunk]:
+        """Yield the memory-mapped chunks, one at a time."""
+        for path in self.chunk_paths():
+            yield ColumnarChunk(path)
+
+    def load(self, names: Optional[Iterable[str]] = None
+             ) -> Tuple[Dict[str, Any], Dict[str, List[str]]]:
+        """Concatenate columns of all chunks into numpy arrays.
+
+        Codes of the encoded columns are remapped to a dictionary shared by
+        all chunks, i.e, to build a `pandas.Categorical` with
+        `Categorical.from_codes(codes, dictionary)`.
+
+        Args:
+            names: Names of the columns to load, all columns if not set.
+
+        Return:
+            The arrays and the dictionaries of the encoded columns, by name.
+
+        Raises:
+            ImportError: When numpy is not installed.
+        """
+        if numpy is None:
+            raise ImportError('Loading columns requires the numpy package.')
+
+        kinds = {name: kind for name, kind, _ in COLUMNS}
+        names = list(kinds if names is None else names)
+        parts: Dict[str, List[Any]] = {x: [] for x in names}
+        dictionaries: Dict[str, Dict[str, int]] = {
+            x: {} for x in names if kinds.get(x) == DICT}
+        for chunk in self.chunks():
+            for name in names:
+                values = chunk.column(name)
+                if name in dictionaries:
+                    shared = dictionaries[name]
+                    # The last entry maps NULL_INT to itself.
+                    mapping = numpy.array(
+                        [shared.setdefault(x, len(shared))
+                         for x in chunk.dictionary(name)] + [NULL_INT],
+                        dtype=_DTYPES[DICT])
+                    values = mapping[values]
+                else:
+                    values = values.copy()
+                parts[name].append(values)
+
+            chunk.close()
+
+        columns = {}
+        for name in names:
+            dtype = _DTYPES[kinds.get(name, FLOAT64)]
+            columns[name] = (numpy.concatenate(parts[name]) if parts[name]
+                             else numpy.empty(0, dtype=dtype))
+
+        return columns, {x: list(y) for x, y in dictionaries.items()}
@@ -1,4 +1,6 @@
 """Implements a config class for audit logger."""
+from typing import Iterable
+from typing import Optional
 
 
 class AuditLoggerConfig:
@@ -31,7 +33,24 @@ class AuditLoggerConfig:
         'log_request_body',
         'log_sensitive_data',
         'default_request_headers',
-        'default_sensitive_parameters')
+        'default_sensitive_parameters',
+        'memory_budget',
+        'memory_sample_rate',
+        'async_concurrency',
+        'min_workers',
+        'max_workers',
+        'queue_size',
+        'scale_up_wait',
+        'worker_idle_timeout',
+        'high_priority_workers',
+        'low_priority_workers',
+        'low_priority_queue_size')
+
+    # Fields which can be included or excluded per action, each one is
+    # enabled by the `log_<field>` option.
+    fields = tuple(
+        opt[4:] for opt in options
+        if opt.startswith('log_') and opt != 'log_sensitive_data')
 
     # default value for not available record
     not_available = 'N/A'
@@ -125,6 +144,42 @@ class AuditLoggerConfig:
         'private_key',
         'privateKey')
 
+    # Approximate memory budget in bytes of the audit events in flight in the
+    # process, i.e, copied requests waiting to be extracted. Over budget,
+    # request bodies are dropped first, then events are sampled. Set to 0 to
+    # disable the budget.
+    memory_budget = 0
+
+    # Fraction of the events kept without request body when even those do
+    # not fit in the memory budget.
+    memory_sample_rate = 0.1
+
+    # Maximum number of async audit log handler calls running at once on the
+    # auditor event loop.
+    async_concurrency = 100
+
+    # Bounds of the background workers extracting audit events. Workers are
+    # added while the expected wait of a new event exceeds `scale_up_wait`
+    # seconds and exit after `worker_idle_timeout` seconds without events.
+    min_workers = 1
+    max_workers = 8
+    scale_up_wait = 0.05
+    worker_idle_timeout = 5.0
+
+    # Maximum number of audit events waiting for a worker, further events are
+    # dropped.
+    queue_size = 10000
+
+    # Maximum workers of the high and low priority lanes. The settings above
+    # apply to the normal lane; each lane keeps at least one worker reserved
+    # once it has been used.
+    high_priority_workers = 2
+    low_priority_workers = 2
+
+    # Maximum number of low priority audit events waiting for a worker, kept
+    # small so that they are dropped first under overload.
+    low_priority_queue_size = 1000
+
     def __init__(self, **kwargs):
         """Initialize an object of the AuditLogConfig class."""
         for key, value in kwargs.items():
@@ -132,3 +187,29 @@ class AuditLoggerConfig:
                 continue
 
             setattr(self, key, value)
+
+    def derive(self, include: Optional[Iterable[str]] = None,
+               exclude: Optional[Iterable[str]] = None,
+               **kwargs) -> 'AuditLoggerConfig':
+        """Return a copy of the config with per-action overrides.
+
+        Args:
+            include: Fields to extract, all other fields are disabled.
+            exclude: Fields not to extract.
+            kwargs: Other options to override, `None` values are ignored.
+        """
+        include = set(include) if include is not None else None
+        exclude = set(exclude or ())
+        unknown = ((include or set()) | exclude) - set(self.fields)
+        if unknown:
+            raise ValueError(f'Unknown fields: {", ".join(sorted(unknown))}.')
+
+        options = {opt: getattr(self, opt) for opt in self.options}
+        for field in self.fields:
+            if include is not None:
+                options[f'log_{field}'] = field in include
+            if field in exclude:
+                options[f'log_{field}'] = False
+
+        options.update({k: v for k, v in kwargs.items() if v is not None})
+        return self.__class__(**options)
@@ -0,0 +1,245 @@
+"""Implements the background workers extracting audit events."""
+import logging
+import queue
+import threading
+import time
+from typing import Callable
+from typing import Optional
+from typing import Set
+
+from . import forksafe
+from .metrics import Metrics
+
+logger = logging.getLogger('flask_auditor')
+
+# Marker put on the queue to ask a worker to exit.
+_STOP = object()
+
+# Weight of the latest task in the handler latency average.
+LATENCY_ALPHA = 0.2
+
+# Latency assumed for tasks faster than this, so a deep queue of very fast
+# tasks still adds workers.
+MIN_LATENCY = 0.001
+
+# Minimum time in seconds between two resize events.
+RESIZE_INTERVAL = 0.1
+
+
+class Dispatcher:
+    """A queue of audit events served by a pool of workers which grows and
+    shrinks within bounds.
+
+    The expected wait of a new event is estimated from the queue depth and
+    a moving average of the task latency. A worker is added when it exceeds
+    `scale_up_wait`. A worker exits after `idle_timeout` seconds without a
+    task, and only while the expected wait is well below the threshold, so
+    the pool does not flap between sizes. A worker is kept while events are
+    queued, even when `min_workers` is zero.
+    """
+
+    def __init__(self, min_workers: int = 1, max_workers: int = 8,
+                 max_queue_size: int = 10000, scale_up_wait: float = 0.05,
+                 idle_timeout: float = 5.0,
+                 metrics: Optional[Metrics] = None,
+                 name: Optional[str] = None) -> None:
+        """Initialize an object of the class.
+
+        Args:
+            min_workers: Number of workers kept while idle.
+            max_workers: Maximum number of workers.
+            max_queue_size: Events are rejected when the queue is full.
+            scale_up_wait: Expected wait in seconds of a new event above
+                           which a worker is added.
+            idle_timeout: Time in seconds a worker waits for a task before
+                          it may exit.
+            metrics: Metrics of the pipeline receiving resize events.
+            name: Name of the dispatcher, appended to its metrics, i.e,
+                  `workers_scaled_up.high`.
+        """
+        self.min_workers = min_workers
+        self.max_workers = max_workers
+        self.max_queue_size = max_queue_size
+        self.scale_up_wait = scale_up_wait
+        self.idle_timeout = idle_timeout
+        self.metrics = metrics or Metrics()
+        self.name = name
+        self.latency = 0.0
+        self._queue = queue.Queue(maxsize=max_queue_size)
+        self._threads: Set[threading.Thread] = set()
+        self._unfinished = 0
+        # Number of stop markers queued by `shutdown` and not yet received.
+        self._stopping = 0
+        self._last_resize = 0.0
+        self._lock = threading.Lock()
+        self._done = threading.Condition(self._lock)
+        forksafe.register(self)
+
+    @property
+    def workers(self) -> int:
+        """Return the number of running workers."""
+        return len(self._threads)
+
+    @property
+    def depth(self) -> int:
+        """Return the number of queued events."""
+        return self._queue.qsize()
+
+    def expected_wait(self) -> float:
+        """Return the estimated time in seconds a new event waits."""
+        return (self._queue.qsize() * max(self.latency, MIN_LATENCY)
+                / max(len(self._threads), 1))
+
+    def submit(self, func: Callable, *args) -> bool:
+        """Queue `func(*args)` to run on a worker.
+
+        Return:
+            False when the queue is full and the event was rejected.
+        """
+        with self._lock:
+            self._unfinished += 1
+
+        try:
+            self._queue.put_nowait((func, args))
+        except queue.Full:
+            self._task_done()
+            self._incr('events_queue_full')
+            return False
+
+        if (len(self._threads) < max(self.min_workers, 1)
+                or self.expected_wait() > self.scale_up_wait):
+            self._scale_up()
+
+        return True
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """Block until all queued events have run.
+
+        Args:
+            timeout: Maximum time in seconds to wait.
+
+        Return:
+            False when the timeout expired first.
+        """
+        with self._done:
+            return self._done.wait_for(lambda: not self._unfinished, timeout)
+
+    def shutdown(self, timeout: Optional[float] = None) -> None:
+        """Run queued events, then stop the workers. Workers are started
+        again by the next event.
+
+        Args:
+            timeout: Maximum time in seconds to wait for queued events.
+        """
+        if not self.flush(timeout):
+            logger.warning('Audit log dispatcher stopped with %d pending '
+                           'events.', self._unfinished)
+
+        with self._lock:
+            threads = list(self._threads)
+            # Workers do not retire until they received the markers, so
+            # none is left in the queue.
+            self._stopping += len(threads)
+
+        for _ in threads:
+            self._queue.put(_STOP)
+
+        for thr in threads:
+            thr.join(timeout)
+
+    def _scale_up(self) -> None:
+        """Start a worker unless the pool is at its maximum size or was
+        resized just before."""
+        with self._lock:
+            workers = len(self._threads)
+            if workers >= self.max_workers:
+                return
+
+            now = time.monotonic()
+            if workers >= max(self.min_workers, 1):
+                if now - self._last_resize < RESIZE_INTERVAL:
+                    return
+
+                self._last_resize = now
+                self._incr('workers_scaled_up')
+
+            thr = threading.Thread(
+                target=self._run,
+                name=f'FlaskAuditorWorker-{self.name or "default"}-{workers}',
+                daemon=True)
+            self._threads.add(thr)
+            thr.start()
+
+    def _retire(self) -> bool:
+        """Return true when an idle worker must exit."""
+        with self._lock:
+            if len(self._threads) <= self.min_workers or self._stopping:
+                return False
+
+            # An event queued after the timeout needs a worker, `submit`
+            # only starts one when there is none left.
+            if len(self._threads) == 1 and self._queue.qsize():
+                return False
+
+            now = time.monotonic()
+            if (now - self._last_resize < RESIZE_INTERVAL
+                    or self.expected_wait() > self.scale_up_wait / 4):
+                return False
+
+            self._last_resize = now
+            self._threads.discard(threading.current_thread())
+
+        self._incr('workers_scaled_down')
+        return True
+
+    def _incr(self, counter: str) -> None:
+        """Increase a counter of the dispatcher."""
+        if self.name is not None:
+            counter = f'{counter}.{self.name}'
+
+        self.metrics.incr(counter)
+
+    def _run(self) -> None:
+        """Worker loop, run queued events and measure their latency."""
+        while True:
+            try:
+                item = self._queue.get(timeout=self.idle_timeout)
+            except queue.Empty:
+                if self._retire():
+                    return
+                continue
+
+            if item is _STOP:
+                with self._lock:
+                    self._stopping -= 1
+                    self._threads.discard(threading.current_thread())
+                return
+
+            func, args = item
+            started = time.perf_counter()
+            try:
+                func(*args)
+            except Exception:  # noqa
+                logger.exception('Failed to process audit event.')
+            finally:
+                elapsed = time.perf_counter() - started
+                self.latency += LATENCY_ALPHA * (elapsed - self.latency)
+                self._task_done()
+
+    def _task_done(self) -> None:
+        """Count a finished event and wake up `flush`."""
+        with self._lock:
+            self._unfinished -= 1
+            if not self._unfinished:
+                self._done.notify_all()
+
+    def _after_fork(self) -> None:
+        """Drop the workers and the events inherited from the parent
+        process, the parent processes them itself."""
+        self._queue = queue.Queue(maxsize=self.max_queue_size)
+        self._threads = set()
+        self._unfinished = 0
+        self._stopping = 0
+        self._last_resize = 0.0
+        self._lock = threading.Lock()
+        self._done = threading.Condition(self._lock)
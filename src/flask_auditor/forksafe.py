@@ -0,0 +1,61 @@
+"""Implements the reset of runtime resources inherited by forked processes.
+
+Apps preloaded by gunicorn or uWSGI are imported once, then forked. Threads
+do not survive the fork, and locks, queues and connections copied from the
+parent are in an undefined state. Objects owning such resources register
+themselves here and implement `_after_fork`, which drops the inherited state
+so that it is created lazily again in the child.
+"""
+import logging
+import os
+import threading
+import weakref
+from typing import Any
+
+logger = logging.getLogger('flask_auditor')
+
+_registry: 'weakref.WeakSet[Any]' = weakref.WeakSet()
+_pid = os.getpid()
+_lock = threading.Lock()
+
+
+def register(obj: Any) -> None:
+    """Reset the given object in forked processes.
+
+    Args:
+        obj: An object implementing `_after_fork()`.
+    """
+    _registry.add(obj)
+
+
+def check() -> None:
+    """Reset registered objects when the current process was forked without
+    running the at-fork hooks, i.e, by a server forking in C."""
+    if _pid == os.getpid():
+        return
+
+    with _lock:
+        if _pid != os.getpid():
+            _reset()
+
+
+def _after_fork_in_child() -> None:
+    """At-fork hook of the child process."""
+    global _lock
+    _lock = threading.Lock()
+    _reset()
+
+
+def _reset() -> None:
+    """Reset registered objects in the current process."""
+    global _pid
+    _pid = os.getpid()
+    for obj in list(_registry):
+        try:
+            obj._after_fork()
+        except Exception:  # noqa
+            logger.exception('Failed to reset %r after fork.', obj)
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_after_fork_in_child)
@@ -0,0 +1,432 @@
+"""Implements tamper-evident hash chains of audit logs.
+
+Sinks with an integrity key seal each batch of audit logs before writing it.
+Every audit log of a batch is a leaf of a Merkle tree, the root of the tree
+is authenticated with an HMAC which also covers the HMAC of the previous
+batch, so batches form a chain. Each audit log carries its position in the
+chain in the `integrity` attribute, the last audit log of a batch also
+carries the root and the HMAC of the batch::
+
+    {..., "integrity": {"chain": "9f86d081", "batch": 12, "seq": 1530}}
+    {..., "integrity": {"chain": "9f86d081", "batch": 12, "seq": 1531,
+                        "size": 32, "root": "...", "prev": "...",
+                        "mac": "..."}}
+
+Leaves are hashes of the JSON serialization written by the sinks, without the
+`integrity` attribute, so sealing costs one hash per audit log and the
+verification does not serialize audit logs again. An altered, removed,
+reordered or inserted audit log breaks the root of its batch, a removed
+batch breaks the chain.
+"""
+import hashlib
+import hmac
+import json
+import os
+import threading
+from collections.abc import Mapping
+from typing import Any
+from typing import Dict
+from typing import Iterable
+from typing import Iterator
+from typing import List
+from typing import Tuple
+from typing import Union
+
+from . import attributes
+from . import forksafe
+from .record import dumps
+
+# HMAC of the batch preceding the first batch of a chain.
+GENESIS = bytes(32)
+
+_LEAF_PREFIX = b'\x00'
+_NODE_PREFIX = b'\x01'
+_MARKER = f'"{attributes.INTEGRITY}":'.encode('utf-8')
+
+
+def leaf_hash(data: bytes) -> bytes:
+    """Return the Merkle leaf hash of a serialized audit log."""
+    return hashlib.sha256(_LEAF_PREFIX + data).digest()
+
+
+def merkle_root(leaves: List[bytes]) -> bytes:
+    """Return the Merkle root of leaf hashes.
+
+    The last node of a level with an odd number of nodes is promoted to the
+    next level unchanged.
+    """
+    if not leaves:
+        return hashlib.sha256(b'').digest()
+
+    sha256 = hashlib.sha256
+    level = leaves
+    while len(level) > 1:
+        nodes = [sha256(_NODE_PREFIX + level[i] + level[i + 1]).digest()
+                 for i in range(0, len(level) - 1, 2)]
+        if len(level) % 2:
+            nodes.append(level[-1])
+        level = nodes
+
+    return level[0]
+
+
+def batch_mac(key: bytes, chain: str, batch: int, seq: int, size: int,
+              prev: bytes, root: bytes) -> bytes:
+    """Return the HMAC of a batch.
+
+    Args:
+        key: Integrity key.
+        chain: Identifier of the chain.
+        batch: Position of the batch in the chain.
+        seq: Position of the first audit log of the batch in the chain.
+        size: Number of audit logs of the batch.
+        prev: HMAC of the previous batch.
+        root: Merkle root of the batch.
+    """
+    message = f'{chain}:{batch}:{seq}:{size}:'.encode('utf-8')
+    return hmac.new(key, message + prev + root, hashlib.sha256).digest()
+
+
+def _to_key(key: Union[str, bytes]) -> bytes:
+    """Return an integrity key as bytes."""
+    if isinstance(key, str):
+        key = key.encode('utf-8')
+
+    if not key:
+        raise ValueError('The integrity key must not be empty.')
+
+    return key
+
+
+class SealedRecord(Mapping):
+    """An audit log with its position in a chain.
+
+    The wrapped audit log is shared by all sinks and is not changed, each
+    sink with an integrity key writes its own sealed copy.
+    """
+
+    __slots__ = ('record', 'integrity', '_json')
+
+    def __init__(self, record: Any, integrity: dict, data: str) -> None:
+        """Initialize an object of the class.
+
+        Args:
+            record: The sealed audit log.
+            integrity: Position of the audit log in the chain.
+            data: Serialized audit log, including the `integrity` attribute.
+        """
+        self.record = record
+        self.integrity = integrity
+        self._json = data
+
+    def to_json(self) -> str:
+        """Return the audit log serialized to compact JSON."""
+        return self._json
+
+    def __getitem__(self, key: str) -> Any:
+        if key == attributes.INTEGRITY:
+            return self.integrity
+
+        return self.record[key]
+
+    def __iter__(self) -> Iterator[str]:
+        yield from self.record
+        yield attributes.INTEGRITY
+
+    def __len__(self) -> int:
+        return len(self.record) + 1
+
+    def __repr__(self) -> str:
+        return self._json
+
+
+class IntegrityChain:
+    """Seals batches of audit logs into a hash chain.
+
+    Each process writes its own chain, identified by a random ID, so chains of
+    forked workers sharing a destination do not collide.
+    """
+
+    def __init__(self, key: Union[str, bytes]) -> None:
+        """Initialize an object of the class.
+
+        Args:
+            key: Secret key of the batch HMACs.
+
+        Raises:
+            ValueError: When the key is empty.
+        """
+        self.key = _to_key(key)
+        self._lock = threading.Lock()
+        self._reset()
+        forksafe.register(self)
+
+    def seal(self, batch: List[Any]) -> List[SealedRecord]:
+        """Append a batch of audit logs to the chain.
+
+        Batches must be written in the order they were sealed.
+
+        Args:
+            batch: Audit logs of the batch.
+
+        Return:
+            The sealed copies of the audit logs.
+        """
+        batch = [_unsealed(audit_log) for audit_log in batch]
+        data = [dumps(audit_log) for audit_log in batch]
+        leaves = [leaf_hash(x.encode('utf-8')) for x in data]
+        root = merkle_root(leaves)
+        size = len(batch)
+        with self._lock:
+            chain, number, seq, prev = (self.chain, self.batch, self.seq,
+                                        self.prev)
+            mac = batch_mac(self.key, chain, number, seq, size, prev, root)
+            self.batch += 1
+            self.seq += size
+            self.prev = mac
+
+        # Formatted without `json.dumps`, which would be most of the cost.
+        prefix = (f'"{attributes.INTEGRITY}":{{"chain":"{chain}",'
+                  f'"batch":{number},"seq":')
+        sealed = []
+        for i, audit_log in enumerate(batch):
+            integrity = {'chain': chain, 'batch': number, 'seq': seq + i}
+            suffix = ''
+            if i == size - 1:
+                integrity.update(size=size, root=root.hex(), prev=prev.hex(),
+                                 mac=mac.hex())
+                suffix = (f',"size":{size},"root":"{integrity["root"]}",'
+                          f'"prev":"{integrity["prev"]}",'
+                          f'"mac":"{integrity["mac"]}"')
+
+            head = data[i][:-1]
+            sep = ',' if len(head) > 1 else ''
+            sealed.append(SealedRecord(
+                audit_log, integrity,
+                f'{head}{sep}{prefix}{seq + i}{suffix}}}}}'))
+
+        return sealed
+
+    def _reset(self) -> None:
+        """Start a new chain."""
+        self.chain = os.urandom(4).hex()
+        self.batch = 0
+        self.seq = 0
+        self.prev = GENESIS
+
+    def _after_fork(self) -> None:
+        """Start a new chain, the parent process continues its own."""
+        self._lock = threading.Lock()
+        self._reset()
+
+
+def _unsealed(audit_log: Any) -> Any:
+    """Return an audit log without the `integrity` attribute it got from
+    another chain, i.e, when sealed audit logs are replayed."""
+    if isinstance(audit_log, SealedRecord):
+        return audit_log.record
+
+    if attributes.INTEGRITY not in audit_log:
+        return audit_log
+
+    return {k: v for k, v in audit_log.items() if k != attributes.INTEGRITY}
+
+
+def _is_int(value: Any) -> bool:
+    """Return true when a JSON value is an integer."""
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+class _PendingBatch:
+    """Leaves of a batch read before its last audit log."""
+
+    __slots__ = ('batch', 'seq', 'location', 'leaves')
+
+    def __init__(self, batch: int, seq: int, location: str) -> None:
+        self.batch = batch
+        self.seq = seq
+        self.location = location
+        self.leaves: List[bytes] = []
+
+
+class ChainVerifier:
+    """Verifies audit logs sealed by `IntegrityChain`.
+
+    Lines are fed in the order they were written. Batches of a chain may be
+    fed in any order, i.e, when they were delivered again after a failure,
+    the links between them are checked by `finish`.
+    """
+
+    def __init__(self, key: Union[str, bytes]) -> None:
+        """Initialize an object of the class.
+
+        Args:
+            key: Secret key of the batch HMACs.
+        """
+        self.key = _to_key(key)
+        self.records = 0
+        self.batches = 0
+        self.errors: List[str] = []
+        self._pending: Dict[str, _PendingBatch] = {}
+        # Chain -> batch -> (first seq, size, prev, mac).
+        self._sealed: Dict[str, Dict[int, Tuple[int, int, bytes, bytes]]] = {}
+
+    @property
+    def chains(self) -> int:
+        """Return the number of chains seen."""
+        return len(self._sealed)
+
+    def feed(self, line: bytes, location: str = '') -> None:
+        """Verify a serialized audit log.
+
+        Args:
+            line: A JSON line written by a sink.
+            location: Location of the line reported in errors, i.e,
+                      `path:line`.
+        """
+        self.records += 1
+        line = line.rstrip(b'\r\n')
+        begin = line.rfind(_MARKER)
+        try:
+            if begin < 0 or not line.endswith(b'}'):
+                raise ValueError
+            info = json.loads(line[begin + len(_MARKER):-1])
+            chain, number, seq = info['chain'], info['batch'], info['seq']
+        except (ValueError, KeyError, TypeError):
+            self.errors.append(f'{location}: audit log is not sealed')
+            return
+
+        # Seals are read from untrusted files, their types are not assumed.
+        if not (isinstance(chain, str) and _is_int(number) and _is_int(seq)):
+            self.errors.append(f'{location}: audit log has an invalid seal')
+            return
+
+        head = line[:begin]
+        data = head[:-1] + b'}' if head.endswith(b',') else head + b'}'
+        pending = self._pending.get(chain)
+        if pending is not None and pending.batch != number:
+            self._incomplete(chain, pending)
+            pending = None
+
+        if pending is None:
+            pending = self._pending[chain] = _PendingBatch(
+                number, seq, location)
+
+        if seq != pending.seq + len(pending.leaves):
+            self.errors.append(f'{location}: audit log {seq} of chain '
+                               f'{chain} is out of sequence')
+
+        pending.leaves.append(leaf_hash(data))
+        if 'mac' in info:
+            del self._pending[chain]
+            self._verify_batch(chain, pending, info, location)
+
+    def merge(self, other: 'ChainVerifier') -> None:
+        """Merge the results of a verifier fed with other lines, i.e, other
+        segments verified by another process."""
+        self.records += other.records
+        self.batches += other.batches
+        self.errors.extend(other.errors)
+        for chain, pending in other._pending.items():
+            self._incomplete(chain, pending)
+
+        for chain, batches in other._sealed.items():
+            sealed = self._sealed.setdefault(chain, {})
+            for number, value in batches.items():
+                if number in sealed:
+                    self.errors.append(f'chain {chain}: batch {number} is '
+                                       f'duplicated')
+                else:
+                    sealed[number] = value
+
+    def finish(self) -> bool:
+        """Check the links between batches once all lines were fed.
+
+        Return:
+            True when no error was found.
+        """
+        for chain, pending in list(self._pending.items()):
+            self._incomplete(chain, pending)
+        self._pending.clear()
+
+        for chain, batches in self._sealed.items():
+            numbers = sorted(batches)
+            for previous, number in zip(numbers, numbers[1:]):
+                if number != previous + 1:
+                    self.errors.append(
+                        f'chain {chain}: batches {previous + 1} to '
+                        f'{number - 1} are missing')
+                    continue
+
+                seq, _, prev, _ = batches[number]
+                first, size, _, mac = batches[previous]
+                if prev != mac or seq != first + size:
+                    self.errors.append(f'chain {chain}: batch {number} does '
+                                       f'not follow batch {previous}')
+
+            if numbers[0] == 0 and batches[0][2] != GENESIS:
+                self.errors.append(f'chain {chain}: batch 0 does not start '
+                                   f'the chain')
+
+        return not self.errors
+
+    def _incomplete(self, chain: str, pending: _PendingBatch) -> None:
+        """Report a batch without its last audit log."""
+        self.errors.append(f'{pending.location}: batch {pending.batch} of '
+                           f'chain {chain} is incomplete')
+
+    def _verify_batch(self, chain: str, pending: _PendingBatch, info: dict,
+                      location: str) -> None:
+        """Verify the root and the HMAC of a complete batch."""
+        self.batches += 1
+        number = pending.batch
+        try:
+            size = info['size']
+            if not _is_int(size):
+                raise TypeError
+            root = bytes.fromhex(info['root'])
+            prev = bytes.fromhex(info['prev'])
+            mac = bytes.fromhex(info['mac'])
+        except (ValueError, KeyError, TypeError):
+            self.errors.append(f'{location}: batch {number} of chain {chain} '
+                               f'has an invalid seal')
+            return
+
+        first = info['seq'] - size + 1
+        expected = batch_mac(self.key, chain, number, first, size, prev, root)
+        if not hmac.compare_digest(mac, expected):
+            self.errors.append(f'{location}: batch {number} of chain {chain} '
+                               f'has an invalid HMAC')
+            return
+
+        if size != len(pending.leaves) or merkle_root(pending.leaves) != root:
+            self.errors.append(f'{location}: batch {number} of chain {chain} '
+                               f'was altered')
+            return
+
+        batches = self._sealed.setdefault(chain, {})
+        if number in batches:
+            self.errors.append(f'{location}: batch {number} of chain {chain} '
+                               f'is duplicated')
+            return
+
+        batches[number] = (first, size, prev, mac)
+
+
+def verify_lines(lines: Iterable[Tuple[bytes, str]],
+                 key: Union[str, bytes]) -> ChainVerifier:
+    """Verify serialized audit logs.
+
+    Args:
+        lines: Pairs of a JSON line and its location.
+        key: Secret key of the batch HMACs.
+
+    Return:
+        The verifier, with the errors found.
+    """
+    verifier = ChainVerifier(key)
+    for line, location in lines:
+        verifier.feed(line, location)
+
+    verifier.finish()
+    return verifier
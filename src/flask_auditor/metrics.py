@@ -0,0 +1,64 @@
+"""Implements metrics of the audit log pipeline."""
+import threading
+from typing import Callable
+from typing import Dict
+from typing import Union
+
+from . import forksafe
+
+Number = Union[int, float]
+
+
+class Metrics:
+    """Thread-safe counters and gauges of the audit log pipeline."""
+
+    def __init__(self) -> None:
+        """Initialize an object of the class."""
+        self._lock = threading.Lock()
+        self._counters: Dict[str, Number] = {}
+        self._gauges: Dict[str, Callable[[], Number]] = {}
+        forksafe.register(self)
+
+    def incr(self, name: str, value: Number = 1) -> None:
+        """Increase a counter.
+
+        Args:
+            name: Name of the counter.
+            value: Value added to the counter.
+        """
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def gauge(self, name: str, getter: Callable[[], Number]) -> None:
+        """Register a gauge, its value is read when metrics are collected.
+
+        Args:
+            name: Name of the gauge.
+            getter: A callable returning the current value.
+        """
+        with self._lock:
+            self._gauges[name] = getter
+
+    def get(self, name: str, default: Number = 0) -> Number:
+        """Return the current value of a counter or a gauge."""
+        with self._lock:
+            if name in self._gauges:
+                return self._gauges[name]()
+
+            return self._counters.get(name, default)
+
+    def snapshot(self) -> Dict[str, Number]:
+        """Return the current values of all counters and gauges."""
+        with self._lock:
+            values = dict(self._counters)
+            gauges = list(self._gauges.items())
+
+        for name, getter in gauges:
+            values[name] = getter()
+
+        return values
+
+    def _after_fork(self) -> None:
+        """Start counting from zero in the child process."""
+        self._lock = threading.Lock()
+        self._counters = {}
@@ -0,0 +1,253 @@
+"""Implements typed audit records passed to audit log handlers.
+
+Records keep extracted values in slots and build the nested dict of the
+audit log, keyed by the constants of `attributes`, at most once, when a
+handler reads them as a mapping or serializes them.
+"""
+import json
+from collections.abc import Mapping
+from collections.abc import MutableMapping
+from typing import Any
+from typing import Dict
+from typing import Iterator
+from typing import Optional
+from typing import Tuple
+
+from . import attributes
+
+# Marker of fields which were not extracted.
+UNSET: Any = object()
+
+REQUEST_FIELDS: Tuple[Tuple[str, str], ...] = (
+    ('server_host', attributes.SERVER_HOST),
+    ('server_port', attributes.SERVER_PORT),
+    ('request_id', attributes.REQUEST_ID),
+    ('remote_ip', attributes.REQUEST_REMOTE_IP),
+    ('remote_port', attributes.REQUEST_REMOTE_PORT),
+    ('protocol', attributes.REQUEST_PROTOCOL),
+    ('host', attributes.REQUEST_HOST),
+    ('method', attributes.REQUEST_METHOD),
+    ('uri', attributes.REQUEST_URI),
+    ('uri_path', attributes.REQUEST_URI_PATH),
+    ('route_path', attributes.REQUEST_ROUTE_PATH),
+    ('referer', attributes.REQUEST_HTTP_REFERER),
+    ('user_agent', attributes.REQUEST_USER_AGENT),
+    ('content_length', attributes.REQUEST_CONTENT_LENGTH),
+    ('headers', attributes.REQUEST_HEADERS),
+    ('query_params', attributes.REQUEST_QUERY_PARAMS),
+    ('body', attributes.REQUEST_BODY),
+)
+
+RESPONSE_FIELDS: Tuple[Tuple[str, str], ...] = (
+    ('status_code', attributes.RESPONSE_STATUS_CODE),
+    ('status', attributes.RESPONSE_STATUS),
+    ('size', attributes.RESPONSE_SIZE),
+)
+
+
+def _convert_none(value: Any, not_available: Any) -> Any:
+    """Convert none values, including nested ones, to the given value."""
+    if value is None:
+        return not_available
+
+    if isinstance(value, dict):
+        return {k: _convert_none(v, not_available) for k, v in value.items()}
+
+    if isinstance(value, (list, tuple)):
+        return [not_available if v is None else v for v in value]
+
+    return value
+
+
+class _FieldsRecord(Mapping):
+    """Base class of the request and response records."""
+
+    __slots__ = ('not_available', '_dict')
+
+    fields: Tuple[Tuple[str, str], ...] = ()
+
+    def __init__(self, not_available: Any = None, **values) -> None:
+        """Initialize an object of the class.
+
+        Args:
+            not_available: Value of the fields extracted as `None`.
+            values: Values of the fields by slot name.
+        """
+        self.not_available = not_available
+        self._dict: Optional[dict] = None
+        for slot, _ in self.fields:
+            setattr(self, slot, values.get(slot, UNSET))
+
+    def to_dict(self) -> dict:
+        """Return the extracted fields keyed by their attribute, the dict is
+        built once."""
+        if self._dict is None:
+            na = self.not_available
+            result = {}
+            for slot, key in self.fields:
+                value = getattr(self, slot)
+                if value is not UNSET:
+                    result[key] = _convert_none(value, na)
+            self._dict = result
+
+        return self._dict
+
+    def __getitem__(self, key: str) -> Any:
+        return self.to_dict()[key]
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.to_dict())
+
+    def __len__(self) -> int:
+        return len(self.to_dict())
+
+    def __repr__(self) -> str:
+        return repr(self.to_dict())
+
+
+class RequestRecord(_FieldsRecord):
+    """Fields extracted from a request."""
+
+    __slots__ = tuple(slot for slot, _ in REQUEST_FIELDS)
+    fields = REQUEST_FIELDS
+
+
+class ResponseRecord(_FieldsRecord):
+    """Fields extracted from a response."""
+
+    __slots__ = tuple(slot for slot, _ in RESPONSE_FIELDS)
+    fields = RESPONSE_FIELDS
+
+
+class AuditRecord(MutableMapping):
+    """An audit log.
+
+    Handlers can read fields by attribute, i.e, `record.request.request_id`,
+    or use the record like the dict of previous versions, i.e,
+    `record['request']['requestID']`. The dict and its JSON serialization
+    are built at most once and shared by all handlers; changing the record
+    as a mapping changes that dict.
+    """
+
+    __slots__ = ('source', 'start_time', 'action_id', 'description',
+                 'request', 'response', 'latency', 'extra', '_dict', '_json')
+
+    def __init__(self, source: str, start_time: str, action_id: str,
+                 description: Optional[str], request: RequestRecord,
+                 response: ResponseRecord, latency: Any = UNSET,
+                 extra: Optional[dict] = None) -> None:
+        """Initialize an object of the class.
+
+        Args:
+            source: Name of the source.
+            start_time: Formatted time the extraction started.
+            action_id: Unique identifier of the action.
+            description: A description of the action.
+            request: Fields extracted from the request.
+            response: Fields extracted from the response.
+            latency: Duration of the extraction, if logged.
+            extra: Extra information merged in the audit log.
+        """
+        self.source = source
+        self.start_time = start_time
+        self.action_id = action_id
+        self.description = description
+        self.request = request
+        self.response = response
+        self.latency = latency
+        self.extra = extra
+        self._dict: Optional[dict] = None
+        self._json: Optional[str] = None
+
+    def to_dict(self) -> dict:
+        """Return the audit log as a nested dict, it is built once."""
+        if self._dict is None:
+            result = {
+                attributes.SOURCE_NAME: self.source,
+                attributes.START_TIME: self.start_time,
+                attributes.ACTION_ID: self.action_id,
+                attributes.ACTION_DESCRIPTION: self.description,
+                attributes.REQUEST: self.request.to_dict(),
+                attributes.RESPONSE: self.response.to_dict(),
+            }
+            if self.latency is not UNSET:
+                result[attributes.LATENCY] = self.latency
+
+            if self.extra:
+                result.update(self.extra)
+
+            self._dict = result
+
+        return self._dict
+
+    def to_json(self) -> str:
+        """Return the audit log serialized to compact JSON, it is serialized
+        once."""
+        if self._json is None:
+            self._json = json.dumps(self.to_dict(), separators=(',', ':'),
+                                    default=str)
+
+        return self._json
+
+    def update_extra(self, values: Dict[str, Any]) -> None:
+        """Merge extra information in the audit log."""
+        if self.extra is None:
+            self.extra = {}
+
+        self.extra.update(values)
+        self._dict = self._json = None
+
+    def __getitem__(self, key: str) -> Any:
+        return self.to_dict()[key]
+
+    def __setitem__(self, key: str, value: Any) -> None:
+        self.to_dict()[key] = value
+        self._json = None
+
+    def __delitem__(self, key: str) -> None:
+        del self.to_dict()[key]
+        self._json = None
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.to_dict())
+
+    def __len__(self) -> int:
+        return len(self.to_dict())
+
+    def __repr__(self) -> str:
+        return repr(self.to_dict())
+
+
+def accepts_records(handler: Any) -> bool:
+    """Return true when a handler opted in to receive `AuditRecord` objects
+    instead of dicts, i.e, sinks."""
+    return bool(getattr(handler, 'accepts_records', False))
+
+
+def handler_input(handler: Any, record: AuditRecord) -> Any:
+    """Return the audit log as a handler expects it, the record itself or
+    its dict.
+
+    Args:
+        handler: Audit log handler.
+        record: Extracted audit record.
+    """
+    if accepts_records(handler):
+        return record
+
+    return record.to_dict()
+
+
+def dumps(audit_log: Any) -> str:
+    """Serialize an audit log to a compact JSON string.
+
+    Audit records are serialized once and shared by all sinks.
+
+    Args:
+        audit_log: Audit log to serialize.
+    """
+    to_json = getattr(audit_log, 'to_json', None)
+    if to_json is not None:
+        return to_json()
+
+    return json.dumps(audit_log, separators=(',', ':'), default=str)
@@ -0,0 +1,406 @@
+"""Implements the replay of stored audit logs through audit log handlers.
+
+Stored audit logs are read from JSON lines files, `HTTPSink` spool
+directories, `SegmentedLogSink` directories or `SQLiteSink` databases, and
+delivered in batches by a pool of threads, i.e, to backfill a sink after an
+outage. Each file, segment or database is a source whose position is saved
+in a checkpoint file, so an interrupted replay resumes where it stopped.
+
+Delivery is at least once: the position of a source only moves past batches
+which were delivered, along with every batch before them, so batches after a
+failed one are delivered again by the next run.
+"""
+import collections
+import functools
+import gzip
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable
+from typing import Deque
+from typing import Dict
+from typing import Iterator
+from typing import List
+from typing import Optional
+from typing import Set
+from typing import Tuple
+
+from . import attributes
+from .config import AuditLoggerConfig
+from .sinks.base import parse_start_time
+from .sinks.http import SPOOL_SUFFIX
+from .sinks.segment import Segment
+from .sinks.segment import SegmentedLogReader
+
+logger = logging.getLogger('flask_auditor')
+
+# Suffixes of the JSON lines files read from a directory.
+JSON_LINES_SUFFIXES = ('.jsonl', '.ndjson', '.jsonl.gz', SPOOL_SUFFIX)
+
+_SQLITE_MAGIC = b'SQLite format 3\x00'
+
+# Name of a source and a callable yielding `(position, line)` pairs from a
+# position. Positions increase, the position of a line is skipped once the
+# line was delivered.
+Source = Tuple[str, Callable[[int], Iterator[Tuple[int, bytes]]]]
+
+
+def _read_json_lines(path: str, position: int) -> Iterator[Tuple[int, bytes]]:
+    """Yield the lines of a JSON lines file, gzipped or not."""
+    opener = gzip.open if path.endswith('.gz') else open
+    with opener(path, 'rb') as f:
+        for i, line in enumerate(f):
+            if i >= position and line.strip():
+                yield i, line
+
+
+def _read_segment(segment: Segment,
+                  position: int) -> Iterator[Tuple[int, bytes]]:
+    """Yield the lines of a segment."""
+    for i, line in enumerate(segment.lines()):
+        if i >= position:
+            yield i, line
+
+
+def _read_sqlite(path: str, table: str,
+                 position: int) -> Iterator[Tuple[int, bytes]]:
+    """Yield the audit logs of a SQLite database by row ID."""
+    conn = sqlite3.connect(f'file:{path}?mode=ro', uri=True)
+    try:
+        cursor = conn.execute(
+            f'SELECT id, data FROM {table} WHERE id >= ? ORDER BY id',
+            (position,))
+        for row_id, data in cursor:
+            yield row_id, data.encode('utf-8')
+    finally:
+        conn.close()
+
+
+def find_sources(path: str, table: str = 'audit_logs') -> List[Source]:
+    """Return the sources of a path in the order they were written.
+
+    Args:
+        path: A JSON lines file, a SQLite database, a segmented log directory
+              or a directory of JSON lines files, i.e, an `HTTPSink` spool.
+        table: Name of the table of a SQLite database.
+
+    Raises:
+        ValueError: When the table name is invalid.
+    """
+    path = os.path.abspath(path)
+    if os.path.isdir(path):
+        segments = SegmentedLogReader(path).segments()
+        if segments:
+            # Named by base, the name is kept when a segment is compressed.
+            return [(x.base, functools.partial(_read_segment, x))
+                    for x in segments]
+
+        return [(os.path.join(path, x),
+                 functools.partial(_read_json_lines, os.path.join(path, x)))
+                for x in sorted(os.listdir(path))
+                if x.endswith(JSON_LINES_SUFFIXES)]
+
+    with open(path, 'rb') as f:
+        magic = f.read(len(_SQLITE_MAGIC))
+
+    if magic == _SQLITE_MAGIC:
+        if not table.isidentifier():
+            raise ValueError(f'Invalid table name: {table}.')
+        return [(path, functools.partial(_read_sqlite, path, table))]
+
+    return [(path, functools.partial(_read_json_lines, path))]
+
+
+class Checkpoint:
+    """Positions of the sources of a replay, saved to a JSON file."""
+
+    def __init__(self, path: Optional[str] = None) -> None:
+        """Initialize an object of the class.
+
+        Args:
+            path: Path of the checkpoint file, positions are kept in memory
+                  only if not set.
+        """
+        self.path = path
+        self.positions: Dict[str, int] = {}
+        # Source -> batches in flight, as `[source, position, delivered]`.
+        self._pending: Dict[str, Deque[list]] = {}
+        self._lock = threading.Lock()
+        if path and os.path.exists(path):
+            with open(path) as f:
+                self.positions = json.load(f)['positions']
+
+    def get(self, source: str) -> int:
+        """Return the position to resume a source from."""
+        return self.positions.get(source, 0)
+
+    def begin(self, source: str, position: int) -> list:
+        """Track a batch of a source ending before `position`.
+
+        Return:
+            A token passed to `done` once the batch was delivered.
+        """
+        token = [source, position, False]
+        with self._lock:
+            self._pending.setdefault(source, collections.deque()).append(
+                token)
+        return token
+
+    def done(self, token: list) -> None:
+        """Mark a batch delivered, the position of its source moves past it
+        once the batches before it are delivered too."""
+        source = token[0]
+        with self._lock:
+            token[2] = True
+            pending = self._pending[source]
+            while pending and pending[0][2]:
+                self.positions[source] = pending.popleft()[1]
+
+    def save(self) -> None:
+        """Write the positions atomically."""
+        if not self.path:
+            return
+
+        with self._lock:
+            data = json.dumps({'positions': self.positions}, indent=2)
+
+        with open(self.path + '.tmp', 'w') as f:
+            f.write(data)
+        os.replace(self.path + '.tmp', self.path)
+
+
+class ReplayStats:
+    """Counters of a replay."""
+
+    def __init__(self) -> None:
+        """Initialize an object of the class."""
+        self.read = 0
+        self.delivered = 0
+        self.failed = 0
+        self.duplicates = 0
+        self.filtered = 0
+        self.invalid = 0
+        self.started = time.monotonic()
+        self.finished: Optional[float] = None
+        self.lock = threading.Lock()
+
+    @property
+    def elapsed(self) -> float:
+        """Return the duration in seconds of the replay."""
+        return (self.finished or time.monotonic()) - self.started
+
+    @property
+    def rate(self) -> float:
+        """Return the number of audit logs delivered per second."""
+        return self.delivered / max(self.elapsed, 1e-9)
+
+    def __str__(self) -> str:
+        return (f'{self.read} read, {self.delivered} delivered, '
+                f'{self.failed} failed, {self.duplicates} duplicates, '
+                f'{self.filtered} filtered, {self.invalid} invalid in '
+                f'{self.elapsed:.1f}s ({self.rate:.0f} audit logs/s)')
+
+
+class RateLimiter:
+    """Paces batches to a maximum number of audit logs per second."""
+
+    def __init__(self, rate: float) -> None:
+        """Initialize an object of the class.
+
+        Args:
+            rate: Maximum number of audit logs per second.
+        """
+        self.rate = rate
+        self._next = 0.0
+
+    def acquire(self, count: int) -> None:
+        """Wait until `count` audit logs may be sent."""
+        now = time.monotonic()
+        self._next = max(self._next, now)
+        delay = self._next - now
+        self._next += count / self.rate
+        if delay > 0:
+            time.sleep(delay)
+
+
+class Replayer:
+    """Re-delivers stored audit logs in parallel batches."""
+
+    def __init__(self, deliver: Callable[[List[dict]], None],
+                 workers: int = 4, batch_size: int = 500,
+                 rate: Optional[float] = None,
+                 checkpoint: Optional[str] = None,
+                 checkpoint_interval: float = 5.0,
+                 dedupe: bool = True,
+                 start: Optional[float] = None,
+                 end: Optional[float] = None,
+                 table: str = 'audit_logs',
+                 datetime_format: str = AuditLoggerConfig.datetime_format,
+                 not_available: str = AuditLoggerConfig.not_available
+                 ) -> None:
+        """Initialize an object of the class.
+
+        Args:
+            deliver: A callable writing a batch of audit logs, i.e,
+                     `FlaskAuditor.deliver`. It is called from several
+                     threads and raises when the batch was not delivered.
+            workers: Number of threads delivering batches.
+            batch_size: Maximum number of audit logs per batch.
+            rate: Maximum number of audit logs delivered per second.
+            checkpoint: Path of the checkpoint file.
+            checkpoint_interval: Time in seconds between two saves of the
+                                 checkpoint.
+            dedupe: Set to true to skip audit logs with the request ID and
+                    the start time of an audit log already read. Audit logs
+                    without a request ID are never skipped.
+            start: Replay audit logs started at or after this timestamp.
+            end: Replay audit logs started before this timestamp.
+            table: Name of the table of SQLite databases.
+            datetime_format: Format of the `startTime` attribute.
+            not_available: Value of the request ID when it is missing.
+        """
+        self.deliver = deliver
+        self.workers = workers
+        self.batch_size = batch_size
+        self.limiter = RateLimiter(rate) if rate else None
+        self.checkpoint = Checkpoint(checkpoint)
+        self.checkpoint_interval = checkpoint_interval
+        self.dedupe = dedupe
+        self.start = start
+        self.end = end
+        self.table = table
+        self.datetime_format = datetime_format
+        self.not_available = not_available
+        self.stats = ReplayStats()
+        self._seen: Set[int] = set()
+        self._slots = threading.BoundedSemaphore(workers * 2)
+
+    def run(self, paths: List[str],
+            progress: Optional[Callable[[ReplayStats], None]] = None,
+            progress_interval: float = 10.0) -> ReplayStats:
+        """Replay the audit logs of the given paths, see `find_sources`.
+
+        Args:
+            paths: Paths of the stored audit logs.
+            progress: A callable receiving the stats periodically.
+            progress_interval: Time in seconds between two progress calls.
+        """
+        self.stats = stats = ReplayStats()
+        last_save = last_progress = time.monotonic()
+        try:
+            with ThreadPoolExecutor(
+                    self.workers,
+                    thread_name_prefix='FlaskAuditorReplay') as executor:
+                for path in paths:
+                    for source, read in find_sources(path, self.table):
+                        for batch, position in self._batches(source, read):
+                            self._submit(executor, source, batch, position)
+
+                            now = time.monotonic()
+                            if now - last_save >= self.checkpoint_interval:
+                                self.checkpoint.save()
+                                last_save = now
+                            if (progress is not None and now - last_progress
+                                    >= progress_interval):
+                                progress(stats)
+                                last_progress = now
+        finally:
+            self.checkpoint.save()
+            stats.finished = time.monotonic()
+
+        return stats
+
+    def _batches(self, source: str, read: Callable
+                 ) -> Iterator[Tuple[List[dict], int]]:
+        """Yield batches of a source with the position following them."""
+        stats = self.stats
+        batch = []
+        position = self.checkpoint.get(source)
+        for offset, line in read(position):
+            stats.read += 1
+            position = offset + 1
+            try:
+                audit_log = json.loads(line)
+            except ValueError:
+                audit_log = None
+
+            # Valid JSON which is not an object is not an audit log either.
+            if not isinstance(audit_log, dict):
+                stats.invalid += 1
+                continue
+
+            if not self._match(audit_log):
+                stats.filtered += 1
+                continue
+
+            if self.dedupe and self._is_duplicate(audit_log):
+                stats.duplicates += 1
+                continue
+
+            batch.append(audit_log)
+            if len(batch) >= self.batch_size:
+                yield batch, position
+                batch = []
+
+        if batch or position != self.checkpoint.get(source):
+            yield batch, position
+
+    def _match(self, audit_log: dict) -> bool:
+        """Return true when an audit log is within the time filters."""
+        if self.start is None and self.end is None:
+            return True
+
+        ts = parse_start_time(audit_log, self.datetime_format)
+        return ((self.start is None or ts >= self.start)
+                and (self.end is None or ts < self.end))
+
+    def _is_duplicate(self, audit_log: dict) -> bool:
+        """Return true when an audit log with the same request ID and start
+        time was read before."""
+        req = audit_log.get(attributes.REQUEST)
+        request_id = req.get(attributes.REQUEST_ID) if isinstance(
+            req, dict) else None
+        if request_id is None or request_id == self.not_available:
+            return False
+
+        # Hashes keep the memory of the seen keys small.
+        key = hash((request_id, audit_log.get(attributes.START_TIME)))
+        if key in self._seen:
+            return True
+
+        self._seen.add(key)
+        return False
+
+    def _submit(self, executor: ThreadPoolExecutor, source: str,
+                batch: List[dict], position: int) -> None:
+        """Deliver a batch on a worker, at most two batches per worker are in
+        flight."""
+        token = self.checkpoint.begin(source, position)
+        if not batch:
+            self.checkpoint.done(token)
+            return
+
+        if self.limiter is not None:
+            self.limiter.acquire(len(batch))
+
+        self._slots.acquire()
+        executor.submit(self._deliver, batch, token)
+
+    def _deliver(self, batch: List[dict], token: list) -> None:
+        """Deliver a batch and move the checkpoint past it."""
+        try:
+            self.deliver(batch)
+        except Exception:  # noqa
+            logger.exception('Failed to replay %d audit logs.', len(batch))
+            with self.stats.lock:
+                self.stats.failed += len(batch)
+        else:
+            with self.stats.lock:
+                self.stats.delivered += len(batch)
+            self.checkpoint.done(token)
+        finally:
+            self._slots.release()
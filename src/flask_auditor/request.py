@@ -1,17 +1,72 @@
 """Implements the Request Logger."""
+from typing import Any
+from typing import Callable
 from typing import Optional
 from typing import Tuple
-from urllib.parse import parse_qs
 
 from flask import Request
 
-from . import attributes
 from .base import BaseAuditLogger
+from .config import AuditLoggerConfig
+from .record import RequestRecord
+
+# Environ key flagging a copied request whose body was dropped.
+BODY_DROPPED = 'flask_auditor.body_dropped'
 
 
 class RequestLogger(BaseAuditLogger):
     """Request logger class to extract Http request parameters."""
 
+    def __init__(self, cfg: Optional[AuditLoggerConfig] = None):
+        """Initialize an object of the class.
+
+        Args:
+            cfg (Optional[AuditLoggerConfig]): Configuration object.
+        """
+        super().__init__(cfg)
+        self.plan = self.compile()
+
+    def compile(self) -> Tuple[Tuple[str, Callable[[Request], Any]], ...]:
+        """Compile the extraction plan of the config.
+
+        Return:
+            A tuple of `(slot, getter)` pairs for the enabled fields, so
+            extracting a request does not check every option again. Slots are
+            the fields of `RequestRecord`.
+        """
+        steps = (
+            ('log_server', 'server_host',
+             lambda req: self.get_server_info(req)[0]),
+            ('log_server', 'server_port',
+             lambda req: self.get_server_info(req)[1]),
+            ('log_request_id', 'request_id', self.get_request_id),
+            ('log_remote_ip', 'remote_ip',
+             self.get_remote_address),
+            ('log_remote_port', 'remote_port',
+             self.get_remote_port),
+            ('log_protocol', 'protocol', self.get_protocol),
+            ('log_host', 'host', self.get_host),
+            ('log_method', 'method', self.get_method),
+            ('log_uri', 'uri', self.get_uri),
+            ('log_uri_path', 'uri_path', self.get_uri_path),
+            ('log_route_path', 'route_path',
+             self.get_route_path),
+            ('log_referer', 'referer',
+             self.get_http_referer),
+            ('log_user_agent', 'user_agent',
+             self.get_user_agent),
+            ('log_content_length', 'content_length',
+             self.get_content_length),
+            ('log_request_headers', 'headers',
+             self.get_headers),
+            ('log_query_params', 'query_params',
+             self.get_query_params),
+            ('log_request_body', 'body',
+             self._get_logged_request_body),
+        )
+        return tuple((slot, getter) for opt, slot, getter in steps
+                     if getattr(self.cfg, opt))
+
     def extract(self, flask_req: Request) -> dict:
         """Extract request audit log.
 
@@ -21,72 +76,36 @@ class RequestLogger(BaseAuditLogger):
         Return:
              A dictionary.
         """
-        log_values = {}
-
-        if self.cfg.log_server:
-            host, port = self.get_server_info(flask_req)
-            log_values[attributes.SERVER_HOST] = host
-            log_values[attributes.SERVER_PORT] = port
-
-        if self.cfg.log_request_id:
-            log_values[attributes.REQUEST_ID] = self.get_request_id(flask_req)
-
-        if self.cfg.log_remote_ip:
-            log_values[attributes.REQUEST_REMOTE_IP] = self.get_remote_address(
-                flask_req)
-
-        if self.cfg.log_remote_port:
-            log_values[attributes.REQUEST_REMOTE_PORT] = self.get_remote_port(
-                flask_req)
-
-        if self.cfg.log_protocol:
-            log_values[attributes.REQUEST_PROTOCOL] = self.get_protocol(
-                flask_req)
+        return self.extract_record(flask_req).to_dict()
 
-        if self.cfg.log_host:
-            log_values[attributes.REQUEST_HOST] = self.get_host(flask_req)
+    def extract_record(self, flask_req: Request) -> RequestRecord:
+        """Extract request audit log to a record.
 
-        if self.cfg.log_method:
-            log_values[attributes.REQUEST_METHOD] = self.get_method(flask_req)
-
-        if self.cfg.log_uri:
-            log_values[attributes.REQUEST_URI] = self.get_uri(flask_req)
-
-        if self.cfg.log_uri_path:
-            log_values[attributes.REQUEST_URI_PATH] = self.get_uri_path(
-                flask_req)
-
-        if self.cfg.log_route_path:
-            log_values[attributes.REQUEST_ROUTE_PATH] = self.get_route_path(
-                flask_req)
-
-        if self.cfg.log_referer:
-            log_values[attributes.REQUEST_HTTP_REFERER] = self.get_http_referer(
-                flask_req)
-
-        if self.cfg.log_user_agent:
-            log_values[attributes.REQUEST_USER_AGENT] = self.get_user_agent(
-                flask_req)
-
-        if self.cfg.log_content_length:
-            key = attributes.REQUEST_CONTENT_LENGTH
-            log_values[key] = self.get_content_length(flask_req)
+        Args:
+            flask_req (Request): Flask request object.
+        """
+        record = RequestRecord(self.cfg.not_available)
+        for slot, getter in self.plan:
+            setattr(record, slot, getter(flask_req))
 
-        if self.cfg.log_request_headers:
-            log_values[attributes.REQUEST_HEADERS] = self.get_headers(flask_req)
+        return record
 
-        if self.cfg.log_query_params:
-            log_values[attributes.REQUEST_QUERY_PARAMS] = self.get_query_params(
-                flask_req)
+    def _get_logged_request_body(self, flask_req: Request) -> dict:
+        """Return request body without sensitive parameters unless the config
+        allows to log them.
 
-        if self.cfg.log_request_body:
-            req_body = self.get_request_body(flask_req)
-            if not self.cfg.log_sensitive_data:
-                req_body = self.remove_sensitive_parameters(req_body)
+        Args:
+            flask_req (Request): Flask request object.
+        """
+        if flask_req.environ.get(BODY_DROPPED):
+            # The body was not kept to stay within the memory budget.
+            return None
 
-            log_values[attributes.REQUEST_BODY] = req_body
+        req_body = self.get_request_body(flask_req)
+        if not self.cfg.log_sensitive_data:
+            req_body = self.remove_sensitive_parameters(req_body)
 
-        return self.convert_none_record(log_values)
+        return req_body
 
     @staticmethod
     def get_server_info(flask_req: Request) -> Tuple[str, int]:
@@ -231,10 +250,19 @@ class RequestLogger(BaseAuditLogger):
     def get_query_params(flask_req: Request) -> dict:
         """Return request query string. The part of the URL after the `?`.
 
+        The arguments already parsed by Flask are reused, blank values are
+        left out like `urllib.parse.parse_qs` does.
+
         Args:
             flask_req (Request): Flask request object.
         """
-        return parse_qs(flask_req.query_string.decode('UTF-8'))
+        params = {}
+        for key, values in flask_req.args.lists():
+            values = [v for v in values if v]
+            if values:
+                params[key] = values
+
+        return params
 
     @staticmethod
     def get_request_body(flask_req: Request) -> dict:
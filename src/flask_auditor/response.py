@@ -1,30 +1,55 @@
 """Implements the Response Logger."""
+from typing import Any
+from typing import Callable
+from typing import Optional
+from typing import Tuple
+
 from flask import Response
 from werkzeug import http
 
-from . import attributes
 from .base import BaseAuditLogger
+from .config import AuditLoggerConfig
+from .record import ResponseRecord
 
 
 class ResponseLogger(BaseAuditLogger):
     """Response logger class to extract http response parameters."""
 
-    def extract(self, flask_resp: Response) -> dict:
-        """Extract response audit log."""
-        log_values = {}
+    def __init__(self, cfg: Optional[AuditLoggerConfig] = None):
+        """Initialize an object of the class.
+
+        Args:
+            cfg (Optional[AuditLoggerConfig]): Configuration object.
+        """
+        super().__init__(cfg)
+        self.plan = self.compile()
+
+    def compile(self) -> Tuple[Tuple[str, Callable[[Response], Any]], ...]:
+        """Compile the extraction plan of the config.
 
-        if self.cfg.log_status_code:
-            log_values[attributes.RESPONSE_STATUS_CODE] = self.get_status_code(
-                flask_resp)
+        Return:
+            A tuple of `(slot, getter)` pairs for the enabled fields, slots
+            are the fields of `ResponseRecord`.
+        """
+        steps = (
+            ('log_status_code', 'status_code', self.get_status_code),
+            ('log_status', 'status', self.get_status),
+            ('log_response_size', 'size', self.get_response_size),
+        )
+        return tuple((slot, getter) for opt, slot, getter in steps
+                     if getattr(self.cfg, opt))
 
-        if self.cfg.log_status:
-            log_values[attributes.RESPONSE_STATUS] = self.get_status(flask_resp)
+    def extract(self, flask_resp: Response) -> dict:
+        """Extract response audit log."""
+        return self.extract_record(flask_resp).to_dict()
 
-        if self.cfg.log_response_size:
-            log_values[attributes.RESPONSE_SIZE] = self.get_response_size(
-                flask_resp)
+    def extract_record(self, flask_resp: Response) -> ResponseRecord:
+        """Extract response audit log to a record."""
+        record = ResponseRecord(self.cfg.not_available)
+        for slot, getter in self.plan:
+            setattr(record, slot, getter(flask_resp))
 
-        return self.convert_none_record(log_values)
+        return record
 
     @staticmethod
     def get_status_code(flask_resp: Response) -> int:
@@ -0,0 +1,12 @@
+"""Built-in audit log sinks.
+
+Sinks are audit log handlers writing audit logs in background batches, they
+can be registered with `FlaskAuditor.register_log_handler`.
+"""
+from .base import BaseSink
+from .http import HTTPSink
+from .segment import SegmentCompressor
+from .segment import SegmentedLogReader
+from .segment import SegmentedLogSink
+from .socket import SocketSink
+from .sqlite import SQLiteSink
@@ -0,0 +1,407 @@
+"""Implement base classes shared by the built-in audit log sinks."""
+import abc
+import logging
+import os
+import queue
+import random
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Any
+from typing import Callable
+from typing import Iterator
+from typing import List
+from typing import Optional
+from typing import Union
+
+from .. import attributes
+from .. import forksafe
+from ..integrity import IntegrityChain
+from ..record import dumps  # noqa: F401
+
+logger = logging.getLogger('flask_auditor')
+
+# Marker put on the queue to ask the writer threads to exit.
+_STOP = object()
+
+TimeFilter = Optional[Union[datetime, float, int]]
+
+
+def parse_start_time(audit_log: dict, datetime_format: str) -> float:
+    """Return the `startTime` of an audit log as a POSIX timestamp.
+
+    The current time is returned when the value cannot be parsed with the
+    given format.
+
+    Args:
+        audit_log: Audit log to read the start time from.
+        datetime_format: Format used by `AuditLoggerConfig.datetime_format`.
+    """
+    value = audit_log.get(attributes.START_TIME)
+    if isinstance(value, str):
+        try:
+            return datetime.strptime(value, datetime_format).timestamp()
+        except ValueError:
+            pass
+
+    return time.time()
+
+
+def to_timestamp(value: TimeFilter) -> Optional[float]:
+    """Convert a datetime or a POSIX timestamp filter to a timestamp."""
+    if isinstance(value, datetime):
+        return value.timestamp()
+
+    return value
+
+
+def process_alive(pid: int) -> bool:
+    """Return whether a process is running."""
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        # The process exists but belongs to another user.
+        return True
+    except OSError:
+        return False
+
+    return True
+
+
+class Backoff:
+    """Exponential backoff with optional full jitter."""
+
+    def __init__(self, initial: float = 0.1, maximum: float = 10.0,
+                 factor: float = 2.0, jitter: bool = False) -> None:
+        """Initialize an object of the class.
+
+        Args:
+            initial: Delay in seconds before the first retry.
+            maximum: Upper bound of the delay in seconds.
+            factor: Multiplier applied to the delay after each attempt.
+            jitter: Set to true to pick a random delay in `[0, delay]`.
+        """
+        self.initial = initial
+        self.maximum = maximum
+        self.factor = factor
+        self.jitter = jitter
+        self._attempts = 0
+
+    def next_delay(self) -> float:
+        """Return the delay to wait before the next attempt."""
+        delay = min(self.maximum, self.initial * self.factor ** self._attempts)
+        self._attempts += 1
+        if self.jitter:
+            return random.uniform(0, delay)
+
+        return delay
+
+    def reset(self) -> None:
+        """Reset the backoff after a successful attempt."""
+        self._attempts = 0
+
+
+class ConnectionPool:
+    """A small thread-safe pool of persistent connections."""
+
+    def __init__(self, factory: Callable[[], Any], size: int = 2,
+                 close: Optional[Callable[[Any], None]] = None,
+                 validate: Optional[Callable[[Any], bool]] = None) -> None:
+        """Initialize an object of the class.
+
+        Args:
+            factory: A callable returning a new connected connection.
+            size: Maximum number of idle connections kept in the pool.
+            close: A callable to close a connection, `conn.close()` is used
+                   by default.
+            validate: A callable returning false when an idle connection was
+                      closed by the peer and must not be reused.
+        """
+        self._factory = factory
+        self._close = close or (lambda conn: conn.close())
+        self._validate = validate
+        self._idle = queue.LifoQueue(maxsize=size)
+        self.size = size
+        forksafe.register(self)
+
+    @contextmanager
+    def connection(self) -> Iterator[Any]:
+        """Borrow a connection from the pool.
+
+        The connection is discarded instead of being returned to the pool
+        when the block raises, so a broken connection is never reused.
+        """
+        conn = None
+        while conn is None:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                conn = self._factory()
+                break
+
+            if self._validate and not self._validate(conn):
+                self.discard(conn)
+                conn = None
+
+        try:
+            yield conn
+        except BaseException:
+            self.discard(conn)
+            raise
+
+        try:
+            self._idle.put_nowait(conn)
+        except queue.Full:
+            self.discard(conn)
+
+    def discard(self, conn: Any) -> None:
+        """Close a connection without returning it to the pool."""
+        try:
+            self._close(conn)
+        except Exception:  # noqa
+            pass
+
+    def clear(self) -> None:
+        """Close all idle connections."""
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                return
+
+            self.discard(conn)
+
+    def _after_fork(self) -> None:
+        """Drop connections inherited from the parent process."""
+        idle, self._idle = self._idle, queue.LifoQueue(maxsize=self.size)
+        # Closing the copies only releases the file descriptors of the child,
+        # the connections of the parent stay open.
+        for conn in idle.queue:
+            self.discard(conn)
+
+
+class BaseSink(metaclass=abc.ABCMeta):
+    """Base class for buffered audit log sinks.
+
+    A sink is an audit log handler, it can be registered with
+    `FlaskAuditor.register_log_handler`. Calling the sink only puts the audit
+    log on an in-memory queue; writer threads drain the queue in batches and
+    pass them to `write_batch`, so the request path never waits on I/O.
+
+    With an integrity key, each batch is sealed into a hash chain by the
+    writer thread before it is written, see `flask_auditor.integrity`.
+    """
+
+    # Sinks receive audit records, see `FlaskAuditor.register_log_handler`.
+    accepts_records = True
+
+    # Maximum time in seconds of a direct write, unbounded when not set.
+    sync_timeout: Optional[float] = None
+
+    def __init__(self, batch_size: int = 100, flush_interval: float = 1.0,
+                 max_queue_size: int = 10000, workers: int = 1,
+                 integrity_key: Optional[Union[str, bytes]] = None) -> None:
+        """Initialize an object of the class.
+
+        Args:
+            batch_size: Maximum number of audit logs written at once.
+            flush_interval: Maximum time in seconds an audit log waits in the
+                            queue before a partial batch is written.
+            max_queue_size: Audit logs are dropped when the queue is full.
+            workers: Number of writer threads.
+            integrity_key: Secret key sealing the written audit logs into a
+                           hash chain. Writer threads write sealed batches
+                           one at a time.
+        """
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_queue_size = max_queue_size
+        self.workers = workers
+        self.dropped = 0
+        self._queue = queue.Queue(maxsize=max_queue_size)
+        self._threads: List[threading.Thread] = []
+        self._lock = threading.Lock()
+        self._closed = False
+        self.integrity: Optional[IntegrityChain] = None
+        self._integrity_lock = threading.Lock()
+        if integrity_key is not None:
+            self.integrity = IntegrityChain(integrity_key)
+        forksafe.register(self)
+
+    def __call__(self, audit_log: dict) -> None:
+        """Enqueue an audit log to be written in background."""
+        if self._closed:
+            return
+
+        self._ensure_started()
+        try:
+            self._queue.put_nowait(audit_log)
+        except queue.Full:
+            self.dropped += 1
+
+    def write(self, audit_log: dict) -> None:
+        """Write an audit log in the calling thread, bypassing the queue.
+
+        Errors are raised to the caller instead of being logged.
+        """
+        self._write_direct([audit_log])
+
+    def write_many(self, batch: List[dict]) -> None:
+        """Write a batch of audit logs in the calling thread, bypassing the
+        queue, i.e, to replay stored audit logs.
+
+        Errors are raised to the caller instead of being logged, and
+        nothing is buffered by the sink to be retried later.
+        """
+        self._write_direct(batch)
+
+    @abc.abstractmethod
+    def write_batch(self, batch: List[dict]) -> None:
+        """Write a batch of audit logs."""
+        raise NotImplementedError("must be implemented in subclass.")
+
+    def write_direct(self, batch: List[dict],
+                     deadline: Optional[float] = None) -> None:
+        """Write a batch of audit logs for a caller waiting for it.
+
+        Sinks whose `write_batch` keeps undelivered audit logs to retry them
+        later, or retries for long, override it to fail fast instead.
+
+        Args:
+            batch: Audit logs to write.
+            deadline: Monotonic time by which the write must be done, set
+                      from `sync_timeout`.
+        """
+        self.write_batch(batch)
+
+    def flush(self) -> None:
+        """Block until all enqueued audit logs have been written."""
+        if self._threads:
+            self._queue.join()
+
+    def close(self) -> None:
+        """Write pending audit logs, stop writer threads and release
+        resources held by the sink."""
+        with self._lock:
+            if self._closed:
+                return
+
+            self._closed = True
+            threads, self._threads = self._threads, []
+
+        for _ in threads:
+            self._queue.put(_STOP)
+
+        for thr in threads:
+            thr.join()
+
+        self._close()
+
+    def _close(self) -> None:
+        """Release resources held by the sink, i.e, connections."""
+
+    def _write(self, batch: List[dict],
+               write_batch: Optional[Callable[[List[dict]], None]] = None,
+               deadline: Optional[float] = None) -> None:
+        """Seal a batch when an integrity key is set, then write it.
+
+        Args:
+            batch: Audit logs to write.
+            write_batch: Method writing the batch, `write_batch` by default.
+            deadline: Monotonic time after which waiting for the batches
+                      being written is given up.
+
+        Raises:
+            TimeoutError: The deadline expired before the batch was sealed.
+        """
+        write_batch = write_batch or self.write_batch
+        if self.integrity is None:
+            write_batch(batch)
+            return
+
+        # Batches are written in the order of the chain, a writer thread may
+        # hold the lock while it retries a batch.
+        timeout = -1
+        if deadline is not None:
+            timeout = max(deadline - time.monotonic(), 0.0)
+        if not self._integrity_lock.acquire(timeout=timeout):
+            raise TimeoutError(f'{self.__class__.__name__} timed out waiting '
+                               f'for the batch being written.')
+
+        try:
+            write_batch(self.integrity.seal(batch))
+        finally:
+            self._integrity_lock.release()
+
+    def _write_direct(self, batch: List[dict]) -> None:
+        """Write a batch for a caller waiting for it, within
+        `sync_timeout`."""
+        deadline = None
+        if self.sync_timeout is not None:
+            deadline = time.monotonic() + self.sync_timeout
+
+        self._write(batch, lambda x: self.write_direct(x, deadline), deadline)
+
+    def _after_fork(self) -> None:
+        """Drop the writer threads and the queue inherited from the parent
+        process, the parent writes the audit logs it has enqueued."""
+        self._queue = queue.Queue(maxsize=self.max_queue_size)
+        self._threads = []
+        self._lock = threading.Lock()
+        self._integrity_lock = threading.Lock()
+
+    def _ensure_started(self) -> None:
+        """Start writer threads on first use."""
+        if self._threads:
+            return
+
+        with self._lock:
+            if self._threads or self._closed:
+                return
+
+            for i in range(self.workers):
+                thr = threading.Thread(
+                    target=self._run,
+                    name=f'{self.__class__.__name__}-{i}',
+                    daemon=True)
+                thr.start()
+                self._threads.append(thr)
+
+    def _run(self) -> None:
+        """Writer loop, collect batches from the queue and write them."""
+        while True:
+            item = self._queue.get()
+            if item is _STOP:
+                self._queue.task_done()
+                return
+
+            batch = [item]
+            stop = False
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                try:
+                    item = self._queue.get(
+                        timeout=max(0.0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+
+                if item is _STOP:
+                    stop = True
+                    break
+
+                batch.append(item)
+
+            try:
+                self._write(batch)
+            except Exception:  # noqa
+                logger.exception('%s failed to write %d audit logs.',
+                                 self.__class__.__name__, len(batch))
+            finally:
+                for _ in range(len(batch) + stop):
+                    self._queue.task_done()
+
+            if stop:
+                return
@@ -0,0 +1,83 @@
+"""Implements the compression codecs of file-based sinks.
+
+gzip is always available. zstd is used when the optional `zstandard` package
+is installed, it compresses several times faster at a similar ratio.
+"""
+import gzip
+from typing import Callable
+from typing import Dict
+from typing import Optional
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover
+    zstandard = None
+
+
+class Codec:
+    """A compression codec, each call to `compress` returns one
+    self-contained frame."""
+
+    def __init__(self, name: str, suffix: str,
+                 compress: Callable[[bytes, Optional[int]], bytes],
+                 decompress: Callable[[bytes], bytes]) -> None:
+        """Initialize an object of the class.
+
+        Args:
+            name: Name of the codec.
+            suffix: Suffix of the compressed files.
+            compress: A callable compressing data at an optional level.
+            decompress: A callable decompressing one frame.
+        """
+        self.name = name
+        self.suffix = suffix
+        self._compress = compress
+        self._decompress = decompress
+
+    def compress(self, data: bytes, level: Optional[int] = None) -> bytes:
+        """Compress data to a single frame."""
+        return self._compress(data, level)
+
+    def decompress(self, data: bytes) -> bytes:
+        """Decompress a single frame."""
+        return self._decompress(data)
+
+    def __repr__(self) -> str:
+        return f'Codec({self.name!r})'
+
+
+def _gzip_compress(data: bytes, level: Optional[int]) -> bytes:
+    return gzip.compress(data, 6 if level is None else level, mtime=0)
+
+
+CODECS: Dict[str, Codec] = {
+    'gzip': Codec('gzip', '.gz', _gzip_compress, gzip.decompress),
+}
+
+if zstandard is not None:
+    def _zstd_compress(data: bytes, level: Optional[int]) -> bytes:
+        return zstandard.ZstdCompressor(
+            level=3 if level is None else level).compress(data)
+
+    def _zstd_decompress(data: bytes) -> bytes:
+        return zstandard.ZstdDecompressor().decompress(data)
+
+    CODECS['zstd'] = Codec('zstd', '.zst', _zstd_compress, _zstd_decompress)
+
+
+def get_codec(name: str) -> Codec:
+    """Return a codec by name.
+
+    Raises:
+        ValueError: When the codec is unknown or its package is not
+                    installed.
+    """
+    try:
+        return CODECS[name]
+    except KeyError:
+        pass
+
+    if name == 'zstd':
+        raise ValueError('The zstd codec requires the zstandard package.')
+
+    raise ValueError(f'Unknown codec: {name}.')
@@ -0,0 +1,346 @@
+"""Implements a sink posting audit logs to an HTTP collector."""
+import collections
+import gzip
+import http.client
+import os
+import threading
+import time
+from datetime import datetime
+from datetime import timezone
+from email.utils import parsedate_to_datetime
+from typing import Deque
+from typing import List
+from typing import Optional
+from typing import Tuple
+from urllib.parse import urlsplit
+
+from .base import Backoff
+from .base import BaseSink
+from .base import ConnectionPool
+from .base import dumps
+from .base import logger
+from .base import process_alive
+
+SPOOL_SUFFIX = '.ndjson.gz'
+
+# Statuses worth retrying, any other error status drops the batch.
+RETRY_STATUSES = (408, 425, 429, 500, 502, 503, 504)
+
+
+class DeliveryError(Exception):
+    """Raised when a batch could not be delivered to the collector."""
+
+
+def _set_timeout(conn: http.client.HTTPConnection, timeout: float) -> None:
+    """Set the timeout of a connection, connected or not."""
+    conn.timeout = timeout
+    if conn.sock is not None:
+        conn.sock.settimeout(timeout)
+
+
+class HTTPSink(BaseSink):
+    """Sink posting gzip-compressed JSON-lines batches to an HTTP collector.
+
+    Writer threads reuse keep-alive connections from a small pool. Failed
+    posts are retried with exponential backoff and jitter, honouring the
+    `Retry-After` response header. Batches which still cannot be delivered
+    are buffered locally, in memory or in a spool directory, and re-sent
+    once the collector accepts a new batch.
+
+    Direct writes, i.e, of actions audited synchronously or of replayed audit
+    logs, are not buffered.
+    They are retried for at most `sync_timeout` seconds, then `DeliveryError`
+    is raised.
+    """
+
+    def __init__(self, url: str,
+                 pool_size: int = 2,
+                 headers: Optional[dict] = None,
+                 timeout: float = 10.0,
+                 compress_level: int = 6,
+                 max_retries: int = 5,
+                 backoff_initial: float = 0.5,
+                 backoff_max: float = 30.0,
+                 max_retry_after: float = 60.0,
+                 spool_dir: Optional[str] = None,
+                 max_buffered_batches: int = 100,
+                 stale_claim_timeout: float = 900.0,
+                 sync_timeout: float = 5.0,
+                 **kwargs) -> None:
+        """Initialize an object of the class.
+
+        Args:
+            url: Collector endpoint, i.e, `https://collector:8443/v1/logs`.
+            pool_size: Number of keep-alive connections, it is also the
+                       number of writer threads.
+            headers: Extra headers sent with each request.
+            timeout: Connection timeout in seconds.
+            compress_level: Gzip compression level.
+            max_retries: Number of retries before a batch is buffered.
+            backoff_initial: Delay in seconds before the first retry.
+            backoff_max: Upper bound of the retry delay in seconds.
+            max_retry_after: Upper bound in seconds of a `Retry-After` delay.
+            spool_dir: Directory buffering undelivered batches, they are kept
+                       in memory when it is not set.
+            max_buffered_batches: Maximum number of undelivered batches kept
+                                  in memory, the oldest ones are dropped.
+            stale_claim_timeout: Age in seconds after which a spool file
+                                 claimed by a writer is put back in the
+                                 spool, even if its process is alive.
+            sync_timeout: Maximum time in seconds spent posting a direct
+                          write.
+            kwargs: Options passed to `BaseSink`.
+        """
+        parts = urlsplit(url)
+        if parts.scheme not in ('http', 'https'):
+            raise ValueError(f'Unsupported URL scheme: {parts.scheme}.')
+
+        kwargs.setdefault('batch_size', 500)
+        kwargs.setdefault('workers', pool_size)
+        super().__init__(**kwargs)
+        self.url = url
+        self.timeout = timeout
+        self.compress_level = compress_level
+        self.max_retries = max_retries
+        self.backoff_initial = backoff_initial
+        self.backoff_max = backoff_max
+        self.max_retry_after = max_retry_after
+        self.spool_dir = spool_dir
+        self.stale_claim_timeout = stale_claim_timeout
+        self.sync_timeout = sync_timeout
+        self.headers = {
+            'Content-Type': 'application/x-ndjson',
+            'Content-Encoding': 'gzip',
+        }
+        self.headers.update(headers or {})
+        self._scheme = parts.scheme
+        self._netloc = parts.netloc
+        self._path = parts.path or '/'
+        if parts.query:
+            self._path += '?' + parts.query
+
+        self._buffer: Deque[Tuple[bytes, int]] = collections.deque(
+            maxlen=max_buffered_batches)
+        self._buffer_lock = threading.Lock()
+        self._pool = ConnectionPool(self._connect, size=pool_size)
+        if spool_dir:
+            os.makedirs(spool_dir, exist_ok=True)
+
+    def write_batch(self, batch: List[dict]) -> None:
+        """Post a batch of audit logs, buffer it when delivery fails."""
+        body = self.encode(batch)
+        try:
+            self._post(body)
+        except DeliveryError as exc:
+            logger.warning('HTTPSink failed to deliver %d audit logs to %s '
+                           '(%s), buffering them.', len(batch), self.url, exc)
+            self._buffer_batch(body, len(batch))
+        else:
+            self._drain_buffer()
+
+    def write_direct(self, batch: List[dict],
+                     deadline: Optional[float] = None) -> None:
+        """Post a batch of audit logs before a deadline, `sync_timeout`
+        seconds from now if not set.
+
+        Raises:
+            DeliveryError: The batch was not accepted by the collector.
+        """
+        if deadline is None:
+            deadline = time.monotonic() + self.sync_timeout
+        self._post(self.encode(batch), deadline)
+
+    def encode(self, batch: List[dict]) -> bytes:
+        """Return the gzip-compressed JSON-lines body of a batch."""
+        lines = ''.join(dumps(audit_log) + '\n' for audit_log in batch)
+        return gzip.compress(lines.encode('utf-8'), self.compress_level)
+
+    def _post(self, body: bytes, deadline: Optional[float] = None) -> None:
+        """Post a body, retrying on connection errors and retryable
+        statuses.
+
+        Args:
+            body: Encoded batch.
+            deadline: Monotonic time after which no request is sent anymore,
+                      for direct writes. Rejected bodies then raise too.
+        """
+        backoff = Backoff(self.backoff_initial, self.backoff_max, jitter=True)
+        for attempt in range(self.max_retries + 1):
+            delay = None
+            try:
+                with self._pool.connection() as conn:
+                    resp = self._request(conn, body, deadline)
+            except (OSError, http.client.HTTPException) as exc:
+                error = repr(exc)
+            else:
+                if resp.status < 300:
+                    return
+
+                error = f'HTTP {resp.status}'
+                if resp.status not in RETRY_STATUSES:
+                    # The collector rejected the batch, retrying is useless.
+                    logger.error('HTTPSink batch rejected by %s: %s.',
+                                 self.url, error)
+                    if deadline is not None:
+                        raise DeliveryError(error)
+                    return
+
+                delay = self._retry_after(resp.getheader('Retry-After'))
+
+            if attempt == self.max_retries or self._closed:
+                raise DeliveryError(error)
+
+            if delay is None:
+                delay = backoff.next_delay()
+
+            if deadline is not None and time.monotonic() + delay >= deadline:
+                raise DeliveryError(error)
+
+            time.sleep(delay)
+
+    def _request(self, conn: http.client.HTTPConnection, body: bytes,
+                 deadline: Optional[float]) -> http.client.HTTPResponse:
+        """Post a body on a connection, reading the response before the
+        deadline if set."""
+        if deadline is not None:
+            _set_timeout(conn, min(self.timeout,
+                                   max(deadline - time.monotonic(), 0.001)))
+        try:
+            conn.request('POST', self._path, body, self.headers)
+            resp = conn.getresponse()
+            resp.read()
+        finally:
+            if deadline is not None:
+                _set_timeout(conn, self.timeout)
+
+        if resp.will_close:
+            conn.close()
+        return resp
+
+    def _retry_after(self, value: Optional[str]) -> Optional[float]:
+        """Parse a `Retry-After` header value to a delay in seconds."""
+        if not value:
+            return None
+
+        try:
+            delay = float(value)
+        except ValueError:
+            try:
+                when = parsedate_to_datetime(value)
+            except (TypeError, ValueError):
+                return None
+
+            if when.tzinfo is None:
+                when = when.replace(tzinfo=timezone.utc)
+            delay = (when - datetime.now(timezone.utc)).total_seconds()
+
+        return min(max(delay, 0.0), self.max_retry_after)
+
+    def _buffer_batch(self, body: bytes, size: int) -> None:
+        """Keep an undelivered body to send it later."""
+        if not self.spool_dir:
+            with self._buffer_lock:
+                if len(self._buffer) == self._buffer.maxlen:
+                    self.dropped += self._buffer[0][1]
+                self._buffer.append((body, size))
+            return
+
+        name = f'spool-{time.time_ns():020d}-{os.getpid()}{SPOOL_SUFFIX}'
+        path = os.path.join(self.spool_dir, name)
+        with open(path + '.tmp', 'wb') as f:
+            f.write(body)
+        os.replace(path + '.tmp', path)
+
+    def _drain_buffer(self) -> None:
+        """Re-send buffered bodies once the collector is reachable again."""
+        while True:
+            with self._buffer_lock:
+                if not self._buffer:
+                    break
+                body, size = self._buffer.popleft()
+
+            try:
+                self._post(body)
+            except DeliveryError:
+                with self._buffer_lock:
+                    self._buffer.appendleft((body, size))
+                return
+
+        if not self.spool_dir:
+            return
+
+        self._recover_claims()
+        for name in sorted(os.listdir(self.spool_dir)):
+            if not name.endswith(SPOOL_SUFFIX):
+                continue
+
+            path = os.path.join(self.spool_dir, name)
+            claimed = f'{path}.{os.getpid()}.{threading.get_ident()}'
+            try:
+                # Renaming claims the file, other writers skip it.
+                os.rename(path, claimed)
+                # The modification time tells when the file was claimed.
+                os.utime(claimed)
+            except FileNotFoundError:
+                continue
+
+            with open(claimed, 'rb') as f:
+                body = f.read()
+
+            try:
+                self._post(body)
+            except DeliveryError:
+                os.rename(claimed, path)
+                return
+
+            os.remove(claimed)
+
+    def _recover_claims(self) -> None:
+        """Put back in the spool the files claimed by a dead process, or
+        claimed for longer than `stale_claim_timeout`."""
+        now = time.time()
+        for name in os.listdir(self.spool_dir):
+            # Claimed files are named `{spool file}.{pid}.{thread ID}`.
+            base, _, claim = name.partition(SPOOL_SUFFIX + '.')
+            pid = claim.split('.')[0]
+            if not base or not pid.isdigit():
+                continue
+
+            claimed = os.path.join(self.spool_dir, name)
+            try:
+                age = now - os.stat(claimed).st_mtime
+            except FileNotFoundError:
+                continue
+
+            if age < self.stale_claim_timeout and process_alive(int(pid)):
+                continue
+
+            logger.warning('HTTPSink recovering the stale spool file %s.',
+                           claimed)
+            try:
+                os.rename(claimed, os.path.join(self.spool_dir,
+                                                base + SPOOL_SUFFIX))
+            except FileNotFoundError:
+                pass
+
+    def _connect(self) -> http.client.HTTPConnection:
+        """Create a new keep-alive connection to the collector."""
+        if self._scheme == 'https':
+            return http.client.HTTPSConnection(
+                self._netloc, timeout=self.timeout)
+
+        return http.client.HTTPConnection(self._netloc, timeout=self.timeout)
+
+    def _close(self) -> None:
+        """Close pooled connections."""
+        self._pool.clear()
+        if self._buffer:
+            logger.warning('HTTPSink closed with %d undelivered batches.',
+                           len(self._buffer))
+
+    def _after_fork(self) -> None:
+        """Drop the batches buffered by the parent process, it re-sends
+        them itself."""
+        super()._after_fork()
+        self._buffer.clear()
+        self._buffer_lock = threading.Lock()
@@ -0,0 +1,910 @@
+"""Implements an append-only segmented audit log with lookup indexes.
+
+Audit logs are appended as JSON lines to segment files. When a segment is
+rotated, two sidecar indexes are written next to it:
+
+* ``.tidx``, a sparse time index with the offset and the time range of every
+  block of `index_interval` audit logs.
+* ``.kidx``, a sorted key index of `(hash, time, offset)` entries for the
+  action ID and the request ID of every audit log.
+
+Closed segments are memory-mapped, so lookups only seek to the offsets found
+by binary searches in the indexes instead of reading whole segments.
+
+Closed segments may then be compressed in background. Every block of the time
+index is compressed to its own frame and a ``.cidx`` index maps the offsets
+of the blocks to the offsets of their frames, so lookups only decompress the
+blocks they read.
+"""
+import bisect
+import hashlib
+import json
+import logging
+import mmap
+import os
+import queue
+import struct
+import sys
+import threading
+import time
+from typing import BinaryIO
+from typing import Dict
+from typing import Iterator
+from typing import List
+from typing import Optional
+from typing import Tuple
+from typing import Union
+
+from .. import attributes
+from .. import forksafe
+from ..config import AuditLoggerConfig
+from .base import BaseSink
+from .base import TimeFilter
+from .base import dumps
+from .base import parse_start_time
+from .base import process_alive
+from .base import to_timestamp
+from .codecs import Codec
+from .codecs import get_codec
+
+logger = logging.getLogger('flask_auditor')
+
+SEGMENT_PREFIX = 'segment-'
+SEGMENT_SUFFIX = '.log'
+TIME_INDEX_SUFFIX = '.tidx'
+KEY_INDEX_SUFFIX = '.kidx'
+COMPRESSION_INDEX_SUFFIX = '.cidx'
+
+_TIME_INDEX_MAGIC = b'FATI\x01'
+_KEY_INDEX_MAGIC = b'FAKI\x01'
+# min time, max time, offset and number of audit logs of a block.
+_TIME_ENTRY = struct.Struct('<ddQQ')
+# key hash, time and offset of an audit log.
+_KEY_ENTRY = struct.Struct('<QdQ')
+_COMPRESSION_INDEX_MAGIC = b'FACI\x01'
+# offsets of a block in the segment and of its frame in the compressed file,
+# the last entry holds the size of both files.
+_COMPRESSION_ENTRY = struct.Struct('<QQ')
+
+# Codecs of the compressed segments by file suffix.
+_SUFFIX_CODECS = {'.gz': 'gzip', '.zst': 'zstd'}
+
+_ACTION_KEY = 'a'
+_REQUEST_KEY = 'r'
+
+# Marker put on the queue to ask the compressor thread to exit.
+_STOP = object()
+
+# Age in seconds of a partially compressed segment, left by a compressor
+# which crashed, after which another compressor takes the segment over.
+STALE_COMPRESSION_SECONDS = 600.0
+
+
+def key_hash(kind: str, value: str) -> int:
+    """Return the 64-bit hash of an indexed key.
+
+    Args:
+        kind: Kind of the key, an action ID or a request ID.
+        value: Value of the key.
+    """
+    digest = hashlib.blake2b(f'{kind}:{value}'.encode('utf-8'),
+                             digest_size=8).digest()
+    return int.from_bytes(digest, 'little')
+
+
+def _request_id(audit_log: dict) -> Optional[str]:
+    """Return the request ID of an audit log."""
+    req = audit_log.get(attributes.REQUEST)
+    if isinstance(req, dict):
+        return req.get(attributes.REQUEST_ID)
+
+
+def _status_code(audit_log: dict) -> Optional[int]:
+    """Return the response status code of an audit log."""
+    resp = audit_log.get(attributes.RESPONSE)
+    if isinstance(resp, dict):
+        return resp.get(attributes.RESPONSE_STATUS_CODE)
+
+
+class _IndexBuilder:
+    """Collect index entries of the active segment."""
+
+    def __init__(self, index_interval: int) -> None:
+        self.index_interval = index_interval
+        self.blocks: List[list] = []
+        self.keys: List[Tuple[int, float, int]] = []
+
+    def add(self, audit_log: dict, ts: float, offset: int) -> None:
+        """Add an audit log written at the given offset."""
+        if not self.blocks or self.blocks[-1][3] == self.index_interval:
+            self.blocks.append([ts, ts, offset, 0])
+
+        block = self.blocks[-1]
+        block[0] = min(block[0], ts)
+        block[1] = max(block[1], ts)
+        block[3] += 1
+
+        action_id = audit_log.get(attributes.ACTION_ID)
+        if isinstance(action_id, str):
+            self.keys.append((key_hash(_ACTION_KEY, action_id), ts, offset))
+
+        request_id = _request_id(audit_log)
+        if isinstance(request_id, str):
+            self.keys.append((key_hash(_REQUEST_KEY, request_id), ts, offset))
+
+    def write(self, segment_path: str) -> None:
+        """Write the indexes of a segment, the key index is written last and
+        marks the segment as closed."""
+        base = segment_path[:-len(SEGMENT_SUFFIX)]
+        data = _TIME_INDEX_MAGIC + b''.join(
+            _TIME_ENTRY.pack(*block) for block in self.blocks)
+        _write_atomic(base + TIME_INDEX_SUFFIX, data)
+
+        self.keys.sort()
+        data = _KEY_INDEX_MAGIC + b''.join(
+            _KEY_ENTRY.pack(*entry) for entry in self.keys)
+        _write_atomic(base + KEY_INDEX_SUFFIX, data)
+
+
+def _write_atomic(path: str, data: bytes) -> None:
+    """Write a file so that readers never see it partially written."""
+    with open(path + '.tmp', 'wb') as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(path + '.tmp', path)
+
+
+class Segment:
+    """A segment file of the audit log."""
+
+    def __init__(self, path: str,
+                 datetime_format: str = AuditLoggerConfig.datetime_format
+                 ) -> None:
+        """Initialize an object of the class.
+
+        Args:
+            path: Path of the segment file.
+            datetime_format: Format of the `startTime` attribute.
+        """
+        self.path = path
+        self.datetime_format = datetime_format
+        self.base = path[:path.rindex(SEGMENT_SUFFIX)]
+
+    @property
+    def closed(self) -> bool:
+        """Return true when the segment was rotated and indexed."""
+        return os.path.exists(self.base + KEY_INDEX_SUFFIX)
+
+    @property
+    def compressed_path(self) -> Optional[str]:
+        """Return the path of the compressed segment, if it exists."""
+        for suffix in _SUFFIX_CODECS:
+            path = self.base + SEGMENT_SUFFIX + suffix
+            if os.path.exists(path):
+                return path
+
+        return None
+
+    def query(self, action_id: Optional[str] = None,
+              request_id: Optional[str] = None,
+              start: Optional[float] = None,
+              end: Optional[float] = None) -> Iterator[dict]:
+        """Yield audit logs of the segment matching all the given filters.
+
+        Args:
+            action_id: Unique identifier of the action.
+            request_id: Request ID of the audit logs.
+            start: Include audit logs started at or after this timestamp.
+            end: Include audit logs started before this timestamp.
+        """
+        if not self.closed:
+            yield from self._scan(action_id, request_id, start, end)
+            return
+
+        data = self._open_data()
+        if data is None:
+            return
+
+        try:
+            if request_id is not None:
+                offsets = self._key_lookup(
+                    key_hash(_REQUEST_KEY, request_id), start, end)
+            elif action_id is not None:
+                offsets = self._key_lookup(
+                    key_hash(_ACTION_KEY, action_id), start, end)
+            else:
+                offsets = None
+
+            if offsets is not None:
+                for offset in offsets:
+                    audit_log = json.loads(data.read_line(offset))
+                    if self._match(audit_log, action_id, request_id,
+                                   start, end):
+                        yield audit_log
+                return
+
+            for begin, stop in self._time_ranges(start, end, data.size):
+                for line in data.read(begin, stop).splitlines():
+                    audit_log = json.loads(line)
+                    if self._match(audit_log, action_id, request_id,
+                                   start, end):
+                        yield audit_log
+        finally:
+            data.close()
+
+    def _open_data(self) -> Optional[Union['_MappedSegment',
+                                           '_CompressedSegment']]:
+        """Open the data of a closed segment, `None` when it is empty."""
+        try:
+            f = open(self.base + SEGMENT_SUFFIX, 'rb')
+        except FileNotFoundError:
+            path = self.compressed_path
+            if path is None:
+                return None
+
+            codec = get_codec(_SUFFIX_CODECS[path[path.rindex('.'):]])
+            data = _CompressedSegment(
+                path, self.base + COMPRESSION_INDEX_SUFFIX, codec)
+            if data.size == 0:
+                data.close()
+                return None
+
+            return data
+
+        with f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return None
+
+            return _MappedSegment(
+                mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+
+    def lines(self) -> Iterator[bytes]:
+        """Yield the JSON lines of the segment in the order they were
+        written."""
+        if not self.closed:
+            yield from self._active_lines()
+            return
+
+        data = self._open_data()
+        if data is None:
+            return
+
+        try:
+            yield from data.read(0, data.size).splitlines()
+        finally:
+            data.close()
+
+    def _active_lines(self) -> Iterator[bytes]:
+        """Yield the complete lines of a segment being written."""
+        try:
+            f = open(self.path, 'rb')
+        except FileNotFoundError:
+            return
+
+        with f:
+            for line in f:
+                if not line.endswith(b'\n'):
+                    # The line is being written.
+                    return
+
+                yield line
+
+    def _scan(self, action_id, request_id, start, end) -> Iterator[dict]:
+        """Read the whole segment, used for segments without indexes."""
+        for line in self._active_lines():
+            audit_log = json.loads(line)
+            if self._match(audit_log, action_id, request_id, start, end):
+                yield audit_log
+
+    def _match(self, audit_log: dict, action_id, request_id, start,
+               end) -> bool:
+        """Return true when an audit log matches all the given filters."""
+        if (action_id is not None
+                and audit_log.get(attributes.ACTION_ID) != action_id):
+            return False
+
+        if request_id is not None and _request_id(audit_log) != request_id:
+            return False
+
+        if start is None and end is None:
+            return True
+
+        ts = parse_start_time(audit_log, self.datetime_format)
+        return ((start is None or ts >= start)
+                and (end is None or ts < end))
+
+    def _key_lookup(self, key: int, start: Optional[float],
+                    end: Optional[float]) -> List[int]:
+        """Return offsets of the audit logs having the given key hash, by a
+        binary search in the key index."""
+        with open(self.base + KEY_INDEX_SUFFIX, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            if size <= len(_KEY_INDEX_MAGIC):
+                return []
+            index = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        with index:
+            view = _KeyView(index, (size - len(_KEY_INDEX_MAGIC))
+                            // _KEY_ENTRY.size)
+            lo = bisect.bisect_left(
+                view, (key, -float('inf') if start is None else start))
+            offsets = []
+            for i in range(lo, len(view)):
+                entry_key, ts, offset = view[i]
+                if entry_key != key or (end is not None and ts >= end):
+                    break
+
+                offsets.append(offset)
+
+        return sorted(offsets)
+
+    def _time_ranges(self, start: Optional[float], end: Optional[float],
+                     size: int) -> List[Tuple[int, int]]:
+        """Return `(begin, end)` offsets of the blocks which may contain audit
+        logs started within the given time range."""
+        with open(self.base + TIME_INDEX_SUFFIX, 'rb') as f:
+            data = f.read()[len(_TIME_INDEX_MAGIC):]
+
+        blocks = list(_TIME_ENTRY.iter_unpack(data))
+        ranges = []
+        for i, (min_ts, max_ts, offset, _) in enumerate(blocks):
+            if start is not None and max_ts < start:
+                continue
+
+            if end is not None and min_ts >= end:
+                continue
+
+            stop = blocks[i + 1][2] if i + 1 < len(blocks) else size
+            if ranges and ranges[-1][1] == offset:
+                ranges[-1] = (ranges[-1][0], stop)
+            else:
+                ranges.append((offset, stop))
+
+        return ranges
+
+
+class _MappedSegment:
+    """Data of a closed segment, memory-mapped."""
+
+    def __init__(self, data: mmap.mmap) -> None:
+        self.data = data
+        self.size = len(data)
+
+    def read(self, begin: int, stop: int) -> bytes:
+        """Return the data between the given offsets."""
+        return self.data[begin:stop]
+
+    def read_line(self, offset: int) -> bytes:
+        """Return the line starting at the given offset."""
+        stop = self.data.find(b'\n', offset)
+        return self.data[offset:stop if stop >= 0 else self.size]
+
+    def close(self) -> None:
+        self.data.close()
+
+
+class _CompressedSegment:
+    """Data of a compressed segment, blocks are decompressed on demand."""
+
+    def __init__(self, path: str, index_path: str, codec: Codec) -> None:
+        with open(index_path, 'rb') as f:
+            data = f.read()[len(_COMPRESSION_INDEX_MAGIC):]
+
+        entries = list(_COMPRESSION_ENTRY.iter_unpack(data))
+        self.offsets = [entry[0] for entry in entries]
+        self.frames = [entry[1] for entry in entries]
+        self.size = self.offsets[-1]
+        self.codec = codec
+        self._file = open(path, 'rb')
+        # The last decompressed block, lookups often read it several times.
+        self._cache: Dict[int, bytes] = {}
+
+    def read(self, begin: int, stop: int) -> bytes:
+        """Return the data between the given offsets."""
+        chunks = []
+        i = bisect.bisect_right(self.offsets, begin) - 1
+        while i < len(self.offsets) - 1 and self.offsets[i] < stop:
+            block_begin = self.offsets[i]
+            chunks.append(self._block(i)[max(begin - block_begin, 0):
+                                         stop - block_begin])
+            i += 1
+
+        return b''.join(chunks)
+
+    def read_line(self, offset: int) -> bytes:
+        """Return the line starting at the given offset."""
+        i = bisect.bisect_right(self.offsets, offset) - 1
+        block = self._block(i)
+        begin = offset - self.offsets[i]
+        stop = block.find(b'\n', begin)
+        return block[begin:stop if stop >= 0 else len(block)]
+
+    def close(self) -> None:
+        self._file.close()
+
+    def _block(self, i: int) -> bytes:
+        """Return the decompressed data of a block."""
+        data = self._cache.get(i)
+        if data is None:
+            self._file.seek(self.frames[i])
+            frame = self._file.read(self.frames[i + 1] - self.frames[i])
+            data = self.codec.decompress(frame)
+            self._cache = {i: data}
+
+        return data
+
+
+class _KeyView:
+    """Sequence view of the entries of a memory-mapped key index."""
+
+    def __init__(self, index: mmap.mmap, count: int) -> None:
+        self.index = index
+        self.count = count
+
+    def __len__(self) -> int:
+        return self.count
+
+    def __getitem__(self, i: int) -> Tuple[int, float, int]:
+        return _KEY_ENTRY.unpack_from(
+            self.index, len(_KEY_INDEX_MAGIC) + i * _KEY_ENTRY.size)
+
+
+class SegmentedLogReader:
+    """Query audit logs written by `SegmentedLogSink`."""
+
+    def __init__(self, directory: str,
+                 datetime_format: str = AuditLoggerConfig.datetime_format
+                 ) -> None:
+        """Initialize an object of the class.
+
+        Args:
+            directory: Directory of the segment files.
+            datetime_format: Format of the `startTime` attribute.
+        """
+        self.directory = directory
+        self.datetime_format = datetime_format
+
+    def segments(self) -> List[Segment]:
+        """Return segments ordered from the oldest to the newest, compressed
+        or not."""
+        names: Dict[str, str] = {}
+        for name in os.listdir(self.directory):
+            if not name.startswith(SEGMENT_PREFIX):
+                continue
+
+            base, _, suffix = name.partition(SEGMENT_SUFFIX)
+            if suffix == '' and name.endswith(SEGMENT_SUFFIX):
+                # The segment is still readable while it is compressed.
+                names[base] = name
+            elif suffix in _SUFFIX_CODECS:
+                names.setdefault(base, name)
+
+        return [Segment(os.path.join(self.directory, names[x]),
+                        self.datetime_format)
+                for x in sorted(names)]
+
+    def iter_logs(self, action_id: Optional[str] = None,
+                  start: TimeFilter = None, end: TimeFilter = None,
+                  request_id: Optional[str] = None,
+                  status_code: Optional[int] = None) -> Iterator[dict]:
+        """Yield audit logs matching all the given filters, from the oldest
+        segment to the newest."""
+        start, end = to_timestamp(start), to_timestamp(end)
+        for segment in self.segments():
+            for audit_log in segment.query(action_id, request_id, start, end):
+                if (status_code is None
+                        or _status_code(audit_log) == status_code):
+                    yield audit_log
+
+    def query(self, action_id: Optional[str] = None,
+              start: TimeFilter = None, end: TimeFilter = None,
+              request_id: Optional[str] = None,
+              status_code: Optional[int] = None,
+              limit: int = 100, offset: int = 0,
+              descending: bool = False) -> List[dict]:
+        """Return audit logs matching all the given filters.
+
+        Args:
+            action_id: Unique identifier of the action.
+            start: Include audit logs started at or after this time.
+            end: Include audit logs started before this time.
+            request_id: Request ID of the audit logs.
+            status_code: Response status code of the audit logs.
+            limit: Maximum number of audit logs to return.
+            offset: Number of matching audit logs to skip.
+            descending: Set to true to return the newest audit logs first.
+        """
+        logs = self.iter_logs(action_id, start, end, request_id, status_code)
+        if descending:
+            logs = reversed(list(logs))
+
+        result = []
+        for i, audit_log in enumerate(logs):
+            if i < offset:
+                continue
+
+            if len(result) == limit:
+                break
+
+            result.append(audit_log)
+
+        return result
+
+
+def compress_segment(base: str, codec: Codec, level: Optional[int] = None,
+                     stale_after: float = STALE_COMPRESSION_SECONDS
+                     ) -> Optional[Tuple[int, int]]:
+    """Compress a closed segment block by block.
+
+    The compressed file replaces the segment once it and its index are fully
+    written, readers use either one meanwhile.
+
+    Args:
+        base: Path of the segment without suffix.
+        codec: Compression codec.
+        level: Compression level, the default level of the codec if not set.
+        stale_after: Time in seconds after which a partially compressed file
+                     not written anymore is removed and compressed again.
+
+    Return:
+        The sizes of the segment and of the compressed file, `None` when the
+        segment is being or has been compressed by another compressor.
+    """
+    path = base + SEGMENT_SUFFIX
+    tmp_path = path + codec.suffix + '.tmp'
+    out = _claim(tmp_path, stale_after)
+    if out is None:
+        return None
+
+    try:
+        with out:
+            with open(path, 'rb') as f:
+                data = f.read()
+
+            with open(base + TIME_INDEX_SUFFIX, 'rb') as f:
+                blocks = f.read()[len(_TIME_INDEX_MAGIC):]
+
+            starts = sorted({0}.union(
+                entry[2] for entry in _TIME_ENTRY.iter_unpack(blocks)))
+            starts = [x for x in starts if x < len(data)]
+            entries = []
+            position = 0
+            for i, begin in enumerate(starts):
+                stop = starts[i + 1] if i + 1 < len(starts) else len(data)
+                frame = codec.compress(data[begin:stop], level)
+                out.write(frame)
+                entries.append((begin, position))
+                position += len(frame)
+
+            entries.append((len(data), position))
+            out.flush()
+            os.fsync(out.fileno())
+
+        _write_atomic(base + COMPRESSION_INDEX_SUFFIX,
+                      _COMPRESSION_INDEX_MAGIC + b''.join(
+                          _COMPRESSION_ENTRY.pack(*x) for x in entries))
+        os.replace(tmp_path, path + codec.suffix)
+    except FileNotFoundError:
+        # Another compressor has just replaced the segment.
+        os.remove(tmp_path)
+        return None
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+    os.remove(path)
+    return len(data), position
+
+
+def _claim(tmp_path: str, stale_after: float) -> Optional[BinaryIO]:
+    """Create the temporary file claiming a segment.
+
+    Return:
+        The file opened for writing, `None` when another compressor holds
+        the claim.
+    """
+    try:
+        return open(tmp_path, 'xb')
+    except FileExistsError:
+        pass
+
+    # Renaming takes the stale file over, only one compressor succeeds.
+    stale = f'{tmp_path}.{os.getpid()}.{threading.get_ident()}'
+    try:
+        if time.time() - os.stat(tmp_path).st_mtime < stale_after:
+            return None
+
+        os.rename(tmp_path, stale)
+    except FileNotFoundError:
+        return None
+
+    if time.time() - os.stat(stale).st_mtime < stale_after:
+        # Another compressor has just claimed the segment again.
+        os.rename(stale, tmp_path)
+        return None
+
+    logger.warning('Removing the stale compressed segment %s.', tmp_path)
+    os.remove(stale)
+    try:
+        return open(tmp_path, 'xb')
+    except FileExistsError:
+        return None
+
+
+def _lower_priority() -> None:
+    """Lower the scheduling priority of the current thread.
+
+    Only done on Linux, where priorities are set per thread.
+    """
+    if not sys.platform.startswith('linux'):
+        return
+
+    try:
+        os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), 19)
+    except OSError:
+        pass
+
+
+class SegmentCompressor:
+    """Compress closed segments in a low-priority background thread."""
+
+    def __init__(self, codec: str = 'gzip',
+                 level: Optional[int] = None) -> None:
+        """Initialize an object of the class.
+
+        Args:
+            codec: Name of the codec, `gzip` or `zstd`, see `codecs.CODECS`.
+            level: Compression level, the default level of the codec if not
+                   set.
+        """
+        self.codec = get_codec(codec)
+        self.level = level
+        self.segments = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.seconds = 0.0
+        self._queue = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        forksafe.register(self)
+
+    @property
+    def ratio(self) -> float:
+        """Return the compression ratio of the segments compressed so far."""
+        return self.bytes_in / self.bytes_out if self.bytes_out else 0.0
+
+    def submit(self, base: str) -> None:
+        """Queue a closed segment to be compressed.
+
+        Args:
+            base: Path of the segment without suffix.
+        """
+        self._ensure_started()
+        self._queue.put(base)
+
+    def flush(self) -> None:
+        """Block until queued segments have been compressed."""
+        if self._thread is not None:
+            self._queue.join()
+
+    def close(self) -> None:
+        """Compress queued segments and stop the thread."""
+        with self._lock:
+            thread, self._thread = self._thread, None
+
+        if thread is not None:
+            self._queue.put(_STOP)
+            thread.join()
+
+    def _ensure_started(self) -> None:
+        """Start the thread on first use."""
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name='SegmentCompressor', daemon=True)
+                self._thread.start()
+
+    def _run(self) -> None:
+        """Compressor loop."""
+        _lower_priority()
+        while True:
+            base = self._queue.get()
+            try:
+                if base is _STOP:
+                    return
+
+                started = time.perf_counter()
+                sizes = compress_segment(base, self.codec, self.level)
+                if sizes is not None:
+                    self.segments += 1
+                    self.bytes_in += sizes[0]
+                    self.bytes_out += sizes[1]
+                    self.seconds += time.perf_counter() - started
+            except Exception:  # noqa
+                logger.exception('Failed to compress segment %s.', base)
+            finally:
+                self._queue.task_done()
+
+    def _after_fork(self) -> None:
+        """Drop the thread and the segments queued by the parent
+        process."""
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+
+
+class SegmentedLogSink(BaseSink):
+    """Sink appending audit logs to rotated and indexed segment files."""
+
+    def __init__(self, directory: str,
+                 max_segment_bytes: int = 64 * 1024 * 1024,
+                 max_segment_age: Optional[float] = None,
+                 index_interval: int = 256,
+                 fsync: bool = False,
+                 datetime_format: str = AuditLoggerConfig.datetime_format,
+                 compression: Optional[str] = 'gzip',
+                 compression_level: Optional[int] = None,
+                 **kwargs) -> None:
+        """Initialize an object of the class.
+
+        Args:
+            directory: Directory of the segment files.
+            max_segment_bytes: Size in bytes above which the active segment is
+                               rotated.
+            max_segment_age: Age in seconds above which the active segment is
+                             rotated.
+            index_interval: Number of audit logs per time index entry.
+            fsync: Set to true to fsync the segment after each batch.
+            datetime_format: Format of the `startTime` attribute, it must
+                             match `AUDIT_LOGGER_DATETIME_FORMAT`.
+            compression: Codec compressing closed segments in background,
+                         `gzip` or `zstd`. Set to `None` to keep them
+                         uncompressed.
+            compression_level: Compression level of the codec.
+            kwargs: Options passed to `BaseSink`.
+        """
+        # Segments are append-only files with a single writer.
+        kwargs['workers'] = 1
+        super().__init__(**kwargs)
+        self.directory = directory
+        self.max_segment_bytes = max_segment_bytes
+        self.max_segment_age = max_segment_age
+        self.index_interval = index_interval
+        self.fsync = fsync
+        self.datetime_format = datetime_format
+        self.reader = SegmentedLogReader(directory, datetime_format)
+        self._file = None
+        self._path: Optional[str] = None
+        self._opened_at = 0.0
+        self._index: Optional[_IndexBuilder] = None
+        self._write_lock = threading.Lock()
+        self.compressor: Optional[SegmentCompressor] = None
+        os.makedirs(directory, exist_ok=True)
+        self._recover_segments()
+        if compression:
+            self.compressor = SegmentCompressor(compression, compression_level)
+            # Segments closed by a previous run.
+            for segment in self.reader.segments():
+                if segment.path.endswith(SEGMENT_SUFFIX) and segment.closed:
+                    self.compressor.submit(segment.base)
+
+    def write_batch(self, batch: List[dict]) -> None:
+        """Append a batch of audit logs to the active segment."""
+        with self._write_lock:
+            if self._file is None:
+                self._open_segment()
+
+            offset = self._file.tell()
+            chunks = []
+            for audit_log in batch:
+                line = (dumps(audit_log) + '\n').encode('utf-8')
+                ts = parse_start_time(audit_log, self.datetime_format)
+                self._index.add(audit_log, ts, offset)
+                chunks.append(line)
+                offset += len(line)
+
+            self._file.write(b''.join(chunks))
+            self._file.flush()
+            if self.fsync:
+                os.fsync(self._file.fileno())
+
+            if offset >= self.max_segment_bytes or (
+                    self.max_segment_age is not None
+                    and time.monotonic() - self._opened_at
+                    >= self.max_segment_age):
+                self._close_segment()
+
+    def rotate(self) -> None:
+        """Close and index the active segment."""
+        with self._write_lock:
+            if self._file is not None:
+                self._close_segment()
+
+    def query(self, **filters) -> List[dict]:
+        """Return audit logs matching the given filters, see
+        `SegmentedLogReader.query`."""
+        return self.reader.query(**filters)
+
+    def _recover_segments(self) -> None:
+        """Close and index the active segments of processes which exited
+        without closing them, i.e, after a crash."""
+        for segment in self.reader.segments():
+            if not segment.path.endswith(SEGMENT_SUFFIX) or segment.closed:
+                continue
+
+            # Segments are named `segment-{time}-{pid}.log`.
+            pid = os.path.basename(segment.base).rpartition('-')[2]
+            if not pid.isdigit():
+                continue
+
+            if int(pid) == os.getpid() or process_alive(int(pid)):
+                continue
+
+            logger.warning('SegmentedLogSink recovering the segment %s left '
+                           'active by process %s.', segment.path, pid)
+            self._index_segment(segment.path)
+
+    def _index_segment(self, path: str) -> None:
+        """Drop a partially written last line of a segment, then write the
+        indexes of the segment."""
+        index = _IndexBuilder(self.index_interval)
+        with open(path, 'r+b') as f:
+            data = f.read()
+            end = data.rfind(b'\n') + 1
+            if end < len(data):
+                f.truncate(end)
+                f.flush()
+                os.fsync(f.fileno())
+
+        offset = 0
+        for line in data[:end].split(b'\n')[:-1]:
+            try:
+                audit_log = json.loads(line)
+            except ValueError:
+                audit_log = None
+
+            if isinstance(audit_log, dict):
+                index.add(audit_log,
+                          parse_start_time(audit_log, self.datetime_format),
+                          offset)
+            offset += len(line) + 1
+
+        index.write(path)
+
+    def _open_segment(self) -> None:
+        """Open a new active segment."""
+        name = (f'{SEGMENT_PREFIX}{time.time_ns():020d}-{os.getpid()}'
+                f'{SEGMENT_SUFFIX}')
+        self._path = os.path.join(self.directory, name)
+        self._file = open(self._path, 'ab')
+        self._opened_at = time.monotonic()
+        self._index = _IndexBuilder(self.index_interval)
+
+    def _close_segment(self) -> None:
+        """Close the active segment and write its indexes."""
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._file.close()
+        self._index.write(self._path)
+        if self.compressor is not None:
+            self.compressor.submit(self._path[:-len(SEGMENT_SUFFIX)])
+
+        self._file = None
+        self._index = None
+
+    def _close(self) -> None:
+        """Close and index the active segment, then wait for the segments
+        being compressed."""
+        self.rotate()
+        if self.compressor is not None:
+            self.compressor.close()
+
+    def _after_fork(self) -> None:
+        """Leave the active segment to the parent process, the child opens
+        its own segment on its first write."""
+        super()._after_fork()
+        self._write_lock = threading.Lock()
+        self._file = None
+        self._path = None
+        self._index = None
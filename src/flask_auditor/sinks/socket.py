@@ -0,0 +1,222 @@
+"""Implements a sink shipping audit logs over TCP, UDP or Unix sockets."""
+import os
+import select
+import socket
+import time
+from datetime import datetime
+from datetime import timezone
+from typing import List
+from typing import Optional
+from typing import Tuple
+from typing import Union
+
+from .. import attributes
+from .base import Backoff
+from .base import BaseSink
+from .base import ConnectionPool
+from .base import dumps
+from .base import logger
+
+TRANSPORT_TCP = 'tcp'
+TRANSPORT_UDP = 'udp'
+TRANSPORT_UNIX = 'unix'
+
+FRAMING_RFC5424 = 'rfc5424'
+FRAMING_NDJSON = 'ndjson'
+
+# Syslog facility `log audit` and severity `informational`.
+DEFAULT_FACILITY = 13
+DEFAULT_SEVERITY = 6
+
+
+class SocketSink(BaseSink):
+    """Sink shipping audit logs to a relay over a socket.
+
+    Each writer thread borrows a persistent connection from a small pool and
+    writes a whole batch with a single `sendall` for stream sockets. Failed
+    sends are retried on a new connection after an exponential backoff.
+    Direct writes, i.e, of actions audited synchronously or of replayed audit
+    logs, are retried for at most `sync_timeout` seconds.
+    """
+
+    def __init__(self, address: Union[str, Tuple[str, int]],
+                 transport: str = TRANSPORT_TCP,
+                 framing: str = FRAMING_NDJSON,
+                 pool_size: int = 2,
+                 app_name: str = 'flask-auditor',
+                 hostname: Optional[str] = None,
+                 facility: int = DEFAULT_FACILITY,
+                 severity: int = DEFAULT_SEVERITY,
+                 timeout: float = 5.0,
+                 max_retries: int = 5,
+                 backoff_initial: float = 0.1,
+                 backoff_max: float = 5.0,
+                 sync_timeout: float = 5.0,
+                 **kwargs) -> None:
+        """Initialize an object of the class.
+
+        Args:
+            address: `(host, port)` for TCP and UDP or a path for Unix sockets.
+            transport: One of `tcp`, `udp` or `unix`.
+            framing: `rfc5424` for syslog messages or `ndjson` for
+                     newline-delimited JSON.
+            pool_size: Number of persistent connections, it is also the number
+                       of writer threads.
+            app_name: Syslog APP-NAME field.
+            hostname: Syslog HOSTNAME field, the host name by default.
+            facility: Syslog facility.
+            severity: Syslog severity.
+            timeout: Socket timeout in seconds.
+            max_retries: Number of retries before a batch is dropped.
+            backoff_initial: Delay in seconds before the first reconnect.
+            backoff_max: Upper bound of the reconnect delay in seconds.
+            sync_timeout: Maximum time in seconds spent sending a direct
+                          write.
+            kwargs: Options passed to `BaseSink`.
+        """
+        if transport not in (TRANSPORT_TCP, TRANSPORT_UDP, TRANSPORT_UNIX):
+            raise ValueError(f'Unsupported transport: {transport}.')
+
+        if framing not in (FRAMING_RFC5424, FRAMING_NDJSON):
+            raise ValueError(f'Unsupported framing: {framing}.')
+
+        kwargs.setdefault('workers', pool_size)
+        super().__init__(**kwargs)
+        self.address = address
+        self.transport = transport
+        self.framing = framing
+        self.app_name = app_name
+        self.hostname = hostname or socket.gethostname()
+        self.priority = facility * 8 + severity
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff_initial = backoff_initial
+        self.backoff_max = backoff_max
+        self.sync_timeout = sync_timeout
+        self._pool = ConnectionPool(
+            self._connect, size=pool_size, validate=self._is_alive)
+
+    def write_batch(self, batch: List[dict],
+                    deadline: Optional[float] = None) -> None:
+        """Frame and send a batch of audit logs.
+
+        Args:
+            batch: Audit logs to send.
+            deadline: Monotonic time after which sends are not retried
+                      anymore, for direct writes.
+        """
+        backoff = Backoff(self.backoff_initial, self.backoff_max)
+        for attempt in range(self.max_retries + 1):
+            try:
+                with self._pool.connection() as sock:
+                    # A Unix socket is a datagram or a stream socket,
+                    # depending on the relay.
+                    stream = sock.type == socket.SOCK_STREAM
+                    messages = [self.frame(audit_log, stream)
+                                for audit_log in batch]
+                    if deadline is not None:
+                        sock.settimeout(min(self.timeout, max(
+                            deadline - time.monotonic(), 0.001)))
+                    self._send(sock, messages)
+                    sock.settimeout(self.timeout)
+                return
+            except OSError as exc:
+                delay = backoff.next_delay()
+                if (attempt == self.max_retries or self._closed
+                        or (deadline is not None
+                            and time.monotonic() + delay >= deadline)):
+                    raise
+
+                logger.warning('SocketSink failed to send to %s (%s), '
+                               'reconnecting in %.2fs.',
+                               self.address, exc, delay)
+                time.sleep(delay)
+
+    def write_direct(self, batch: List[dict],
+                     deadline: Optional[float] = None) -> None:
+        """Send a batch of audit logs before a deadline, `sync_timeout`
+        seconds from now if not set."""
+        if deadline is None:
+            deadline = time.monotonic() + self.sync_timeout
+        self.write_batch(batch, deadline)
+
+    def frame(self, audit_log: dict, stream: bool = False) -> bytes:
+        """Return the audit log framed for the wire.
+
+        Args:
+            audit_log: Audit log to frame.
+            stream: Set to true for stream sockets, syslog messages are then
+                    prefixed with their length.
+        """
+        payload = dumps(audit_log)
+        if self.framing == FRAMING_NDJSON:
+            return (payload + '\n').encode('utf-8')
+
+        msg_id = audit_log.get(attributes.ACTION_ID) or '-'
+        timestamp = datetime.now(timezone.utc).isoformat()
+        msg = (f'<{self.priority}>1 {timestamp} {self.hostname} '
+               f'{self.app_name} {os.getpid()} {msg_id} - {payload}')
+        msg = msg.encode('utf-8')
+        if stream:
+            # Octet counting framing described in RFC 6587.
+            return str(len(msg)).encode('ascii') + b' ' + msg
+
+        return msg
+
+    def _send(self, sock: socket.socket, messages: List[bytes]) -> None:
+        """Send framed messages through the given socket."""
+        if sock.type == socket.SOCK_DGRAM:
+            for msg in messages:
+                sock.send(msg)
+        else:
+            sock.sendall(b''.join(messages))
+
+    def _connect(self) -> socket.socket:
+        """Open a new connection to the configured address."""
+        if self.transport == TRANSPORT_UNIX:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+            sock.settimeout(self.timeout)
+            try:
+                sock.connect(self.address)
+            except OSError:
+                # The relay is listening on a stream socket.
+                sock.close()
+                sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+                sock.settimeout(self.timeout)
+                sock.connect(self.address)
+            return sock
+
+        if self.transport == TRANSPORT_UDP:
+            host, port = self.address
+            family = socket.getaddrinfo(host, port)[0][0]
+            sock = socket.socket(family, socket.SOCK_DGRAM)
+            sock.settimeout(self.timeout)
+            sock.connect((host, port))
+            return sock
+
+        sock = socket.create_connection(self.address, timeout=self.timeout)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        return sock
+
+    @staticmethod
+    def _is_alive(sock: socket.socket) -> bool:
+        """Return false when the peer has closed a stream connection."""
+        if sock.type == socket.SOCK_DGRAM:
+            return True
+
+        try:
+            readable, _, _ = select.select([sock], [], [], 0)
+            if not readable:
+                return True
+
+            data = sock.recv(1, socket.MSG_PEEK)
+        except (OSError, ValueError):
+            return False
+
+        # An empty read means the peer sent FIN, relays are not expected to
+        # write anything back.
+        return data != b''
+
+    def _close(self) -> None:
+        """Close pooled connections."""
+        self._pool.clear()
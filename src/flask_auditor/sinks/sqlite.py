@@ -0,0 +1,185 @@
+"""Implements a sink storing audit logs in a local SQLite database."""
+import json
+import os
+import sqlite3
+from typing import List
+from typing import Optional
+from typing import Tuple
+
+from .. import attributes
+from ..config import AuditLoggerConfig
+from .base import BaseSink
+from .base import ConnectionPool
+from .base import TimeFilter
+from .base import dumps
+from .base import parse_start_time
+from .base import to_timestamp
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS {table} (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    action_id TEXT,
+    start_time REAL NOT NULL,
+    request_id TEXT,
+    remote_ip TEXT,
+    status_code INTEGER,
+    route_path TEXT,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS {table}_action_time
+    ON {table} (action_id, start_time);
+CREATE INDEX IF NOT EXISTS {table}_start_time ON {table} (start_time);
+CREATE INDEX IF NOT EXISTS {table}_request_id ON {table} (request_id);
+CREATE INDEX IF NOT EXISTS {table}_status_code
+    ON {table} (status_code, start_time);
+CREATE INDEX IF NOT EXISTS {table}_remote_ip ON {table} (remote_ip);
+CREATE INDEX IF NOT EXISTS {table}_route_path ON {table} (route_path);
+"""
+
+
+class _Connection(sqlite3.Connection):
+    """SQLite connection remembering the process which opened it."""
+
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self.pid = os.getpid()
+
+
+class SQLiteSink(BaseSink):
+    """Sink storing audit logs in a SQLite database.
+
+    The database runs in WAL mode so queries do not block the writer thread,
+    which inserts whole batches with `executemany`. Core attributes are
+    promoted to indexed columns and the full audit log is kept as JSON.
+    Connections are borrowed from a small pool, threads writing or querying
+    concurrently beyond its size use short-lived connections.
+    """
+
+    def __init__(self, path: str, table: str = 'audit_logs',
+                 datetime_format: str = AuditLoggerConfig.datetime_format,
+                 pool_size: int = 2, **kwargs) -> None:
+        """Initialize an object of the class.
+
+        Args:
+            path: Path of the database file.
+            table: Name of the table storing audit logs.
+            datetime_format: Format of the `startTime` attribute, it must
+                             match `AUDIT_LOGGER_DATETIME_FORMAT`.
+            pool_size: Maximum number of idle connections kept open.
+            kwargs: Options passed to `BaseSink`.
+        """
+        if not table.isidentifier():
+            raise ValueError(f'Invalid table name: {table}.')
+
+        # SQLite allows a single writer at a time.
+        kwargs['workers'] = 1
+        super().__init__(**kwargs)
+        self.path = path
+        self.table = table
+        self.datetime_format = datetime_format
+        self._insert_sql = (
+            f'INSERT INTO {table} (action_id, start_time, request_id, '
+            f'remote_ip, status_code, route_path, data) '
+            f'VALUES (?, ?, ?, ?, ?, ?, ?)')
+        self._inherited_connections: List[sqlite3.Connection] = []
+        self._pool = ConnectionPool(self._connect, size=pool_size,
+                                    close=self._release)
+        conn = self._connect()
+        conn.executescript(_SCHEMA.format(table=table))
+        conn.close()
+
+    def write_batch(self, batch: List[dict]) -> None:
+        """Insert a batch of audit logs in a single transaction."""
+        with self._pool.connection() as conn, conn:
+            conn.executemany(self._insert_sql, [self.to_row(x) for x in batch])
+
+    def to_row(self, audit_log: dict) -> tuple:
+        """Return the values inserted for an audit log."""
+        req = audit_log.get(attributes.REQUEST) or {}
+        resp = audit_log.get(attributes.RESPONSE) or {}
+        status_code = resp.get(attributes.RESPONSE_STATUS_CODE)
+        if not isinstance(status_code, int):
+            status_code = None
+
+        return (
+            audit_log.get(attributes.ACTION_ID),
+            parse_start_time(audit_log, self.datetime_format),
+            req.get(attributes.REQUEST_ID),
+            req.get(attributes.REQUEST_REMOTE_IP),
+            status_code,
+            req.get(attributes.REQUEST_ROUTE_PATH),
+            dumps(audit_log),
+        )
+
+    def query(self, action_id: Optional[str] = None,
+              start: TimeFilter = None, end: TimeFilter = None,
+              request_id: Optional[str] = None,
+              status_code: Optional[int] = None,
+              limit: int = 100, offset: int = 0,
+              descending: bool = False) -> List[dict]:
+        """Return stored audit logs matching all the given filters.
+
+        Args:
+            action_id: Unique identifier of the action.
+            start: Include audit logs started at or after this time.
+            end: Include audit logs started before this time.
+            request_id: Request ID of the audit logs.
+            status_code: Response status code of the audit logs.
+            limit: Maximum number of audit logs to return.
+            offset: Number of matching audit logs to skip.
+            descending: Set to true to return the newest audit logs first.
+        """
+        sql, params = self._build_query(
+            action_id, to_timestamp(start), to_timestamp(end), request_id,
+            status_code)
+        order = 'DESC' if descending else 'ASC'
+        sql += f' ORDER BY start_time {order}, id {order} LIMIT ? OFFSET ?'
+        params += (limit, offset)
+        with self._pool.connection() as conn:
+            rows = conn.execute(sql, params).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def _build_query(self, action_id, start, end, request_id,
+                     status_code) -> Tuple[str, tuple]:
+        """Return the SQL query and its parameters for the given filters."""
+        conditions = []
+        params = ()
+        for column, op, value in (('action_id', '=', action_id),
+                                  ('start_time', '>=', start),
+                                  ('start_time', '<', end),
+                                  ('request_id', '=', request_id),
+                                  ('status_code', '=', status_code)):
+            if value is not None:
+                conditions.append(f'{column} {op} ?')
+                params += (value,)
+
+        sql = f'SELECT data FROM {self.table}'
+        if conditions:
+            sql += ' WHERE ' + ' AND '.join(conditions)
+
+        return sql, params
+
+    def _connect(self) -> sqlite3.Connection:
+        """Open a new connection to the database."""
+        # Connections are only used by the thread which borrowed them, the
+        # flag allows the pool to close them from another thread.
+        conn = sqlite3.connect(self.path, timeout=30, factory=_Connection,
+                               check_same_thread=False)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        return conn
+
+    def _release(self, conn: _Connection) -> None:
+        """Close a connection discarded by the pool."""
+        if conn.pid != os.getpid():
+            # SQLite connections must not be used across a fork. They are
+            # kept referenced rather than closed, closing the last connection
+            # of a process may checkpoint the WAL the parent is still using.
+            self._inherited_connections.append(conn)
+            return
+
+        conn.close()
+
+    def _close(self) -> None:
+        """Close idle connections of the pool."""
+        self._pool.clear()
@@ -1,3 +1,6 @@
+import socket
+import threading
+
 import pytest
 from flask import Flask
 from flask import jsonify
@@ -5,6 +8,60 @@ from flask import request
 from flask_auditor import FlaskAuditor
 
 
+class TCPServer:
+    def __init__(self, max_reads_per_conn=None):
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind(('127.0.0.1', 0))
+        self.sock.listen()
+        self.address = self.sock.getsockname()
+        self.max_reads_per_conn = max_reads_per_conn
+        self.data = b''
+        self.connections = 0
+        self.closed_connections = 0
+        self.received = threading.Condition()
+        threading.Thread(target=self._serve, daemon=True).start()
+
+    def _serve(self):
+        while True:
+            try:
+                conn, _ = self.sock.accept()
+            except OSError:
+                return
+
+            self.connections += 1
+            threading.Thread(target=self._read, args=(conn,),
+                             daemon=True).start()
+
+    def _read(self, conn):
+        reads = 0
+        with conn:
+            while True:
+                chunk = conn.recv(65536)
+                if not chunk:
+                    break
+
+                with self.received:
+                    self.data += chunk
+                    self.received.notify_all()
+
+                reads += 1
+                if reads == self.max_reads_per_conn:
+                    break
+
+        with self.received:
+            self.closed_connections += 1
+            self.received.notify_all()
+
+    def wait_for(self, predicate, timeout=5):
+        with self.received:
+            return self.received.wait_for(lambda: predicate(self),
+                                          timeout=timeout)
+
+    def close(self):
+        self.sock.close()
+
+
 @pytest.fixture(scope='session')
 def extension_factory():
     def factory(configs=None):
@@ -44,3 +101,17 @@ def extension_factory():
         return app, auditor
 
     return factory
+
+
+@pytest.fixture
+def tcp_server_factory():
+    servers = []
+
+    def factory(max_reads_per_conn=None):
+        server = TCPServer(max_reads_per_conn)
+        servers.append(server)
+        return server
+
+    yield factory
+    for server in servers:
+        server.close()
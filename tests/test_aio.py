@@ -0,0 +1,51 @@
+import asyncio
+import time
+
+from flask_auditor import attributes
+from flask_auditor.aio import EventLoopThread
+
+
+def test_event_loop_thread_limits_concurrency():
+    loop_thread = EventLoopThread(concurrency=5)
+    running = []
+    peak = []
+
+    async def handler(i):
+        running.append(i)
+        peak.append(len(running))
+        await asyncio.sleep(0.01)
+        running.remove(i)
+
+    futures = [loop_thread.submit(handler, i) for i in range(50)]
+    assert loop_thread.running
+    loop_thread.shutdown(timeout=5)
+    assert all(f.done() for f in futures)
+    assert len(peak) == 50
+    assert max(peak) == 5
+    assert loop_thread.pending == 0
+    assert not loop_thread.running
+
+
+def test_flask_auditor_async_handler(extension_factory):
+    app, auditor = extension_factory(configs={
+        'AUDIT_LOGGER_ASYNC_CONCURRENCY': 10,
+    })
+    logs = []
+
+    async def handler(audit_log):
+        await asyncio.sleep(0.01)
+        logs.append(audit_log)
+
+    auditor.register_log_handler(handler)
+    with app.test_client() as client:
+        for i in range(20):
+            client.get(f'/api/v1/users/{i}')
+
+    for _ in range(200):
+        if auditor.metrics.get('async_pending') == 0 and len(logs) == 20:
+            break
+        time.sleep(0.01)
+
+    auditor.shutdown(timeout=5)
+    assert len(logs) == 20
+    assert {x[attributes.ACTION_ID] for x in logs} == {'GET_USER'}
@@ -0,0 +1,67 @@
+import threading
+import time
+
+from flask_auditor import attributes
+from flask_auditor.budget import MemoryBudget
+
+
+def test_memory_budget():
+    budget = MemoryBudget(100)
+    assert budget.try_acquire(60)
+    assert not budget.try_acquire(60)
+    budget.acquire(60)
+    assert budget.used == 120
+    budget.release(120)
+    assert budget.used == 0
+    assert MemoryBudget().try_acquire(10 ** 12)
+
+
+def wait_for(predicate):
+    for _ in range(200):
+        if predicate():
+            return True
+        time.sleep(0.01)
+    return False
+
+
+def test_flask_auditor_memory_budget(extension_factory):
+    app, auditor = extension_factory(configs={
+        'AUDIT_LOGGER_MEMORY_BUDGET': 1,
+        'AUDIT_LOGGER_MEMORY_SAMPLE_RATE': 1.0,
+    })
+    logs = []
+    release = threading.Event()
+
+    def handler(audit_log):
+        release.wait(5)
+        logs.append(audit_log)
+
+    auditor.register_log_handler(handler)
+    with app.test_client() as client:
+        client.post('/api/v1/users', json={'name': 'makai'})
+        assert auditor.metrics.get('memory_in_flight_bytes') > 0
+        release.set()
+
+    assert wait_for(lambda: logs)
+    assert logs[0][attributes.REQUEST][attributes.REQUEST_BODY] == 'N/A'
+    assert wait_for(lambda: auditor.metrics.get('memory_in_flight_bytes') == 0)
+    metrics = auditor.metrics.snapshot()
+    assert metrics['events_body_dropped'] == 1
+    assert metrics['events_sampled'] == 1
+    assert metrics['memory_budget_bytes'] == 1
+
+
+def test_flask_auditor_memory_budget_drops_events(extension_factory):
+    app, auditor = extension_factory(configs={
+        'AUDIT_LOGGER_MEMORY_BUDGET': 1,
+        'AUDIT_LOGGER_MEMORY_SAMPLE_RATE': 0.0,
+    })
+    logs = []
+    auditor.register_log_handler(logs.append)
+    with app.test_client() as client:
+        client.get('/api/v1/users/1')
+
+    time.sleep(0.05)
+    assert logs == []
+    assert auditor.metrics.get('events_dropped') == 1
+    assert auditor.metrics.get('events_body_dropped') == 0
@@ -0,0 +1,105 @@
+import json
+import math
+import os
+
+import pytest
+
+from flask_auditor import attributes
+from flask_auditor.cli import main
+from flask_auditor.columnar import NULL_INT
+from flask_auditor.columnar import ColumnarExporter
+from flask_auditor.columnar import ColumnarReader
+from flask_auditor.sinks import SegmentedLogSink
+
+
+def make_log(i):
+    return {
+        attributes.ACTION_ID: 'CREATE_USER' if i % 3 == 0 else 'GET_USER',
+        attributes.START_TIME: f'2024-05-22 10:{i % 60:02d}:00',
+        attributes.REQUEST: {
+            attributes.REQUEST_ID: f'req-{i}',
+            attributes.REQUEST_ROUTE_PATH: '/api/v1/users',
+        },
+        attributes.RESPONSE: {
+            attributes.RESPONSE_STATUS_CODE: 201 if i % 3 == 0 else 200,
+            attributes.RESPONSE_SIZE: 'N/A' if i == 4 else i * 10,
+        },
+        attributes.LATENCY: i / 1000,
+    }
+
+
+def test_columnar_export(tmp_path):
+    with ColumnarExporter(str(tmp_path), chunk_rows=4) as exporter:
+        exporter.write(make_log(i) for i in range(10))
+    assert (exporter.rows, exporter.chunks) == (10, 3)
+
+    chunks = list(ColumnarReader(str(tmp_path)).chunks())
+    assert [x.rows for x in chunks] == [4, 4, 2]
+    chunk = chunks[1]
+    status_codes = chunk.column(attributes.RESPONSE_STATUS_CODE)
+    assert list(status_codes) == [200, 200, 201, 200]
+    assert list(chunk.column(attributes.RESPONSE_SIZE)) == [
+        NULL_INT, 50, 60, 70]
+    assert list(chunk.column(attributes.LATENCY)) == [
+        0.004, 0.005, 0.006, 0.007]
+    assert chunk.dictionary(attributes.ACTION_ID) == [
+        'GET_USER', 'CREATE_USER']
+    assert chunk.decode(attributes.ACTION_ID) == [
+        'GET_USER', 'GET_USER', 'CREATE_USER', 'GET_USER']
+    assert chunk.decode(attributes.REQUEST_METHOD) == [None] * 4
+    start_time = chunk.column(attributes.START_TIME)
+    assert start_time[1] - start_time[0] == 60
+    del status_codes, start_time
+    for chunk in chunks:
+        chunk.close()
+
+    # Chunks are numbered after the existing ones.
+    with ColumnarExporter(str(tmp_path)) as exporter:
+        exporter.write([{attributes.START_TIME: 'N/A'}])
+    chunk = list(ColumnarReader(str(tmp_path)).chunks())[-1]
+    assert chunk.path.endswith('chunk-000003.col')
+    assert math.isnan(chunk.column(attributes.START_TIME)[0])
+    chunk.close()
+
+    # Deleted chunks are not reused, the newest one is never overwritten.
+    os.remove(tmp_path / 'chunk-000001.col')
+    with ColumnarExporter(str(tmp_path)) as exporter:
+        exporter.write([make_log(10)])
+    assert [os.path.basename(x) for x in ColumnarReader(
+        str(tmp_path)).chunk_paths()] == [
+        'chunk-000000.col', 'chunk-000002.col', 'chunk-000003.col',
+        'chunk-000004.col']
+
+    with pytest.raises(ValueError):
+        ColumnarExporter(str(tmp_path), chunk_rows=0)
+
+
+def test_columnar_load(tmp_path):
+    numpy = pytest.importorskip('numpy')
+    with ColumnarExporter(str(tmp_path), chunk_rows=4) as exporter:
+        exporter.write(make_log(i) for i in range(4))
+        exporter.write([{attributes.ACTION_ID: 'LOGIN'}, make_log(6)])
+
+    columns, dictionaries = ColumnarReader(str(tmp_path)).load(
+        [attributes.ACTION_ID, attributes.RESPONSE_STATUS_CODE])
+    assert dictionaries[attributes.ACTION_ID] == [
+        'CREATE_USER', 'GET_USER', 'LOGIN']
+    assert columns[attributes.ACTION_ID].tolist() == [0, 1, 1, 0, 2, 0]
+    codes = columns[attributes.RESPONSE_STATUS_CODE]
+    assert int(numpy.sum(codes == 201)) == 3
+
+
+def test_cli_export(tmp_path, capsys):
+    sink = SegmentedLogSink(str(tmp_path / 'segments'), compression=None)
+    sink.write_batch([make_log(i) for i in range(5)])
+    sink.close()
+    path = tmp_path / 'logs.jsonl'
+    path.write_text(''.join(json.dumps(make_log(i)) + '\n'
+                            for i in range(5, 8)))
+
+    assert main(['export', str(tmp_path / 'segments'), str(path),
+                 '--output', str(tmp_path / 'columns')]) == 0
+    assert capsys.readouterr().out == '8 audit logs, 1 chunks\n'
+    chunk, = ColumnarReader(str(tmp_path / 'columns')).chunks()
+    assert chunk.rows == 8
+    chunk.close()
@@ -35,3 +35,23 @@ def test_audit_logger_config(options):
     cfg = AuditLoggerConfig(**options)
     for opt in options:
         assert getattr(cfg, opt) == options[opt]
+
+
+def test_audit_logger_config_derive():
+    cfg = AuditLoggerConfig(not_available='NA')
+    derived = cfg.derive(include=('request_id', 'status_code'),
+                         default_request_headers=('X-Tenant',))
+    for field in AuditLoggerConfig.fields:
+        expected = field in ('request_id', 'status_code')
+        assert getattr(derived, f'log_{field}') is expected
+
+    assert derived.not_available == 'NA'
+    assert derived.default_request_headers == ('X-Tenant',)
+    assert cfg.log_request_body is True
+
+    derived = cfg.derive(exclude=('request_body',))
+    assert derived.log_request_body is False
+    assert derived.log_request_headers is True
+
+    with pytest.raises(ValueError):
+        cfg.derive(include=('unknown',))
@@ -0,0 +1,80 @@
+import threading
+import time
+
+from flask_auditor.dispatcher import Dispatcher
+
+
+def test_dispatcher_scales_with_queue_depth():
+    dispatcher = Dispatcher(min_workers=1, max_workers=4, scale_up_wait=0.01,
+                            idle_timeout=0.05)
+    done = []
+
+    def task(i):
+        time.sleep(0.02)
+        done.append(i)
+
+    for i in range(100):
+        assert dispatcher.submit(task, i)
+        time.sleep(0.002)
+
+    assert dispatcher.workers > 1
+    assert dispatcher.metrics.get('workers_scaled_up') >= 1
+    assert dispatcher.flush(5)
+    assert sorted(done) == list(range(100))
+    assert dispatcher.latency > 0
+
+    deadline = time.monotonic() + 5
+    while dispatcher.workers > 1 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert dispatcher.workers == 1
+    assert dispatcher.metrics.get('workers_scaled_down') >= 1
+    dispatcher.shutdown()
+    assert dispatcher.workers == 0
+
+
+def test_dispatcher_queue_full():
+    dispatcher = Dispatcher(min_workers=1, max_workers=1, max_queue_size=1)
+    release = threading.Event()
+    dispatcher.submit(release.wait)
+    accepted = [dispatcher.submit(release.wait) for _ in range(3)]
+    assert accepted.count(False) >= 2
+    assert dispatcher.metrics.get('events_queue_full') >= 2
+    assert not dispatcher.flush(0.01)
+    release.set()
+    assert dispatcher.flush(5)
+    dispatcher.shutdown()
+
+
+def test_dispatcher_without_min_workers():
+    dispatcher = Dispatcher(min_workers=0, idle_timeout=0.01)
+    done = []
+    for i in range(3):
+        assert dispatcher.submit(done.append, i)
+        assert dispatcher.flush(5)
+        deadline = time.monotonic() + 5
+        while dispatcher.workers and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert dispatcher.workers == 0
+
+    assert done == [0, 1, 2]
+    dispatcher.submit(done.append, 3)
+    dispatcher.shutdown()
+    assert done == [0, 1, 2, 3]
+    assert dispatcher.workers == dispatcher.depth == 0
+
+
+def test_flask_auditor_flush(extension_factory):
+    app, auditor = extension_factory(configs={
+        'AUDIT_LOGGER_MAX_WORKERS': 2,
+    })
+    logs = []
+    auditor.register_log_handler(logs.append)
+    with app.test_client() as client:
+        for i in range(10):
+            client.get(f'/api/v1/users/{i}')
+
+    assert auditor.flush(5)
+    assert len(logs) == 10
+    assert auditor.metrics.get('queue_depth') == 0
+    assert 1 <= auditor.metrics.get('workers') <= 2
+    auditor.shutdown()
@@ -1,3 +1,15 @@
+import json
+import threading
+import time
+
+import pytest
+from flask import Blueprint
+from flask import Flask
+from flask import g
+from flask import jsonify
+from flask import request
+
+from flask_auditor import FlaskAuditor
 from flask_auditor import attributes
 
 log_values = {}
@@ -35,3 +47,183 @@ def test_flask_auditor(extension_factory):
         assert log_values.get(attributes.ACTION_DESCRIPTION) == 'Create user'
         assert 'password' not in log_values[attributes.REQUEST][
             attributes.REQUEST_BODY]
+
+
+def test_flask_auditor_per_action_fields():
+    app = Flask(__name__)
+    auditor = FlaskAuditor(app)
+    logs = []
+
+    @app.route('/api/v1/users/<int:user_id>', methods=['DELETE'])
+    @auditor.log(action_id='DELETE_USER',
+                 include=('request_id', 'status_code', 'latency'))
+    def delete_user(user_id):
+        return '', 204
+
+    @app.route('/api/v1/users', methods=['POST'])
+    @auditor.log(action_id='CREATE_USER', exclude=('request_body',),
+                 headers=('X-Tenant',))
+    def create_user():
+        return jsonify({'id': 1}), 201
+
+    auditor.register_log_handler(logs.append)
+    with app.test_client() as client:
+        client.delete('/api/v1/users/1', headers={'X-Request-Id': 'abc'})
+        client.post('/api/v1/users', json={'name': 'makai'},
+                    headers={'X-Tenant': 'acme'})
+
+    for _ in range(100):
+        if len(logs) == 2:
+            break
+        time.sleep(0.01)
+
+    logs = {x[attributes.ACTION_ID]: x for x in logs}
+    assert logs['DELETE_USER'][attributes.REQUEST] == {
+        attributes.REQUEST_ID: 'abc'}
+    assert logs['DELETE_USER'][attributes.RESPONSE] == {
+        attributes.RESPONSE_STATUS_CODE: 204}
+    assert attributes.LATENCY in logs['DELETE_USER']
+
+    req = logs['CREATE_USER'][attributes.REQUEST]
+    assert attributes.REQUEST_BODY not in req
+    assert req[attributes.REQUEST_HEADERS] == {'X-Tenant': 'acme'}
+    assert req[attributes.REQUEST_METHOD] == 'POST'
+
+    with pytest.raises(ValueError):
+        auditor.log(action_id='INVALID', include=('unknown',))
+
+
+def test_flask_auditor_deferred_hook():
+    app = Flask(__name__)
+    auditor = FlaskAuditor(app)
+    logs = []
+    request_threads = []
+
+    @app.route('/api/v1/users/<int:user_id>', methods=['GET'])
+    @auditor.log(action_id='GET_USER')
+    def get_user(user_id):
+        g.user = {'id': 42}
+        request_threads.append(threading.get_ident())
+        return jsonify({'id': user_id})
+
+    def deferred_hook(flask_req, flask_resp, captured):
+        assert threading.get_ident() not in request_threads
+        return {'actorId': captured['user']['id'],
+                'path': flask_req.path,
+                'statusCode': flask_resp.status_code}
+
+    auditor.register_capture('user', lambda: g.get('user'))
+    auditor.register_deferred_hook(deferred_hook)
+    auditor.register_log_handler(logs.append)
+    with app.test_client() as client:
+        client.get('/api/v1/users/1')
+
+    for _ in range(100):
+        if logs:
+            break
+        time.sleep(0.01)
+
+    assert logs[0]['actorId'] == 42
+    assert logs[0]['path'] == '/api/v1/users/1'
+    assert logs[0]['statusCode'] == 200
+
+    with pytest.raises(TypeError):
+        auditor.register_capture('user', None)
+
+
+def test_flask_auditor_register_rule():
+    app = Flask(__name__)
+    auditor = FlaskAuditor(app)
+    admin = Blueprint('admin', __name__, url_prefix='/admin')
+    logs = []
+
+    @admin.route('/users', methods=['GET', 'POST'])
+    def admin_users():
+        return jsonify([])
+
+    @admin.route('/settings', methods=['PUT'])
+    @auditor.log(action_id='UPDATE_SETTINGS')
+    def admin_settings():
+        return jsonify({})
+
+    @app.route('/api/v1/reports/<int:report_id>', methods=['GET', 'DELETE'])
+    def report(report_id):
+        return jsonify({})
+
+    @app.route('/health')
+    def health():
+        return 'ok'
+
+    app.register_blueprint(admin)
+    auditor.register_rule('ADMIN', blueprint='admin')
+    auditor.register_rule('DELETE_REPORT', rule='/api/v1/reports/*',
+                          methods=['DELETE'], include=('status_code',))
+    auditor.register_log_handler(logs.append)
+    with app.test_client() as client:
+        client.get('/admin/users')
+        client.put('/admin/settings')
+        client.get('/api/v1/reports/1')
+        client.delete('/api/v1/reports/1')
+        client.get('/health')
+
+    for _ in range(100):
+        if len(logs) == 3:
+            break
+        time.sleep(0.01)
+
+    time.sleep(0.05)
+    assert sorted(x[attributes.ACTION_ID] for x in logs) == [
+        'ADMIN', 'DELETE_REPORT', 'UPDATE_SETTINGS']
+    delete_log = [x for x in logs
+                  if x[attributes.ACTION_ID] == 'DELETE_REPORT'][0]
+    assert delete_log[attributes.REQUEST] == {}
+    assert delete_log[attributes.RESPONSE] == {
+        attributes.RESPONSE_STATUS_CODE: 200}
+
+    with pytest.raises(ValueError):
+        auditor.register_rule('INVALID')
+
+
+def test_clone_current_request_reuses_parsed_data():
+    app = Flask(__name__)
+    with app.test_request_context('/?page=1', json={'name': 'makai'}):
+        data = request.get_json()
+        args = request.args
+        flask_req = FlaskAuditor._clone_current_request()
+        assert flask_req.get_json() is data
+        assert flask_req.args is args
+
+    with app.test_request_context('/', data={'name': 'makai'}):
+        form = request.form
+        flask_req = FlaskAuditor._clone_current_request()
+        assert flask_req.form is form
+
+    with app.test_request_context('/?page=1', json={'name': 'makai'}):
+        flask_req = FlaskAuditor._clone_current_request()
+        assert 'args' not in request.__dict__
+        assert flask_req.get_json() == {'name': 'makai'}
+        assert flask_req.args.to_dict() == {'page': '1'}
+
+
+def test_flask_auditor_handler_input(extension_factory):
+    app, auditor = extension_factory()
+    logs, records = [], []
+
+    class RecordHandler:
+        accepts_records = True
+
+        def __call__(self, record):
+            records.append(record)
+
+    auditor.register_log_handler(lambda x: logs.append(json.dumps(x)))
+    auditor.register_log_handler(lambda x: logs.append(isinstance(x, dict)))
+    auditor.register_log_handler(RecordHandler())
+    with app.test_client() as client:
+        client.get('/api/v1/users/1')
+
+    auditor.flush()
+    assert True in logs
+    audit_log = json.loads(next(x for x in logs if isinstance(x, str)))
+    assert audit_log[attributes.ACTION_ID] == 'GET_USER'
+    assert records[0].action_id == 'GET_USER'
+    assert json.loads(records[0].to_json()) == audit_log
@@ -0,0 +1,65 @@
+import json
+import os
+
+import pytest
+
+from flask_auditor import attributes
+from flask_auditor import forksafe
+from flask_auditor.sinks import SocketSink
+
+
+@pytest.mark.skipif(not hasattr(os, 'fork'), reason='requires os.fork')
+def test_events_delivered_after_fork(extension_factory, tcp_server_factory):
+    server = tcp_server_factory()
+    app, auditor = extension_factory()
+    sink = SocketSink(server.address, flush_interval=0.01)
+    auditor.register_log_handler(sink)
+
+    def create_user(name):
+        with app.test_client() as client:
+            client.post('/api/v1/users', json={'name': name})
+
+    # Writer threads and a pooled connection exist before the fork, as in
+    # apps preloaded by the server.
+    create_user('before')
+    assert server.wait_for(lambda srv: srv.data.count(b'\n') == 1)
+
+    pid = os.fork()
+    if pid == 0:
+        code = 1
+        try:
+            create_user('child')
+            assert auditor.flush(5)
+            sink.flush()
+            code = 0
+        finally:
+            os._exit(code)
+
+    create_user('parent')
+    _, status = os.waitpid(pid, 0)
+    assert os.WIFEXITED(status) and os.WEXITSTATUS(status) == 0
+    assert server.wait_for(lambda srv: srv.data.count(b'\n') == 3)
+    records = [json.loads(line) for line in server.data.splitlines()]
+    assert [r[attributes.ACTION_ID] for r in records] == ['CREATE_USER'] * 3
+    assert sorted(r[attributes.REQUEST][attributes.REQUEST_BODY]['name']
+                  for r in records) == ['before', 'child', 'parent']
+    sink.close()
+    server.close()
+
+
+def test_check_resets_registered_objects(monkeypatch):
+    class Resource:
+        resets = 0
+
+        def _after_fork(self):
+            self.resets += 1
+
+    resource = Resource()
+    forksafe.register(resource)
+    forksafe.check()
+    assert resource.resets == 0
+
+    monkeypatch.setattr(forksafe, '_pid', -1)
+    forksafe.check()
+    assert resource.resets == 1
+    assert forksafe._pid == os.getpid()
@@ -0,0 +1,151 @@
+import gzip
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer
+
+import pytest
+
+from flask_auditor.sinks import HTTPSink
+
+
+class Collector:
+    def __init__(self, port=0):
+        self.records = []
+        self.clients = set()
+        self.responses = []
+        collector = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers['Content-Length']))
+                status, headers = 200, {}
+                if collector.responses:
+                    status, headers = collector.responses.pop(0)
+
+                if status == 200:
+                    assert self.headers['Content-Encoding'] == 'gzip'
+                    lines = gzip.decompress(body).decode('utf-8').splitlines()
+                    collector.records.extend(json.loads(x) for x in lines)
+                    collector.clients.add(self.client_address)
+
+                self.send_response(status)
+                for key, value in headers.items():
+                    self.send_header(key, value)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', port), Handler)
+        self.url = 'http://127.0.0.1:%d/logs' % self.server.server_port
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def test_http_sink_posts_gzip_batches_over_keep_alive():
+    collector = Collector()
+    sink = HTTPSink(collector.url, pool_size=1, batch_size=10,
+                    flush_interval=0.01)
+    for i in range(10):
+        sink({'seq': i})
+    sink.flush()
+    for i in range(10, 30):
+        sink({'seq': i})
+    sink.flush()
+
+    assert [r['seq'] for r in collector.records] == list(range(30))
+    assert len(collector.clients) == 1
+    sink.close()
+    collector.close()
+
+
+def test_http_sink_honours_retry_after():
+    collector = Collector()
+    collector.responses.append((503, {'Retry-After': '1'}))
+    sink = HTTPSink(collector.url, flush_interval=0.01, backoff_initial=0)
+    started = time.monotonic()
+    sink({'seq': 1})
+    sink.flush()
+
+    assert time.monotonic() - started >= 0.9
+    assert collector.records == [{'seq': 1}]
+    sink.close()
+    collector.close()
+
+
+def test_http_sink_spools_when_collector_is_unavailable(tmp_path):
+    collector = Collector()
+    port = collector.server.server_port
+    collector.close()
+
+    sink = HTTPSink(f'http://127.0.0.1:{port}/logs', flush_interval=0.01,
+                    max_retries=1, backoff_initial=0.01, timeout=1,
+                    spool_dir=str(tmp_path))
+    sink({'seq': 1})
+    sink.flush()
+    assert len(list(tmp_path.iterdir())) == 1
+
+    collector = Collector(port)
+    sink({'seq': 2})
+    sink.flush()
+    assert sorted(r['seq'] for r in collector.records) == [1, 2]
+    assert list(tmp_path.iterdir()) == []
+    sink.close()
+    collector.close()
+
+
+def test_http_sink_recovers_stale_spool_claims(tmp_path):
+    process = subprocess.Popen([sys.executable, '-c', 'pass'])
+    process.wait()
+    body = gzip.compress(b'{"seq": 1}\n')
+    # Claimed by a process which died while draining the spool.
+    (tmp_path / f'spool-1.ndjson.gz.{process.pid}.1').write_bytes(body)
+    # Claimed by a thread of this process a long time ago.
+    stale = tmp_path / f'spool-2.ndjson.gz.{os.getpid()}.1'
+    stale.write_bytes(gzip.compress(b'{"seq": 2}\n'))
+    os.utime(stale, (time.time() - 3600, time.time() - 3600))
+    # Claimed by a thread of this process which is still posting it.
+    active = tmp_path / f'spool-3.ndjson.gz.{os.getpid()}.1'
+    active.write_bytes(gzip.compress(b'{"seq": 3}\n'))
+
+    collector = Collector()
+    sink = HTTPSink(collector.url, flush_interval=0.01,
+                    spool_dir=str(tmp_path))
+    sink({'seq': 4})
+    sink.flush()
+    assert sorted(r['seq'] for r in collector.records) == [1, 2, 4]
+    assert list(tmp_path.iterdir()) == [active]
+    sink.close()
+    collector.close()
+
+
+def test_http_sink_sync_write_waits_for_chain_within_timeout():
+    collector = Collector()
+    collector.responses.append((503, {'Retry-After': '3'}))
+    sink = HTTPSink(collector.url, flush_interval=0.01, integrity_key='k',
+                    sync_timeout=0.5)
+    sink({'seq': 1})
+    # The writer thread holds the chain while it waits to retry.
+    deadline = time.monotonic() + 5
+    while collector.responses and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+    started = time.monotonic()
+    with pytest.raises(TimeoutError):
+        sink.write({'seq': 2})
+    assert time.monotonic() - started < 1
+    sink.flush()
+    assert [r['seq'] for r in collector.records] == [1]
+    sink.close()
+    collector.close()
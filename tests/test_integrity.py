@@ -0,0 +1,124 @@
+import json
+
+import pytest
+
+from flask_auditor import attributes
+from flask_auditor.cli import main
+from flask_auditor.integrity import IntegrityChain
+from flask_auditor.integrity import verify_lines
+from flask_auditor.record import dumps
+from flask_auditor.sinks import SegmentedLogReader
+from flask_auditor.sinks import SegmentedLogSink
+
+KEY = 'secret'
+
+
+def make_log(i):
+    return {
+        attributes.ACTION_ID: 'GET_USER',
+        attributes.START_TIME: f'2024-05-22 10:{i % 60:02d}:00',
+        attributes.REQUEST: {attributes.REQUEST_ID: f'req-{i}'},
+    }
+
+
+def seal_lines(batches, chain=None):
+    chain = chain or IntegrityChain(KEY)
+    lines = []
+    for batch in batches:
+        for audit_log in chain.seal(batch):
+            lines.append(dumps(audit_log).encode('utf-8'))
+    return lines
+
+
+def verify(lines, key=KEY):
+    return verify_lines(((x, str(i)) for i, x in enumerate(lines)), key)
+
+
+def test_sealed_records():
+    chain = IntegrityChain(KEY)
+    audit_log = make_log(1)
+    first, last = chain.seal([audit_log, make_log(2)])
+    assert first[attributes.INTEGRITY] == {
+        'chain': chain.chain, 'batch': 0, 'seq': 0}
+    assert last[attributes.INTEGRITY]['size'] == 2
+    assert json.loads(dumps(first)) == dict(first)
+    assert attributes.INTEGRITY not in audit_log
+
+    verifier = verify(seal_lines([[make_log(i) for i in range(7)],
+                                  [make_log(7)]], chain))
+    assert verifier.errors == []
+    assert (verifier.records, verifier.batches, verifier.chains) == (8, 2, 1)
+
+
+def test_verify_detects_tampering():
+    lines = seal_lines([[make_log(i) for i in range(5)] for _ in range(3)])
+
+    altered = list(lines)
+    altered[6] = altered[6].replace(b'req-1', b'req-9')
+    assert 'was altered' in verify(altered).errors[0]
+
+    assert 'out of sequence' in verify(lines[:6] + lines[7:]).errors[0]
+    assert 'missing' in verify(lines[:5] + lines[10:]).errors[0]
+    assert 'incomplete' in verify(lines[:12]).errors[0]
+    assert 'invalid HMAC' in verify(lines, 'other').errors[0]
+    assert not verify(lines[5:]).errors
+    # Batches delivered again after a failure may be out of order.
+    assert not verify(lines[5:10] + lines[:5] + lines[10:]).errors
+
+
+def test_segment_sink_integrity(tmp_path, capsys):
+    with pytest.raises(ValueError):
+        SegmentedLogSink(str(tmp_path), integrity_key='')
+
+    sink = SegmentedLogSink(str(tmp_path), integrity_key=KEY,
+                            max_segment_bytes=2000, flush_interval=0.01,
+                            batch_size=8)
+    for i in range(50):
+        sink(make_log(i))
+    sink.flush()
+    sink.write(make_log(50))
+    sink.close()
+
+    reader = SegmentedLogReader(str(tmp_path))
+    assert len(reader.segments()) > 1
+    assert any(x.path.endswith('.gz') for x in reader.segments())
+    assert reader.query(request_id='req-7')[0][attributes.INTEGRITY][
+        'seq'] == 7
+
+    assert main(['verify', str(tmp_path), '--key', KEY]) == 0
+    assert capsys.readouterr().out.startswith('51 audit logs')
+
+    sink = SegmentedLogSink(str(tmp_path), compression=None)
+    sink.write(make_log(51))
+    sink.close()
+    assert main(['verify', str(tmp_path), '--key', KEY, '--jobs', '1']) == 1
+    assert 'is not sealed' in capsys.readouterr().err
+
+
+def test_reseal_sealed_records():
+    lines = seal_lines([[make_log(i) for i in range(3)]])
+    chain = IntegrityChain('other')
+    resealed = seal_lines([[json.loads(x) for x in lines]], chain)
+    for line in resealed:
+        pairs = json.loads(line, object_pairs_hook=list)
+        assert [k for k, _ in pairs].count(attributes.INTEGRITY) == 1
+        assert dict(dict(pairs)[attributes.INTEGRITY])['chain'] == (
+            chain.chain)
+
+    assert verify(resealed, 'other').errors == []
+    assert len(dict(chain.seal([json.loads(lines[0])])[0])) == 4
+
+
+@pytest.mark.parametrize('field, value', [
+    ('chain', '["x"]'), ('batch', '"0"'), ('seq', '"2"'), ('size', '"3"'),
+    ('size', 'true'), ('mac', '1')])
+def test_verify_reports_seals_with_wrong_types(field, value):
+    lines = seal_lines([[make_log(i) for i in range(3)]])
+    sealed = json.loads(lines[-1])[attributes.INTEGRITY]
+    old = f'"{field}":{json.dumps(sealed[field])}'.encode()
+    assert old in lines[-1]
+    lines[-1] = lines[-1].replace(old, f'"{field}":{value}'.encode())
+
+    errors = verify(lines).errors
+    assert errors
+    assert 'invalid seal' in errors[0]
@@ -0,0 +1,144 @@
+import socket
+import threading
+import time
+
+import pytest
+
+from flask_auditor import FlaskAuditor
+from flask_auditor import attributes
+from flask_auditor.sinks import BaseSink
+from flask_auditor.sinks import HTTPSink
+
+
+def add_routes(app, auditor):
+    @app.route('/users', methods=['GET'])
+    @auditor.log(action_id='GET_USERS', priority='low')
+    def get_users():
+        return {'users': []}
+
+    @app.route('/users/<int:user_id>', methods=['DELETE'])
+    @auditor.log(action_id='DELETE_USER', priority='high')
+    def delete_user(user_id):
+        return '', 204
+
+    @app.route('/login', methods=['POST'])
+    @auditor.log(action_id='LOGIN', priority='high', sync=True)
+    def login():
+        return {'token': 'x'}
+
+
+def test_high_priority_lane_is_not_starved(extension_factory):
+    app, auditor = extension_factory({'AUDIT_LOGGER_MAX_WORKERS': 1})
+    add_routes(app, auditor)
+    release = threading.Event()
+    deleted = threading.Event()
+
+    def handler(audit_log):
+        if audit_log[attributes.ACTION_ID] == 'CREATE_USER':
+            release.wait(5)
+        elif audit_log[attributes.ACTION_ID] == 'DELETE_USER':
+            deleted.set()
+
+    auditor.register_log_handler(handler)
+    with app.test_client() as client:
+        for _ in range(3):
+            client.post('/api/v1/users', json={'name': 'makai'})
+        client.delete('/users/1')
+
+    assert deleted.wait(5)
+    assert auditor.metrics.get('queue_depth') >= 1
+    release.set()
+    assert auditor.flush(5)
+    auditor.shutdown()
+
+
+def test_priority_memory_budget(extension_factory):
+    app, auditor = extension_factory({
+        'AUDIT_LOGGER_MEMORY_BUDGET': 1,
+        'AUDIT_LOGGER_MEMORY_SAMPLE_RATE': 1.0,
+    })
+    add_routes(app, auditor)
+    logs = []
+    auditor.register_log_handler(logs.append)
+    with app.test_client() as client:
+        client.get('/users')
+        client.delete('/users/1', json={'reason': 'spam'})
+
+    assert auditor.flush(5)
+    assert [x[attributes.ACTION_ID] for x in logs] == ['DELETE_USER']
+    assert logs[0][attributes.REQUEST][attributes.REQUEST_BODY] == {
+        'reason': 'spam'}
+    assert auditor.metrics.get('events_dropped') == 1
+    assert auditor.metrics.get('events_sampled') == 0
+
+
+class MemorySink(BaseSink):
+    def __init__(self):
+        super().__init__()
+        self.logs = []
+
+    def write_batch(self, batch):
+        self.logs.extend(batch)
+
+
+def test_sync_delivery(extension_factory):
+    app, auditor = extension_factory()
+    add_routes(app, auditor)
+    sink = MemorySink()
+    auditor.register_log_handler(sink)
+
+    with app.test_client() as client:
+        client.post('/login', json={'user': 'makai', 'password': 'secret'})
+        assert [x[attributes.ACTION_ID] for x in sink.logs] == ['LOGIN']
+
+    assert sink.logs[0][attributes.REQUEST][attributes.REQUEST_BODY] == {
+        'user': 'makai'}
+    assert not sink._threads
+
+
+def test_sync_delivery_failure(extension_factory):
+    app, auditor = extension_factory()
+    add_routes(app, auditor)
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+    sink = HTTPSink(f'http://127.0.0.1:{port}/logs', backoff_initial=0.2,
+                    sync_timeout=0.5)
+    auditor.register_log_handler(sink)
+
+    started = time.monotonic()
+    with app.test_client() as client:
+        assert client.post('/login', json={'user': 'makai'}).status_code == 200
+
+    assert time.monotonic() - started < 2
+    assert auditor.metrics.get('events_sync_failed') == 1
+    assert not sink._buffer
+    sink.close()
+
+
+def test_unknown_priority():
+    auditor = FlaskAuditor()
+    with pytest.raises(ValueError):
+        auditor.log(action_id='GET_USERS', priority='urgent')
+
+
+def test_sync_extraction_failure(extension_factory):
+    app, auditor = extension_factory()
+    add_routes(app, auditor)
+    sink = MemorySink()
+    auditor.register_log_handler(sink)
+    with app.test_client() as client:
+        resp = client.post('/login', data='{"user": ',
+                           content_type='application/json')
+        assert resp.status_code == 200
+        assert auditor.metrics.get('events_sync_failed') == 1
+
+        def hook(flask_req, flask_resp, captured):
+            raise RuntimeError('enrichment failed')
+
+        auditor.register_deferred_hook(hook)
+        resp = client.post('/login', json={'user': 'makai'})
+        assert resp.status_code == 200
+        assert auditor.metrics.get('events_sync_failed') == 2
+
+    assert sink.logs == []
@@ -0,0 +1,66 @@
+import json
+
+from flask_auditor import AuditRecord
+from flask_auditor import attributes
+from flask_auditor.record import RequestRecord
+from flask_auditor.record import ResponseRecord
+from flask_auditor.sinks.base import dumps
+
+
+def make_record(**kwargs):
+    return AuditRecord(
+        source='test', start_time='2023-01-01T00:00:00', action_id='login',
+        description=None,
+        request=RequestRecord(None, request_id='abc', method='POST',
+                              headers={'X-Empty': None}),
+        response=ResponseRecord(None, status_code=200),
+        **kwargs)
+
+
+def test_audit_record():
+    record = make_record(latency=0.1)
+    assert record.request.request_id == 'abc'
+    assert record.response.status_code == 200
+    assert not hasattr(record, '__dict__')
+
+    audit_log = record.to_dict()
+    assert record.to_dict() is audit_log
+    assert record.to_json() is record.to_json()
+    assert dumps(record) == record.to_json()
+    assert json.loads(record.to_json()) == audit_log
+
+    assert record[attributes.ACTION_ID] == 'login'
+    assert record[attributes.LATENCY] == 0.1
+    assert record[attributes.REQUEST] == {
+        attributes.REQUEST_ID: 'abc',
+        attributes.REQUEST_METHOD: 'POST',
+        attributes.REQUEST_HEADERS: {'X-Empty': None},
+    }
+    assert record[attributes.RESPONSE].get(
+        attributes.RESPONSE_STATUS) is None
+    assert dict(record) == audit_log
+
+
+def test_audit_record_update():
+    record = make_record()
+    assert attributes.LATENCY not in record
+
+    json_log = record.to_json()
+    record.update_extra({'userID': 1})
+    assert record['userID'] == 1
+    assert record.to_json() != json_log
+
+    record['tenant'] = 'acme'
+    del record['userID']
+    assert json.loads(record.to_json())['tenant'] == 'acme'
+    assert 'userID' not in record
+
+
+def test_record_not_available():
+    record = RequestRecord('N/A', request_id=None,
+                           headers={'X-Empty': None},
+                           query_params={'q': [None, 'a']})
+    assert record[attributes.REQUEST_ID] == 'N/A'
+    assert record[attributes.REQUEST_HEADERS] == {'X-Empty': 'N/A'}
+    assert record[attributes.REQUEST_QUERY_PARAMS] == {'q': ['N/A', 'a']}
+    assert attributes.REQUEST_BODY not in record
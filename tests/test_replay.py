@@ -0,0 +1,174 @@
+import gzip
+import json
+import os
+import socket
+import time
+
+from flask_auditor import FlaskAuditor
+from flask_auditor import attributes
+from flask_auditor.cli import main
+from flask_auditor.replay import Checkpoint
+from flask_auditor.replay import Replayer
+from flask_auditor.sinks import BaseSink
+from flask_auditor.sinks import HTTPSink
+from flask_auditor.sinks import SegmentedLogReader
+from flask_auditor.sinks import SegmentedLogSink
+from flask_auditor.sinks import SQLiteSink
+
+
+def make_log(i):
+    return {
+        attributes.ACTION_ID: 'GET_USER',
+        attributes.START_TIME: f'2024-05-22 10:{i % 60:02d}:00',
+        attributes.REQUEST: {attributes.REQUEST_ID: f'req-{i}'},
+    }
+
+
+def request_ids(logs):
+    return sorted(int(x[attributes.REQUEST][attributes.REQUEST_ID][4:])
+                  for x in logs)
+
+
+class MemorySink(BaseSink):
+    def __init__(self):
+        super().__init__()
+        self.logs = []
+
+    def write_batch(self, batch):
+        self.logs.extend(batch)
+
+
+def test_replay_sources(tmp_path):
+    path = tmp_path / 'logs.jsonl'
+    path.write_text(''.join(json.dumps(make_log(i)) + '\n'
+                            for i in range(10)))
+    spool = tmp_path / 'spool'
+    spool.mkdir()
+    (spool / 'spool-1.ndjson.gz').write_bytes(gzip.compress(b''.join(
+        json.dumps(make_log(i)).encode() + b'\n' for i in range(10, 15))))
+    sink = SegmentedLogSink(str(tmp_path / 'segments'),
+                            max_segment_bytes=500)
+    sink.write_many([make_log(i) for i in range(15, 25)])
+    sink.close()
+    sink = SQLiteSink(str(tmp_path / 'audit.db'))
+    # Duplicates of the JSON lines file, and one without a request ID.
+    sink.write_many([make_log(i) for i in range(5)] + [
+        {attributes.REQUEST: {attributes.REQUEST_ID: 'N/A'}}] * 2)
+    sink.close()
+
+    auditor = FlaskAuditor()
+    memory = MemorySink()
+    logs = []
+    auditor.register_log_handler(memory)
+    auditor.register_log_handler(logs.append)
+    replayer = Replayer(auditor.deliver, workers=3, batch_size=4)
+    stats = replayer.run([str(path), str(spool), str(tmp_path / 'segments'),
+                          str(tmp_path / 'audit.db')])
+
+    assert request_ids(x for x in memory.logs
+                       if x[attributes.REQUEST][attributes.REQUEST_ID]
+                       != 'N/A') == list(range(25))
+    assert len(memory.logs) == len(logs) == 27
+    assert not memory._threads
+    assert (stats.read, stats.delivered, stats.duplicates) == (32, 27, 5)
+    assert stats.rate > 0
+
+
+def test_replay_checkpoint(tmp_path):
+    path = tmp_path / 'logs.jsonl'
+    path.write_text(''.join(json.dumps(make_log(i)) + '\n'
+                            for i in range(20)) + 'invalid\n[1, 2]\n')
+    checkpoint = str(tmp_path / 'checkpoint.json')
+    delivered = []
+
+    def failing(batch):
+        if request_ids(batch)[0] == 8:
+            raise OSError('collector is down')
+        delivered.extend(batch)
+
+    stats = Replayer(failing, workers=1, batch_size=4,
+                     checkpoint=checkpoint).run([str(path)])
+    assert (stats.delivered, stats.failed, stats.invalid) == (16, 4, 2)
+    with open(checkpoint) as f:
+        assert list(json.load(f)['positions'].values()) == [8]
+
+    delivered.clear()
+    stats = Replayer(delivered.extend, batch_size=4,
+                     checkpoint=checkpoint).run([str(path)])
+    assert request_ids(delivered) == list(range(8, 20))
+    assert stats.failed == 0
+
+    delivered.clear()
+    Replayer(delivered.extend, checkpoint=checkpoint).run([str(path)])
+    assert delivered == []
+
+
+def test_replay_to_unreachable_collector(tmp_path):
+    path = tmp_path / 'logs.jsonl'
+    path.write_text(''.join(json.dumps(make_log(i)) + '\n'
+                            for i in range(5)))
+    checkpoint = str(tmp_path / 'checkpoint.json')
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+    sink = HTTPSink(f'http://127.0.0.1:{port}/logs', backoff_initial=0.01,
+                    sync_timeout=0.1, spool_dir=str(tmp_path / 'spool'))
+    auditor = FlaskAuditor()
+    auditor.register_log_handler(sink)
+
+    stats = Replayer(auditor.deliver, checkpoint=checkpoint).run([str(path)])
+    assert (stats.delivered, stats.failed) == (0, 5)
+    assert not sink._buffer
+    assert not os.listdir(tmp_path / 'spool')
+    assert not any(Checkpoint(checkpoint).positions.values())
+    sink.close()
+
+
+def test_replay_to_failing_async_handler(tmp_path):
+    path = tmp_path / 'logs.jsonl'
+    path.write_text(''.join(json.dumps(make_log(i)) + '\n'
+                            for i in range(5)))
+    checkpoint = str(tmp_path / 'checkpoint.json')
+    auditor = FlaskAuditor()
+
+    async def handler(audit_log):
+        raise OSError('collector is down')
+
+    auditor.register_log_handler(handler)
+    stats = Replayer(auditor.deliver, batch_size=2,
+                     checkpoint=checkpoint).run([str(path)])
+    assert (stats.delivered, stats.failed) == (0, 5)
+    assert not any(Checkpoint(checkpoint).positions.values())
+    auditor.shutdown()
+
+
+def test_replay_rate_limit(tmp_path):
+    path = tmp_path / 'logs.jsonl'
+    path.write_text(''.join(json.dumps(make_log(i)) + '\n'
+                            for i in range(20)))
+    started = time.monotonic()
+    stats = Replayer(lambda batch: None, batch_size=5, rate=100,
+                     dedupe=False).run([str(path)])
+    assert stats.delivered == 20
+    assert time.monotonic() - started >= 0.15
+
+
+def test_cli_replay(tmp_path, monkeypatch, capsys):
+    (tmp_path / 'replay_app.py').write_text(
+        'import os\n'
+        'from flask_auditor import FlaskAuditor\n'
+        'from flask_auditor.sinks import SegmentedLogSink\n'
+        'auditor = FlaskAuditor()\n'
+        'auditor.register_log_handler(\n'
+        '    SegmentedLogSink(os.environ["REPLAY_OUTPUT"]))\n')
+    monkeypatch.syspath_prepend(str(tmp_path))
+    monkeypatch.setenv('REPLAY_OUTPUT', str(tmp_path / 'output'))
+    path = tmp_path / 'logs.jsonl'
+    path.write_text(''.join(json.dumps(make_log(i)) + '\n'
+                            for i in range(30)))
+
+    assert main(['replay', str(path), '--auditor', 'replay_app',
+                 '--start', '2024-05-22T10:10:00']) == 0
+    assert capsys.readouterr().out.startswith('30 read, 20 delivered')
+    logs = SegmentedLogReader(str(tmp_path / 'output')).query(limit=100)
+    assert request_ids(logs) == list(range(10, 30))
@@ -80,3 +80,11 @@ def test_extract_request_log():
         assert (log_values[attributes.REQUEST_QUERY_PARAMS]
                 == {'client_id': ['makai']})
         assert log_values[attributes.REQUEST_BODY] == {'name': 'makai'}
+
+
+def test_get_query_params():
+    app = Flask(__name__)
+    logger = RequestLogger()
+    with app.test_request_context(query_string='a=1&a=2&b=&c=x+y') as ctx:
+        assert logger.get_query_params(ctx.request) == {
+            'a': ['1', '2'], 'c': ['x y']}
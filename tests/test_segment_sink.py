@@ -0,0 +1,175 @@
+import json
+import os
+import subprocess
+import sys
+import time
+from datetime import datetime
+
+import pytest
+
+from flask_auditor import attributes
+from flask_auditor.cli import main
+from flask_auditor.sinks import SegmentedLogReader
+from flask_auditor.sinks import SegmentedLogSink
+from flask_auditor.sinks.codecs import CODECS
+from flask_auditor.sinks.codecs import get_codec
+from flask_auditor.sinks.segment import compress_segment
+
+
+def make_log(action_id, minute, request_id, status_code=200):
+    return {
+        attributes.ACTION_ID: action_id,
+        attributes.START_TIME: f'2024-05-22 10:{minute:02d}:00',
+        attributes.REQUEST: {attributes.REQUEST_ID: request_id},
+        attributes.RESPONSE: {attributes.RESPONSE_STATUS_CODE: status_code},
+    }
+
+
+def write_logs(directory):
+    sink = SegmentedLogSink(str(directory), max_segment_bytes=2000,
+                            index_interval=4, flush_interval=0.01,
+                            batch_size=5)
+    for i in range(40):
+        action_id = 'CREATE_USER' if i % 4 == 0 else 'GET_USER'
+        sink(make_log(action_id, i, f'req-{i}', 201 if i % 4 == 0 else 200))
+        if i % 5 == 4:
+            sink.flush()
+
+    sink.close()
+    return sink
+
+
+def test_segmented_log_lookups(tmp_path):
+    write_logs(tmp_path)
+    reader = SegmentedLogReader(str(tmp_path))
+    segments = reader.segments()
+    assert len(segments) > 1
+    assert all(segment.closed for segment in segments)
+
+    logs = reader.query(request_id='req-17')
+    assert [x[attributes.REQUEST][attributes.REQUEST_ID] for x in logs] == [
+        'req-17']
+
+    logs = reader.query(action_id='CREATE_USER',
+                        start=datetime(2024, 5, 22, 10, 10),
+                        end=datetime(2024, 5, 22, 10, 30))
+    assert [x[attributes.REQUEST][attributes.REQUEST_ID] for x in logs] == [
+        'req-12', 'req-16', 'req-20', 'req-24', 'req-28']
+
+    logs = reader.query(start=datetime(2024, 5, 22, 10, 37), limit=10)
+    assert len(logs) == 3
+    assert len(reader.query(status_code=201, limit=100)) == 10
+    logs = reader.query(limit=2, offset=1, descending=True)
+    assert [x[attributes.REQUEST][attributes.REQUEST_ID] for x in logs] == [
+        'req-38', 'req-37']
+
+
+def test_segmented_log_reads_active_segment(tmp_path):
+    sink = SegmentedLogSink(str(tmp_path), flush_interval=0.01)
+    sink(make_log('GET_USER', 1, 'req-1'))
+    sink.flush()
+    assert not SegmentedLogReader(str(tmp_path)).segments()[0].closed
+    assert sink.query(request_id='req-1')[0][attributes.ACTION_ID] == (
+        'GET_USER')
+    sink.close()
+    assert SegmentedLogReader(str(tmp_path)).segments()[0].closed
+    assert len(os.listdir(tmp_path)) == 4
+
+
+def test_cli_query(tmp_path, capsys):
+    write_logs(tmp_path)
+    assert main(['query', str(tmp_path), '--action-id', 'CREATE_USER',
+                 '--start', '2024-05-22T10:30:00']) == 0
+    lines = capsys.readouterr().out.splitlines()
+    assert [json.loads(x)[attributes.REQUEST][attributes.REQUEST_ID]
+            for x in lines] == ['req-32', 'req-36']
+
+
+@pytest.mark.parametrize('codec', sorted(CODECS))
+def test_segmented_log_compression(tmp_path, codec):
+    plain = tmp_path / 'plain'
+    compressed = tmp_path / 'compressed'
+    sink = SegmentedLogSink(str(plain), compression=None,
+                            max_segment_bytes=2000, index_interval=4)
+    for i in range(40):
+        sink(make_log('GET_USER', i, f'req-{i}'))
+    sink.close()
+    assert not any(x.endswith(CODECS[codec].suffix)
+                   for x in os.listdir(plain))
+
+    sink = SegmentedLogSink(str(compressed), compression=codec,
+                            max_segment_bytes=2000, index_interval=4)
+    for i in range(40):
+        sink(make_log('GET_USER', i, f'req-{i}'))
+    sink.close()
+    names = os.listdir(compressed)
+    assert not any(x.endswith('.log') for x in names)
+    assert sink.compressor.segments == len(
+        [x for x in names if x.endswith(CODECS[codec].suffix)])
+    assert sink.compressor.ratio > 1
+
+    plain_reader = SegmentedLogReader(str(plain))
+    reader = SegmentedLogReader(str(compressed))
+    for filters in ({'request_id': 'req-17'},
+                    {'action_id': 'GET_USER', 'limit': 100},
+                    {'start': datetime(2024, 5, 22, 10, 13),
+                     'end': datetime(2024, 5, 22, 10, 29)}):
+        assert reader.query(**filters) == plain_reader.query(**filters)
+
+
+def test_segment_sink_compresses_segments_of_previous_runs(tmp_path):
+    sink = SegmentedLogSink(str(tmp_path), compression=None)
+    sink(make_log('GET_USER', 1, 'req-1'))
+    sink.close()
+
+    sink = SegmentedLogSink(str(tmp_path))
+    sink.compressor.flush()
+    segment, = SegmentedLogReader(str(tmp_path)).segments()
+    assert segment.path.endswith('.log.gz')
+    assert sink.query(request_id='req-1')[0][attributes.ACTION_ID] == (
+        'GET_USER')
+    sink.close()
+
+
+def test_compress_segment_takes_stale_claims_over(tmp_path):
+    sink = SegmentedLogSink(str(tmp_path), compression=None)
+    sink(make_log('GET_USER', 1, 'req-1'))
+    sink.close()
+    segment, = SegmentedLogReader(str(tmp_path)).segments()
+    base = segment.path[:-len('.log')]
+    claim = tmp_path / (os.path.basename(segment.path) + '.gz.tmp')
+
+    # Claimed by a compressor which is still running.
+    claim.write_bytes(b'partial')
+    assert compress_segment(base, get_codec('gzip')) is None
+
+    # Claimed by a compressor which crashed.
+    os.utime(claim, (time.time() - 3600, time.time() - 3600))
+    assert compress_segment(base, get_codec('gzip')) is not None
+    assert sorted(os.listdir(tmp_path)) == [
+        os.path.basename(base) + x for x in ('.cidx', '.kidx', '.log.gz',
+                                             '.tidx')]
+    assert SegmentedLogReader(str(tmp_path)).query(request_id='req-1')
+
+
+def test_segment_sink_recovers_segments_of_crashed_processes(tmp_path):
+    pid = subprocess.Popen([sys.executable, '-c', 'pass']).pid
+    os.waitpid(pid, 0)
+    crashed = tmp_path / f'segment-{time.time_ns():020d}-{pid}.log'
+    crashed.write_bytes(b''.join(
+        json.dumps(make_log('GET_USER', i, f'req-{i}')).encode() + b'\n'
+        for i in range(3)) + b'{"actionId": "GE')
+    running = tmp_path / f'segment-{time.time_ns():020d}-{os.getpid()}.log'
+    running.write_bytes(
+        json.dumps(make_log('GET_USER', 3, 'req-3')).encode() + b'\n')
+
+    sink = SegmentedLogSink(str(tmp_path), compression=None)
+    segments = {x.path: x for x in SegmentedLogReader(
+        str(tmp_path)).segments()}
+    assert segments[str(crashed)].closed
+    assert not segments[str(running)].closed
+    assert crashed.read_bytes().endswith(b'\n')
+    assert sink.query(request_id='req-1')[0][attributes.ACTION_ID] == (
+        'GET_USER')
+    assert len(sink.query(limit=100)) == 4
+    sink.close()
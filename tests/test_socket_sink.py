@@ -0,0 +1,103 @@
+import json
+import os
+import socket
+import time
+
+import pytest
+
+from flask_auditor import attributes
+from flask_auditor.sinks import SocketSink
+
+
+def test_socket_sink_ndjson_over_tcp(tcp_server_factory):
+    server = tcp_server_factory()
+    sink = SocketSink(server.address, batch_size=10, flush_interval=0.05)
+    for i in range(25):
+        sink({attributes.ACTION_ID: 'CREATE_USER', 'seq': i})
+
+    sink.flush()
+    assert server.wait_for(lambda srv: srv.data.count(b'\n') == 25)
+    records = [json.loads(line) for line in server.data.splitlines()]
+    assert sorted(r['seq'] for r in records) == list(range(25))
+    assert server.connections <= 2
+    sink.close()
+    server.close()
+
+
+def test_socket_sink_rfc5424_over_udp():
+    server = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    server.bind(('127.0.0.1', 0))
+    server.settimeout(5)
+    sink = SocketSink(server.getsockname(), transport='udp',
+                      framing='rfc5424', app_name='pytest',
+                      hostname='localhost', flush_interval=0.01)
+    sink({attributes.ACTION_ID: 'GET_USER', 'id': 1})
+    sink.flush()
+
+    msg = server.recv(65536).decode('utf-8')
+    header, payload = msg.split(' - ', 1)
+    assert header.startswith('<110>1 ')
+    assert header.split(' ')[2:4] == ['localhost', 'pytest']
+    assert header.endswith(' GET_USER')
+    assert json.loads(payload) == {attributes.ACTION_ID: 'GET_USER', 'id': 1}
+    sink.close()
+    server.close()
+
+
+def test_socket_sink_rfc5424_over_unix_stream(tmp_path):
+    path = str(tmp_path / 'relay.sock')
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(path)
+    server.listen()
+    server.settimeout(5)
+    sink = SocketSink(path, transport='unix', framing='rfc5424',
+                      flush_interval=0.01)
+    sink.write_many([{'seq': 1}, {'seq': 2}])
+
+    conn, _ = server.accept()
+    conn.settimeout(5)
+    data = b''
+    while data.count(b'"seq"') < 2:
+        data += conn.recv(65536)
+
+    # Messages over stream sockets are prefixed with their length.
+    messages = []
+    while data:
+        length, data = data.split(b' ', 1)
+        messages.append(data[:int(length)])
+        data = data[int(length):]
+    assert [json.loads(x[x.index(b'{'):]) for x in messages] == [
+        {'seq': 1}, {'seq': 2}]
+    sink.close()
+    conn.close()
+    server.close()
+    os.remove(path)
+
+
+def test_socket_sink_reconnects(tcp_server_factory):
+    server = tcp_server_factory(max_reads_per_conn=1)
+    sink = SocketSink(server.address, pool_size=1, flush_interval=0.01,
+                      backoff_initial=0.01)
+    sink({'seq': 1})
+    sink.flush()
+    assert server.wait_for(lambda srv: srv.closed_connections == 1)
+
+    # The server closed the first connection after reading from it.
+    sink({'seq': 2})
+    sink.flush()
+    assert server.wait_for(lambda srv: srv.data.count(b'\n') == 2)
+    assert server.connections == 2
+    sink.close()
+    server.close()
+
+
+def test_socket_sink_direct_write_fails_fast(tcp_server_factory):
+    server = tcp_server_factory()
+    address = server.address
+    server.close()
+    sink = SocketSink(address, backoff_initial=0.2, sync_timeout=0.5)
+    started = time.monotonic()
+    with pytest.raises(OSError):
+        sink.write({'seq': 1})
+    assert time.monotonic() - started < 2
+    sink.close()
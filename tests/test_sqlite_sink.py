@@ -0,0 +1,84 @@
+import threading
+import time
+from datetime import datetime
+
+import pytest
+
+from flask_auditor import attributes
+from flask_auditor.sinks import SQLiteSink
+
+
+def make_log(action_id, start_time, request_id, status_code):
+    return {
+        attributes.ACTION_ID: action_id,
+        attributes.START_TIME: start_time,
+        attributes.REQUEST: {
+            attributes.REQUEST_ID: request_id,
+            attributes.REQUEST_REMOTE_IP: '127.0.0.1',
+            attributes.REQUEST_ROUTE_PATH: '/api/v1/users',
+        },
+        attributes.RESPONSE: {attributes.RESPONSE_STATUS_CODE: status_code},
+    }
+
+
+def test_sqlite_sink_query(tmp_path):
+    sink = SQLiteSink(str(tmp_path / 'audit.db'), flush_interval=0.01)
+    sink(make_log('CREATE_USER', '2024-05-22 10:00:00', 'r1', 201))
+    sink(make_log('CREATE_USER', '2024-05-22 11:00:00', 'r2', 400))
+    sink(make_log('GET_USER', '2024-05-22 12:00:00', 'r3', 200))
+    sink.flush()
+
+    logs = sink.query(action_id='CREATE_USER')
+    assert [x[attributes.REQUEST][attributes.REQUEST_ID] for x in logs] == [
+        'r1', 'r2']
+    assert sink.query(request_id='r3')[0][attributes.ACTION_ID] == 'GET_USER'
+    assert len(sink.query(status_code=400)) == 1
+    logs = sink.query(start=datetime(2024, 5, 22, 10, 30),
+                      end=datetime(2024, 5, 22, 12))
+    assert [x[attributes.ACTION_ID] for x in logs] == ['CREATE_USER']
+    logs = sink.query(limit=1, offset=1, descending=True)
+    assert logs[0][attributes.REQUEST][attributes.REQUEST_ID] == 'r2'
+    sink.close()
+
+
+def test_flask_auditor_query_logs(extension_factory, tmp_path):
+    app, auditor = extension_factory()
+    with pytest.raises(RuntimeError):
+        auditor.query_logs()
+
+    sink = SQLiteSink(str(tmp_path / 'audit.db'), flush_interval=0.01)
+    auditor.register_log_handler(sink)
+    with app.test_client() as client:
+        client.get('/api/v1/users/1', headers={'X-Request-Id': 'abc'})
+
+    for _ in range(100):
+        sink.flush()
+        logs = auditor.query_logs(request_id='abc')
+        if logs:
+            break
+        time.sleep(0.01)
+
+    assert logs[0][attributes.ACTION_ID] == 'GET_USER'
+    assert logs[0][attributes.RESPONSE][attributes.RESPONSE_STATUS_CODE] == 200
+    sink.close()
+
+
+def test_sqlite_sink_bounds_idle_connections(tmp_path):
+    sink = SQLiteSink(str(tmp_path / 'audit.db'), pool_size=2)
+    barrier = threading.Barrier(20)
+
+    def run(i):
+        barrier.wait()
+        sink.write(make_log('GET_USER', '2024-05-22 10:00:00', f'r{i}', 200))
+        sink.query(request_id=f'r{i}')
+
+    threads = [threading.Thread(target=run, args=(i,)) for i in range(20)]
+    for thr in threads:
+        thr.start()
+    for thr in threads:
+        thr.join()
+
+    assert len(sink.query(limit=50)) == 20
+    assert sink._pool._idle.qsize() <= 2
+    sink.close()
+    assert sink._pool._idle.qsize() == 0